@@ -0,0 +1,323 @@
+"""
+Times the hot paths of the bot against a generated SQLite database, without connecting to Discord.
+
+    python benchmark.py --output results.json
+    python benchmark.py --baseline results.json --threshold 0.2
+
+The database is filled by `dataset.generate` in a temporary file, and the bot is a real `CustomClient` that never
+logs in, its channels and interactions are stand ins that only record what would have been sent. Every benchmark
+runs `--warmup` untimed rounds and then `--iterations` timed ones, and its min, median, p95 and mean are written as
+JSON, together with the dataset and the interpreter they were measured on, so runs on the same machine compare.
+
+The render pipeline is measured end to end against `fakediscord.FakeDiscord`: dossiers and statistics are created
+for `--pipeline-players` players, then all of them are changed in one commit, and the throughput of both rounds,
+the staleness of every statistics message (from the commit to its edit on the fake) and the retries caused by
+`--failure-rate` are reported as `render_pipeline`. The `refresh_page` benchmarks also report how many statements
+a page of unit messages ran, from the statement accounting of `metrics.registry`.
+
+Passing `--baseline` compares the medians against an earlier result file and exits with status 1 when any of them
+got slower by more than `--threshold`. A benchmark that can't run here, like `create_xls` without pandas, is
+reported as skipped with the reason instead of failing the run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from logging import getLogger, basicConfig, WARNING
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable
+import sqlalchemy
+from sqlalchemy import func, case
+from sqlalchemy.orm import sessionmaker
+from database import create_db_engine
+import dataset
+import migrations
+import refreshjob
+from fakediscord import FakeDiscord
+from metrics import registry
+from models import Player, Unit, Medals, Campaign, ShopUpgrade, RenderOutbox, Statistic
+from ratelimit import RatePacer
+from renderqueue import RenderTask, CREATE, TERMINATE
+from utils import RollingCounter
+
+logger = getLogger(__name__)
+
+class Benchmarks:
+    """
+    Runs the benchmarks and collects their timings.
+
+    Attributes:
+        iterations (int): How many timed rounds every benchmark runs.
+        warmup (int): How many untimed rounds run before those.
+        results (dict[str, dict[str, Any]]): The timings of every benchmark by name, or why it was skipped or failed.
+    """
+    def __init__(self, iterations: int, warmup: int):
+        if iterations <= 0:
+            raise ValueError("Iterations must be greater than 0.")
+        self.iterations = iterations
+        self.warmup = warmup
+        self.results: dict[str, dict[str, Any]] = {}
+
+    async def measure(self, name: str, round: Callable[[], Awaitable[Any]]):
+        timings = []
+        try:
+            for _ in range(self.warmup):
+                await round()
+            for _ in range(self.iterations):
+                started = time.perf_counter()
+                await round()
+                timings.append(time.perf_counter() - started)
+        except Exception as e:
+            # a broken path is reported, but doesn't stop the others from being measured
+            self.results[name] = {"error": f"{type(e).__name__}: {e}".splitlines()[0]}
+            logger.error(f"{name} failed: {self.results[name]['error']}")
+            return
+        self.record(name, timings)
+
+    def record(self, name: str, timings: list[float], **extra):
+        timings = sorted(timings)
+        self.results[name] = {"runs": len(timings), "min": timings[0], "median": statistics.median(timings),
+                              "p95": timings[min(len(timings) - 1, int(0.95 * len(timings)))], "mean": statistics.fmean(timings), **extra}
+        logger.info(f"{name}: median {self.results[name]['median'] * 1000:.3f}ms over {len(timings)} runs")
+
+    def skip(self, name: str, reason: str):
+        self.results[name] = {"skipped": reason}
+        logger.warning(f"Skipping {name}: {reason}")
+
+class Stub(SimpleNamespace):
+    """
+    Stands in for a Discord object, any coroutine method called on it is awaited and does nothing.
+    """
+    def __getattr__(self, name: str):
+        async def noop(*args, **kwargs):
+            return None
+        return noop
+
+def make_interaction(user_id: int) -> Stub:
+    return Stub(user=Stub(id=user_id, name="benchmark", global_name="benchmark", roles=[]),
+                guild=Stub(get_role=lambda role_id: None), response=Stub(), followup=Stub())
+
+async def drained(bot, Session):
+    """
+    Waits until the render pipeline has nothing left to do, in the outbox, the queue, the workers or the retries.
+    """
+    while True:
+        await asyncio.sleep(0.05)
+        with Session() as session:
+            pending = session.query(RenderOutbox).count()
+        if not pending and not bot.queue.qsize() and not len(bot.retries) and all(stats["current"] is None for stats in bot.worker_stats):
+            return
+
+async def pipeline(benchmarks: Benchmarks, bot, Session, players: int, fake: FakeDiscord):
+    bot.pacer = RatePacer(default_limit=fake.limit, default_period=fake.period)
+    fake.install(bot)
+    bot.config.update(dossier_channel_id=fake.add_channel(1).id, statistics_channel_id=fake.add_channel(2).id)
+    with Session() as session:
+        player_ids = [player_id for player_id, in session.query(Player.id).order_by(Player.id).limit(players)]
+    registry.reset()
+    running = [asyncio.create_task(bot.outbox_pump()), asyncio.create_task(bot.retries.run())]
+    consumer = asyncio.create_task(bot.queue_consumer())
+
+    started = time.monotonic()
+    for player_id in player_ids:
+        bot.offer(RenderTask.for_player(CREATE, player_id))
+    await drained(bot, Session)
+    created = len(player_ids) / (time.monotonic() - started)
+
+    with Session() as session:
+        for player in session.query(Player).filter(Player.id.in_(player_ids)):
+            player.rec_points += 1
+        session.commit()
+        committed = time.monotonic()
+        await drained(bot, Session)
+        updated = len(player_ids) / (time.monotonic() - committed)
+        messages = [int(message_id) for message_id, in session.query(Statistic.message_id).filter(Statistic.player_id.in_(player_ids))]
+
+    bot.queue.put_nowait(RenderTask(TERMINATE))
+    await consumer
+    for task in running:
+        task.cancel()
+    staleness = [fake.written[message_id] - committed for message_id in messages if fake.written.get(message_id, 0) >= committed]
+    if not staleness:
+        benchmarks.skip("render_pipeline", "no statistics message was edited after the commit")
+        return
+    benchmarks.record("render_pipeline", staleness, created_per_second=created, updated_per_second=updated,
+                      stale=len(messages) - len(staleness), retried=sum(registry.counter("retried", label) for label in registry.labels()),
+                      dead_lettered=sum(registry.counter("dead_lettered", label) for label in registry.labels()), **fake.stats())
+
+async def run(benchmarks: Benchmarks, engine, rng: random.Random, fake: FakeDiscord, pipeline_players: int):
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    # the extensions take the sessionmaker of the client at import, so it has to exist first
+    from customclient import CustomClient
+    bot = CustomClient(session, sessionmaker=Session)
+    bot.medal_emotes.update({name: f"<:medal{i}:{10 ** 17 + i}>" for i, name in enumerate(dataset.MEDALS[::2])})
+
+    counts = session.query(Unit.player_id, func.count(Unit.id)).group_by(Unit.player_id).order_by(func.count(Unit.id)).all()
+    typical = session.get(Player, counts[len(counts) // 2][0])
+    heaviest = session.get(Player, counts[-1][0])
+
+    await benchmarks.measure("generate_unit_message.typical", lambda: bot.generate_unit_message(typical, session=session))
+    await benchmarks.measure("generate_unit_message.heaviest", lambda: bot.generate_unit_message(heaviest, session=session))
+
+    # a page of the refresh job rendered the way the job does it, against a query per player, with the statements each ran
+    page = [player_id for player_id, in session.query(Player.id).order_by(Player.id).limit(refreshjob.PAGE_SIZE)]
+    async def refresh_page_batched():
+        with registry.account("refresh_page.batched"):
+            bot.generate_unit_messages(page, session)
+    async def refresh_page_per_player():
+        with registry.account("refresh_page.per_player"):
+            for player_id in page:
+                bot.generate_unit_messages([player_id], session)
+    for name, round in (("refresh_page.batched", refresh_page_batched), ("refresh_page.per_player", refresh_page_per_player)):
+        await benchmarks.measure(name, round)
+        if "error" not in benchmarks.results[name]:
+            benchmarks.results[name]["statements"] = registry.commands[name].average
+            logger.info(f"{name}: {registry.commands[name].average:.0f} statements for {len(page)} players")
+
+    decorated = session.query(Medals.player_id).group_by(Medals.player_id).order_by(func.count(Medals.id).desc()).first()[0]
+    async def medal_block():
+        bot.medal_block(session.query(Medals).filter(Medals.player_id == decorated).all())
+    await benchmarks.measure("dossier.medal_block", medal_block)
+
+    # the index is measured warm, with a few players changed before every search, against the query it falls back to
+    from searchindex import SearchIndex
+    search_index, fallback = SearchIndex(), SearchIndex(enabled=False)
+    search_index.load(session)
+    player_ids = [player_id for player_id, _ in counts]
+    async def search(engine: SearchIndex):
+        engine.invalidate(rng.sample(player_ids, min(5, len(player_ids))))
+        engine.search(session, rng.choice(dataset.AREAS), rng.choice(dataset.UNIT_TYPES))
+    await benchmarks.measure("search.index", lambda: search(search_index))
+    await benchmarks.measure("search.database", lambda: search(fallback))
+
+    from extensions.shop import compatible
+    async def shop():
+        # a session of its own, so the upgrades and their unit types are loaded every round like in the shop
+        with Session() as shop_session:
+            upgrades = shop_session.query(ShopUpgrade).order_by(case((ShopUpgrade.type == "REFIT", 0), else_=1)).all()
+            compatible(upgrades, rng.choice(dataset.UNIT_TYPES))
+    await benchmarks.measure("shop.compatible", shop)
+
+    from extensions.campaigns import Campaigns
+    campaign = session.query(Campaign).join(Unit).group_by(Campaign.id).order_by(func.count(Unit.id).desc()).first()
+    if campaign is None:
+        benchmarks.skip("campaigns.payout", "the dataset has no units in a campaign")
+    else:
+        gm = 10 ** 17
+        campaign.gm = str(gm)
+        session.commit()
+        cog = Campaigns(bot)
+        interaction = make_interaction(gm)
+        await benchmarks.measure("campaigns.payout", lambda: Campaigns.payout.callback(cog, interaction, campaign=campaign.name, base=1, survivor=1))
+
+    try:
+        from extensions.backup import Backup
+    except ImportError as e:
+        benchmarks.skip("backup.create_xls", f"{e}")
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            async def create_xls():
+                with Session() as backup_session:
+                    Backup._write_xls(backup_session, os.path.join(directory, "backup.xlsx"))
+            await benchmarks.measure("backup.create_xls", create_xls)
+
+    # the counter keeps a task per increment until it expires, so time both the increments and the expiry of a burst
+    async def rolling_counter_set():
+        counter = RollingCounter(1)
+        for _ in range(10000):
+            counter.set()
+        for task in counter.tasks:
+            task.cancel()
+        await asyncio.gather(*counter.tasks, return_exceptions=True) # don't leave the cancellations to the next round
+    await benchmarks.measure("rolling_counter.set_10k", rolling_counter_set)
+
+    async def rolling_counter_drain():
+        counter = RollingCounter(0.01)
+        for _ in range(10000):
+            counter.set()
+        while counter.get():
+            await asyncio.sleep(0.001)
+    await benchmarks.measure("rolling_counter.drain_10k", rolling_counter_drain)
+
+    if pipeline_players:
+        bot.retries.base, bot.retries.cap = 0.05, 0.5 # the fake fails for a moment, not for minutes like an outage
+        await pipeline(benchmarks, bot, Session, pipeline_players, fake)
+
+    await bot.resync_config()
+    session.close()
+
+def compare(results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]], threshold: float) -> list[str]:
+    """
+    Lists the benchmarks whose median got slower than the baseline by more than `threshold`, as a fraction.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if "median" not in result or not before or "median" not in before or before["median"] <= 0:
+            continue
+        change = result["median"] / before["median"] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {before['median'] * 1000:.3f}ms -> {result['median'] * 1000:.3f}ms (+{change:.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the hot paths of the bot on a generated SQLite database")
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--units", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--pipeline-players", type=int, default=200, help="players rendered end to end, 0 to leave the pipeline out")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds every request to the fake Discord takes")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="the chance a request to the fake Discord fails")
+    parser.add_argument("--output", help="write the results to this file, they are printed otherwise")
+    parser.add_argument("--baseline", help="an earlier result file to check the medians against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="how much slower than the baseline a median may get, 0.2 is 20%%")
+    args = parser.parse_args()
+    basicConfig(level=WARNING)
+    logger.setLevel("INFO")
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_db_engine(f"sqlite:///{os.path.join(directory, 'benchmark.db')}")
+        migrations.upgrade(engine)
+        with engine.begin() as connection:
+            counts = dataset.generate(connection, args.players, args.units, upgrades=2.0, medals=1.5, campaigns=20,
+                                      shop_upgrades=50, skew=3.0, rng=random.Random(args.seed))
+        benchmarks = Benchmarks(args.iterations, args.warmup)
+        fake = FakeDiscord(latency=args.latency, failure_rate=args.failure_rate, seed=args.seed)
+        asyncio.run(run(benchmarks, engine, random.Random(args.seed), fake, args.pipeline_players))
+        engine.dispose()
+
+    report = {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+                       "platform": platform.platform(), "sqlalchemy": sqlalchemy.__version__, "seed": args.seed,
+                       "iterations": args.iterations, "dataset": counts,
+                       "pipeline": {"players": args.pipeline_players, "latency": args.latency, "failure_rate": args.failure_rate}},
+              "results": benchmarks.results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["meta"].get("dataset") != counts:
+            logger.warning("The baseline was measured on a different dataset, the comparison may not mean much")
+        if regressions := compare(benchmarks.results, baseline["results"], args.threshold):
+            for regression in regressions:
+                logger.error(f"Regression in {regression}")
+            sys.exit(1)
+        logger.info(f"No benchmark got more than {args.threshold:.0%} slower than {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+ConfigStore holds a namespace of the bot configuration (`BOT_CONFIG`, `MEDAL_EMOTES`), one JSON encoded ConfigEntry row
+per key.
+
+Reads are served from an in-memory cache of decoded values, so they never touch the database. Writes go to the cache
+straight away, bump the store's version, and mark the key dirty. The dirty keys are written behind, together, a short
+while after the first of them (`CONFIG_WRITE_DELAY`), and at close. Only the keys that changed are written, instead
+of re-pickling the whole dict. They are always written in a session of the store's own, committed on its own, so a
+flush never commits or rolls back the work of whoever triggered it, and the delayed write runs on a thread so it
+doesn't block the event loop.
+
+A value changed in place (`config["unit_types"].add(name)`) can't be seen by the store, so read-modify-write goes
+through `mutate`, which runs under the store's lock and always marks the key dirty.
+
+The first load of a namespace that has no entries yet imports the old pickled Config row of the same key, which is
+left in place.
+"""
+
+import asyncio
+import json
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import Executor
+from logging import getLogger
+from typing import Any, Callable, Iterator
+from sqlalchemy.orm import Session
+from models import Config, ConfigEntry
+
+logger = getLogger(__name__)
+
+def _tag(value: Any) -> Any:
+    # JSON has no sets, and unit_types is one
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": sorted(value, key=str)}
+    raise TypeError(f"Can't store {type(value).__name__} values in the config")
+
+def _untag(obj: dict) -> Any:
+    if len(obj) == 1 and "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+def encode(value: Any) -> str:
+    return json.dumps(value, default=_tag)
+
+def decode(text: str) -> Any:
+    return json.loads(text, object_hook=_untag)
+
+class ConfigStore(MutableMapping):
+    """
+    A dict of configuration values, cached in memory and written behind to the ConfigEntry table.
+
+    Attributes:
+        namespace (str): The namespace of the entries, the key of the Config row it replaces.
+        delay (float): How many seconds after a write the dirty keys are written to the database.
+        executor (Executor | None): Runs the delayed writes, the loop's default executor if None.
+        version (int): Goes up by one with every write, and is stored with each entry it writes.
+    """
+    def __init__(self, sessionmaker: Callable[[], Session], namespace: str, defaults: dict[str, Any] | None = None, delay: float = 2.0, executor: Executor | None = None):
+        self.sessionmaker = sessionmaker
+        self.namespace = namespace
+        self.delay = delay
+        self.executor = executor
+        self.version = 0
+        self._values: dict[str, Any] = dict(defaults or {})
+        self._dirty: set[str] = set(self._values)
+        self._deleted: set[str] = set()
+        self._lock = threading.RLock() # the offloaded database threads may write too
+        self._write_lock = threading.Lock() # one flush at a time, so an older snapshot can't overwrite a newer one
+        self._flush_task: asyncio.Task | None = None
+
+    def load(self, session: Session):
+        """
+        Reads every entry of the namespace, importing the pickled Config row if there are none yet.
+        """
+        entries = session.query(ConfigEntry).filter(ConfigEntry.namespace == self.namespace).all()
+        with self._lock:
+            if entries:
+                for entry in entries:
+                    self._values[entry.key] = decode(entry.value)
+                    self._dirty.discard(entry.key)
+                self.version = max(entry.version or 0 for entry in entries)
+            else:
+                legacy = session.query(Config).filter(Config.key == self.namespace).first()
+                if legacy and legacy.value:
+                    logger.info(f"Importing {len(legacy.value)} {self.namespace} keys from the pickled config")
+                    self._values.update(legacy.value)
+                    self._dirty.update(legacy.value)
+        self.flush()
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values[key]
+
+    def __setitem__(self, key: str, value: Any):
+        encode(value) # refuse what can't be stored now, rather than when it is written
+        with self._lock:
+            self._values[key] = value
+            self._deleted.discard(key)
+            self._dirty.add(key)
+            self.version += 1
+        self._schedule()
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            del self._values[key]
+            self._dirty.discard(key)
+            self._deleted.add(key)
+            self.version += 1
+        self._schedule()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._values))
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def mutate(self, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        """
+        Replaces the value of `key` with `fn(value)`, `fn(default)` if it isn't set, as one atomic write.
+        """
+        with self._lock:
+            value = fn(self._values.get(key, default))
+            self[key] = value
+            return value
+
+    def _schedule(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return # a flush is already waiting, it will pick this write up too
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # no loop yet, the write goes out with the next flush
+        self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        try:
+            await self.flush_async()
+        except Exception as e:
+            logger.error(f"Error writing the {self.namespace} config: {e}")
+
+    async def flush_async(self):
+        """
+        `flush` on a thread of `executor`, for callers on the event loop.
+        """
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.flush)
+
+    def flush(self):
+        """
+        Writes the dirty keys now, in a session of the store's own. A failed write leaves them dirty.
+        """
+        with self._write_lock:
+            with self._lock:
+                written = {key: encode(self._values[key]) for key in self._dirty}
+                deleted = set(self._deleted)
+                version = self.version
+                self._dirty.clear()
+                self._deleted.clear()
+            if not written and not deleted:
+                return
+            with self.sessionmaker() as session:
+                try:
+                    keys = set(written) | deleted
+                    entries = {entry.key: entry for entry in session.query(ConfigEntry).filter(ConfigEntry.namespace == self.namespace, ConfigEntry.key.in_(keys))}
+                    for key, value in written.items():
+                        if key in entries:
+                            entries[key].value = value
+                            entries[key].version = version
+                        else:
+                            session.add(ConfigEntry(namespace=self.namespace, key=key, value=value, version=version))
+                    for key in deleted:
+                        if key in entries:
+                            session.delete(entries[key])
+                    session.commit()
+                    logger.debug(f"Wrote {len(written)} and deleted {len(deleted)} {self.namespace} keys at version {version}")
+                except Exception:
+                    session.rollback()
+                    with self._lock:
+                        # put them back, unless they were written again since
+                        self._dirty.update(key for key in written if key in self._values)
+                        self._deleted.update(key for key in deleted if key not in self._values)
+                    raise
@@ -3,7 +3,7 @@ CustomClient is a specialized subclass of `discord.ext.commands.Bot` to facilita
 
 *Features*:
     - Integrates with SQLAlchemy for database operations.
-    - Uses an asynchronous task queue for handling various player and unit-related tasks.
+    - Uses a coalescing asynchronous task queue for handling various player and unit-related tasks.
     - Periodically keeps the database session alive.
     - Manages bot commands and extensions.
     - Syncs slash commands with Discord's command tree.
@@ -16,20 +16,29 @@ Modules:
     - `logging`: Logging utilities for debugging and information.
 """
 
-from discord import Interaction, Intents, Status, Activity, ActivityType, Member
+from discord import Interaction, Intents, Status, Activity, ActivityType, Member, NotFound, Forbidden, HTTPException, Object
 from discord.ext.commands import Bot
 from discord.ext import tasks
+from discord import utils as discord_utils
 from os import getenv
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, lazyload
 from models import *
-from sqlalchemy import text
-from datetime import datetime
-from typing import Any, Callable
+from sqlalchemy import event
+from datetime import datetime, timedelta
+from typing import Callable, Hashable
 from singleton import Singleton
 import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 import templates
 import logging
-from utils import uses_db, RollingCounterDict, callback_listener
+from utils import uses_db, callback_listener, AwaitableSessionmaker
+from renderqueue import ShardedRenderQueue, RetryScheduler, RenderTask, CREATE, UPDATE, DELETE, TERMINATE, BULK, DEFERRED, KIND_NAMES
+from ratelimit import RatePacer, channel_route
+from mentions import MentionResolver
+from refreshjob import RefreshJob
+from configstore import ConfigStore
+from metrics import registry, task_label
 
 use_ephemeral = getenv("EPHEMERAL", "false").lower() == "true"
 
@@ -46,22 +55,38 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         - `mod_roles`: (Set[str]) Roles with moderator privileges.
         - `session`: (Session) Database session for executing SQL queries.
         - `use_ephemeral`: (bool) Controls whether to send messages as ephemeral.
-        - `config`: (dict) Bot configuration loaded from the database.
+        - `config`: (ConfigStore) Bot configuration, cached in memory and written behind to the database.
+        - `medal_emotes`: (ConfigStore) The emotes of each medal, stored like `config`.
+        - `jobs`: (ConfigStore) The state of long running jobs, like `RefreshJob`, so they resume after a restart.
         - `uses_db`: (Callable) A decorator for database operations.
+        - `async_sessionmaker`: (async_sessionmaker | AwaitableSessionmaker) Sessions for code moved to the async engine, these wrap the synchronous engine while `DB_ASYNC` is off. The render workers and their handlers haven't moved, see `render_worker`.
+        - `db_executor`: (ThreadPoolExecutor | None) The threads `async_sessionmaker` sessions offload their queries to, when `DB_OFFLOAD` is on.
+        - `pacer`: (RatePacer) Paces the queue consumer using Discord's rate limit headers.
+        - `queue`: (ShardedRenderQueue) Pending render tasks, sharded by player over the render workers, in an interactive and a bulk lane.
+        - `worker_stats`: (list[dict]) Processed and failed task counts, restarts, and the current task, per render worker.
+        - `outbox_event`: (asyncio.Event) Set when a commit has recorded rows in the RenderOutbox.
+        - `edits_avoided`: (int) How many message edits were skipped because the render was unchanged.
+        - `mentions`: (MentionResolver) Builds mentions from stored discord ids, and caches users fetched from Discord.
+        - `refresh_job`: (asyncio.Task | None) The running `RefreshJob`, if there is one.
+        - `prerendered`: (dict[int, str | None]) Unit messages `RefreshJob` rendered for a page of players at once, by player id, None while the page is being rendered. A commit changing a player drops their entry.
+        - `retries`: (RetryScheduler) Failed render tasks waiting out their backoff before they are queued again.
+        - `retry_limit`: (int) How many times a render task may fail before it is moved to the dead letters.
     """
     mod_roles = {1308924912936685609, 1302095620231794698}
     gm_role = 1308925031069388870
     session: Session
     use_ephemeral: bool
-    config: dict
+    config: ConfigStore
     sessionmaker: Callable
     start_time: datetime
-    def __init__(self, session: Session,/, sessionmaker: Callable, **kwargs):
+    def __init__(self, session: Session,/, sessionmaker: Callable, async_sessionmaker: Callable | None = None, **kwargs):
         """
         Initializes the CustomClient instance.
 
         Args:
             session (Session): The SQLAlchemy session for database operations.
+            sessionmaker (Callable): Makes sessions on the synchronous engine.
+            async_sessionmaker (Callable | None): Makes sessions on the async engine, if it is enabled.
             **kwargs: Additional keyword arguments for the Bot constructor.
 
         Merges the `DEFAULTS` with provided `kwargs`, loads configurations, and initializes
@@ -69,24 +94,37 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         """
         defintents = Intents.default()
         defintents.members = True
-        DEFAULTS = {"command_prefix":"\0", "intents":defintents}
+        self.pacer = RatePacer()
+        DEFAULTS = {"command_prefix":"\0", "intents":defintents, "http_trace":registry.instrument_trace(self.pacer.trace_config())}
         kwargs = {**DEFAULTS, **kwargs} # merge DEFAULTS and kwargs, kwargs takes precedence
         super().__init__(**kwargs)
         self.owner_ids = {533009808501112881, 126747253342863360}
         self.sessionmaker = sessionmaker
-        self.queue = asyncio.Queue()
-        _Config = session.query(Config).filter(Config.key == "BOT_CONFIG").first()
-        if not _Config:
-            _Config = Config(key="BOT_CONFIG", value={"EXTENSIONS":[]})
-            session.add(_Config)
-            session.commit()
-        self.config:dict = _Config.value
-        _Medal_Emotes = session.query(Config).filter(Config.key == "MEDAL_EMOTES").first()
-        if not _Medal_Emotes:
-            _Medal_Emotes = Config(key="MEDAL_EMOTES", value={})
-            session.add(_Medal_Emotes)
-            session.commit()
-        self.medal_emotes:dict = _Medal_Emotes.value
+        # one thread per pooled connection, the overflow is left to the sessions still running on the event loop
+        self.db_executor = ThreadPoolExecutor(max_workers=int(getenv("DB_OFFLOAD_THREADS", getenv("DB_POOL_SIZE", 10))), thread_name_prefix="db") if getenv("DB_OFFLOAD", "false").lower() == "true" else None
+        self.async_sessionmaker = async_sessionmaker or AwaitableSessionmaker(sessionmaker, self.db_executor)
+        self.queue = ShardedRenderQueue(int(getenv("RENDER_WORKERS", 4)), bulk_every=int(getenv("RENDER_BULK_EVERY", 4)), maxsize=int(getenv("RENDER_QUEUE_SIZE", 400)))
+        self.retries = RetryScheduler(self.queue, base=float(getenv("RETRY_BASE", 2)), cap=float(getenv("RETRY_CAP", 300)))
+        self.retry_limit = int(getenv("RETRY_LIMIT", 5))
+        self.worker_stats = [{"processed": 0, "failed": 0, "restarts": 0, "current": None} for _ in range(len(self.queue))]
+        self.outbox_event = asyncio.Event()
+        self.edits_avoided = 0
+        self.refresh_job: asyncio.Task | None = None
+        self.prerendered: dict[int, str | None] = {}
+        self.mentions = MentionResolver(self, maxsize=int(getenv("MENTION_CACHE_SIZE", 1024)), ttl=float(getenv("MENTION_CACHE_TTL", 3600)))
+        self._outbox_loop: asyncio.AbstractEventLoop | None = None
+        self._outbox_starved = False
+        self._outbox_queued: set[int] = set() # ids of the outbox rows the pump has handed out and the workers haven't settled yet
+        event.listen(Session, "after_commit", self._outbox_committed)
+        subscribe_changes(self._players_committed)
+        registry.instrument_engine()
+        config_delay = float(getenv("CONFIG_WRITE_DELAY", 2))
+        self.config = ConfigStore(sessionmaker, "BOT_CONFIG", defaults={"EXTENSIONS":[]}, delay=config_delay, executor=self.db_executor)
+        self.config.load(session)
+        self.medal_emotes = ConfigStore(sessionmaker, "MEDAL_EMOTES", delay=config_delay, executor=self.db_executor)
+        self.medal_emotes.load(session)
+        self.jobs = ConfigStore(sessionmaker, "JOBS", delay=config_delay, executor=self.db_executor)
+        self.jobs.load(session)
         self.use_ephemeral = use_ephemeral
         self.tree.interaction_check = self.check_banned_interaction
 
@@ -105,22 +143,21 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         logger.debug(f"Interaction check passed for user {interaction.user.global_name}")
         return True
 
-    async def resync_config(self, session: Session):
+    async def resync_config(self):
         """
-        Synchronizes the bot configuration with the database.
-
-        Fetches and updates the in-memory configuration, ensuring the bot is synchronized with the database.
+        Writes the configuration changes that are still waiting to be written behind, now, each store in a session of its own.
 
         Raises:
             SQLAlchemyError: If a database operation fails.
         """
-        _Config = session.query(Config).filter(Config.key == "BOT_CONFIG").first()
-        _Config.value = self.config
-        logger.debug(f"Resynced config: {self.config}")
+        await self.config.flush_async()
+        await self.medal_emotes.flush_async()
+        await self.jobs.flush_async()
+        logger.debug(f"Resynced config at version {self.config.version}")
 
-    async def queue_consumer(self, session: Session):
+    async def queue_consumer(self):
         """
-        Consumes tasks from the queue for processing player and unit actions.
+        Starts one render worker per queue shard, and watches the queue while they run.
 
         *Task Types*:
             - **0**: Creation tasks.
@@ -128,200 +165,387 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
             - **2**: Deletion tasks.
             - **4**: Graceful termination of the queue consumer.
 
-        This method runs indefinitely, processing tasks from the queue and managing associated database
-        operations, while updating channels as necessary.
+        The queue is a `ShardedRenderQueue`, so every task owned by a player (including Unit and PlayerUpgrade changes)
+        arrives already merged into a single task for that player, always on the same shard, and is rendered as that player.
+        The number of workers is set with the `RENDER_WORKERS` environment variable, and `RENDER_BULK_EVERY` sets after how
+        many interactive tasks in a row a waiting bulk task is let through.
 
-        Raises:
-            Exception: If task processing encounters an error.
+        A worker that crashes is restarted on the same shard, a worker that received a termination task is not.
+
+        When the queue fills up (`RENDER_QUEUE_SIZE`), new work waits in the RenderOutbox until it drains again, see
+        `offer`. The bot owner is sent a single alert when that happens, which is re-armed once the queue is back
+        under its low water mark.
         """
-        logger.info("queue consumer started")
-        unknown_handler = lambda task: logger.error(f"Unknown task type: {task}")
-        handlers = {
-            0: self._handle_create_task,
-            1: self._handle_update_task,
-            2: self._handle_delete_task,
-            4: self._handle_terminate_task
-        }
-        ratelimit = RollingCounterDict(30)
-        nosleep = True
-        
+        logger.info(f"queue consumer started with {len(self.queue)} workers")
+        workers = [asyncio.create_task(self.render_worker(shard)) for shard in range(len(self.queue))]
+        alerted = False
         while True:
-            if nosleep:
-                await asyncio.sleep(0)
-                nosleep = False
+            done, _ = await asyncio.wait(workers, timeout=5)
+            for worker in done:
+                if not worker.cancelled() and worker.exception() is not None:
+                    # a worker only stops on its own for a termination task, anything else crashed it
+                    shard = workers.index(worker)
+                    logger.error(f"Render worker {shard} crashed, restarting it: {worker.exception()}")
+                    self.worker_stats[shard]["restarts"] += 1
+                    workers[shard] = asyncio.create_task(self.render_worker(shard))
+            if all(worker.done() for worker in workers):
+                break
+            logger.debug(f"Queue size: {self.queue.qsize()}, coalesced so far: {self.queue.coalesced}, deferred so far: {self.queue.deferred}")
+            if self.queue.full() and not alerted:
+                alerted = True
+                logger.warning(f"Render queue is full at {self.queue.qsize()} tasks, new work is deferred to the outbox")
+                try:
+                    owner = await self.mentions.resolve(533009808501112881)
+                    if owner:
+                        await owner.send(f"The render queue is full at {self.queue.qsize()} tasks, new work is being deferred until it drains")
+                except Exception as e:
+                    logger.error(f"Error sending the queue alert: {e}")
+            elif alerted and self.queue.qsize() <= self.queue.low_water:
+                alerted = False
+                logger.info(f"Render queue drained to {self.queue.qsize()} tasks")
+        logger.info("queue consumer terminated")
+
+    def offer(self, task: RenderTask | tuple, session: Session | None = None) -> int:
+        """
+        Hands render work to the queue without blocking, the way producers outside the render workers should.
+
+        If the queue is full the task is written to the RenderOutbox instead, and the outbox pump feeds it back in
+        once the queue has drained below its low water mark.
+
+        Args:
+            task (RenderTask | tuple): The task, or a legacy `(kind, instance)` tuple.
+            session (Session | None): A session to write a deferred task with, so it commits along with the caller's
+                work. Without one the task is written and committed on its own.
+
+        Returns:
+            int: ACCEPTED if the task is in the queue, DEFERRED if it was stored in the outbox.
+        """
+        if isinstance(task, tuple):
+            task = RenderTask.from_tuple(task)
+        result = self.queue.offer(task)
+        if result == DEFERRED:
+            if session is not None:
+                self._spill(task, session)
             else:
-                await asyncio.sleep(5)  # Maintain pacing to avoid hitting downstream timeouts
-            logger.debug(f"Queue size: {self.queue.qsize()}")
-            if self.queue.qsize() >= 400:
-                logger.critical(f"Queue size is {self.queue.qsize()}, this is too high!")
-                # fetch the discord user for the bot owner, message them, then call self.close()
-                owner = await self.fetch_user(533009808501112881)
-                if owner:
-                    await owner.send("Queue size is too high, terminating")
-                await self.close()
-            task = await self.queue.get()
-            if not isinstance(task, tuple):
-                logger.error("Task is not a tuple, skipping")
-                nosleep = True
-                continue
-            # we need to recraft the tuple before we can log it, because the session is detached
-            if len(task) == 3:
-                task = (task[0], session.merge(task[1]), task[2])
-            elif len(task) == 2:
-                task = (task[0], session.merge(task[1]), 0)
-            elif len(task) == 1:
-                if not task[0] == 4:
-                    logger.error("Task is a tuple of length 1, but the first element is not 4, skipping")
-                    nosleep = True
+                with self.sessionmaker() as session:
+                    self._spill(task, session)
+                    session.commit()
+        return result
+
+    def _spill(self, task: RenderTask, session: Session):
+        session.add(RenderOutbox(kind=task.kind, model=task.model, pk=task.pk, attempts=task.attempts, priority=task.priority))
+        session.info["outbox_written"] = True
+        logger.debug(f"Deferred {task} to the outbox")
+
+    async def render_worker(self, shard: int):
+        """
+        Processes the tasks of a single queue shard, one at a time.
+
+        Every worker owns its own database session, committing after each task, so workers never share
+        a transaction. That session comes from the synchronous `sessionmaker` even with `DB_ASYNC` on: the handlers
+        use the Query API and lazy loaded relationships (the templates read them) throughout, which an AsyncSession
+        can't run, so moving them means rewriting every handler against `select` with eager loads. That is left for
+        later, until then the async engine serves the cogs that moved to `async_sessionmaker` and the refresh job. Failed tasks are requeued with an incremented fail count, and if even recording the failure
+        fails, the task is rolled back and retried from memory, so a database outage doesn't stop the worker.
+
+        Args:
+            shard (int): The index of the shard in `self.queue.shards` this worker consumes.
+        """
+        logger.debug(f"render worker {shard} started")
+        queue = self.queue.shards[shard]
+        stats = self.worker_stats[shard]
+        unknown_handler = lambda task, session: logger.error(f"Unknown task type: {task}")
+        handlers = {
+            CREATE: self._handle_create_task,
+            UPDATE: self._handle_update_task,
+            DELETE: self._handle_delete_task,
+            TERMINATE: self._handle_terminate_task
+        }
+
+        with self.sessionmaker() as session:
+            while True:
+                task: RenderTask = await queue.get()
+                if not isinstance(task, RenderTask):
+                    logger.error(f"Task {task} is not a RenderTask, skipping")
+                    queue.task_done()
                     continue
+                # everything recorded while this task runs, down to single queries and requests, is counted against its kind
+                task_label.set(KIND_NAMES.get(task.kind, "unknown"))
+                registry.observe("wait", time.monotonic() - task.enqueued_at)
+                stats["current"] = task.key
+                try:
+                    if await self._process_task(task, session, handlers.get(task.kind, unknown_handler), stats):
+                        break
+                except Exception as e:
+                    # recording the outcome failed as well, most likely the database is down, so the task is kept in memory
+                    logger.error(f"Error recording the outcome of {task}, retrying it: {e}")
+                    try:
+                        session.rollback()
+                    except Exception as rollback_error:
+                        logger.error(f"Error rolling back after {task}: {rollback_error}")
+                    self.retries.schedule(task, self.retries.backoff(max(task.attempts, 1)))
+                    registry.inc("retried")
+                finally:
+                    stats["current"] = None
+                    queue.task_done()
+                if self._outbox_starved and self.queue.qsize() <= self.queue.low_water:
+                    # the pump left rows in the outbox for lack of room, there is room again
+                    self._outbox_starved = False
+                    self.outbox_event.set()
+        logger.debug(f"render worker {shard} terminated")
+
+    async def _process_task(self, task: RenderTask, session: Session, handler: Callable, stats: dict) -> bool:
+        """
+        Runs a single task on a render worker's session, and records whether it succeeded, failed or has to be retried.
+
+        Anything that fails up to and including the handler counts as a failure of the task. Failing to record that
+        failure is left to the caller.
+
+        Returns:
+            bool: True if the task terminates the worker.
+        """
+        try:
+            if task.kind != TERMINATE and task.model == "PlayerUpgrade":
+                # upgrades queued outside of a flush may not know their owner yet, everything a player owns is rendered as that player
+                owner = session.query(Unit.player_id).join(PlayerUpgrade, PlayerUpgrade.unit_id == Unit.id).filter(PlayerUpgrade.id == task.pk).scalar()
+                if owner is None:
+                    logger.error(f"Owner of {task} not found, skipping")
+                    registry.inc("dropped")
+                    self._settle_outbox(task, session)
+                    return False
+                task.model, task.pk = "Player", owner
+            if task.attempts > self.retry_limit:
+                # loaded from the outbox after a restart with its retries already spent
+                self._dead_letter(task, "retry limit reached before a restart", session)
+                return False
+            with registry.timer("handler"):
+                # the rows a handler adds are written by the commit, not flushed while it waits on Discord, so a worker
+                # never holds write locks across a request, which on SQLite would block every other worker's writes
+                with session.no_autoflush:
+                    result = await handler(task, session=session)
+                self._settle_outbox(task, session)
+        except Exception as e:
+            logger.error(f"Error processing task: {e}")
+            session.rollback()
+            stats["failed"] += 1
+            registry.inc("failed")
+            task.attempts += 1
+            if task.attempts > self.retry_limit:
+                self._dead_letter(task, str(e), session)
             else:
-                logger.error(f"Task is a tuple of length {len(task)}, skipping")
-                nosleep = True
-                continue
-            ratelimit.set(str(task[1]))
-            if ratelimit.get(str(task[1])) >=5: # window is 30s, which is 6 tasks, this requires at least 50% different tasks
-                logger.warning(f"Ratelimit hit for {task[1]}")
-                nosleep = True
-                continue # just discard the task
-            #logger.debug(f"Processing task: {task}")
-            # Initialize fail count
-            fail_count = task[2] if len(task) > 2 else 0
-            if fail_count > 5:
-                logger.error(f"Task {task} failed too many times, skipping")
-                nosleep = True
-                continue
+                # retry after a backoff, and keep the count and the backoff in the outbox across restarts
+                delay = self.retries.backoff(task.attempts)
+                if task.outbox_ids:
+                    session.query(RenderOutbox).filter(RenderOutbox.id.in_(task.outbox_ids)).update(
+                        {RenderOutbox.attempts: task.attempts, RenderOutbox.not_before: datetime.now() + timedelta(seconds=delay)}, synchronize_session=False)
+                    session.commit()
+                self.retries.schedule(task, delay)
+                registry.inc("retried")
+            return False
+        stats["processed"] += 1
+        registry.inc("processed")
+        return bool(result)
 
-            try:
-                result = await handlers.get(task[0], unknown_handler)(task)
-                #session.expunge(task[1]) # expunge the instance to avoid memory leak or stale commits
-                if result:
-                    break
-            except Exception as e:
-                logger.error(f"Error processing task: {e}")
-                # Requeue the task with an incremented fail count
-                new_fail_count = fail_count + 1
-                if len(task) > 2:
-                    task = (*task[:2], new_fail_count)  # Update fail count
-                else:
-                    task = (*task, new_fail_count)  # Add fail count
-                self.queue.put_nowait(task)
-            self.queue.task_done()
+    def rendering(self, key: Hashable) -> bool:
+        """
+        Whether a task with this key is waiting in the queue, being rendered by a worker, or waiting out a retry.
+        """
+        return key in self.queue or key in self.retries or any(worker["current"] == key for worker in self.worker_stats)
+
+    def _dead_letter(self, task: RenderTask, error: str, session: Session):
+        """
+        Gives up on a task that has run out of retries, keeping it in the DeadLetter table for the debug menu.
+        """
+        logger.error(f"Task {task} failed {task.attempts} times, moving it to the dead letters: {error}")
+        session.add(DeadLetter(kind=task.kind, model=task.model, pk=task.pk, attempts=task.attempts, priority=task.priority, error=error[:255]))
+        registry.inc("dead_lettered")
+        self._settle_outbox(task, session)
+
+    def replay_dead_letters(self, session: Session) -> int:
+        """
+        Moves every dead letter back into the RenderOutbox with a fresh retry count. Returns how many were replayed.
+        """
+        letters = session.query(DeadLetter).order_by(DeadLetter.id).all()
+        for letter in letters:
+            session.add(RenderOutbox(kind=letter.kind, model=letter.model, pk=letter.pk, attempts=0, priority=letter.priority))
+            session.delete(letter)
+        if letters:
+            session.info["outbox_written"] = True # wake the pump once this commits
+        return len(letters)
+
+    def purge_dead_letters(self, session: Session) -> int:
+        """
+        Deletes every dead letter. Returns how many were deleted.
+        """
+        return session.query(DeadLetter).delete(synchronize_session=False)
+
+    def _settle_outbox(self, task: RenderTask, session: Session):
+        """
+        Removes the outbox rows a task was loaded from, and commits the task's work together with it.
+        """
+        if task.outbox_ids:
+            session.query(RenderOutbox).filter(RenderOutbox.id.in_(task.outbox_ids)).delete(synchronize_session=False)
+        session.commit()
+        self._outbox_queued.difference_update(task.outbox_ids)
+
+    def _outbox_committed(self, session: Session):
+        """
+        `after_commit` hook for every session, wakes the outbox pump when the transaction recorded render tasks.
+        """
+        if session.info.pop("outbox_written", False) and self._outbox_loop is not None:
+            self._outbox_loop.call_soon_threadsafe(self.outbox_event.set)
+
+    def _players_committed(self, players: frozenset[int]):
+        # one call per commit, however many rows of each player it touched
+        logger.debug(f"Commit changed {len(players)} players")
+        for player_id in players:
+            self.prerendered.pop(player_id, None) # rendered before the change, the worker renders it again
+        registry.inc("players_changed", label="commit", amount=len(players))
+
+    async def outbox_pump(self):
+        """
+        Feeds the rows of the RenderOutbox into the render queue.
+
+        On start every pending row is loaded, so work that was queued before a restart is resumed. After that the
+        pump wakes whenever a commit recorded new rows, with a periodic poll as a fallback, and reads the pending rows
+        it hasn't queued yet. Rows are removed by the render workers once their task is done. The rows already queued
+        are tracked by id rather than behind a cursor, because ids are handed out when a row is inserted, not when it
+        commits, so on InnoDB a row can become visible after rows with higher ids.
+        Rows that are still backing off from a failure (`not_before` in the future) go to the retry scheduler instead
+        of the queue, so a restart doesn't cut a backoff short.
+
+        The pump never loads more rows than the queue has room for, the rest stay in the outbox until the render
+        workers have drained the queue below its low water mark, which is how overflow is taken back in.
+        """
+        logger.info("outbox pump started")
+        self._outbox_loop = asyncio.get_running_loop()
+        with self.sessionmaker() as session:
+            while not self.is_closed():
+                limit = min(500, self.queue.room())
+                rows = []
+                if limit:
+                    # at most len(queued) of the oldest pending ids were queued already, the rest of them are new
+                    queued = set(self._outbox_queued)
+                    pending = [row_id for row_id, in session.query(RenderOutbox.id).order_by(RenderOutbox.id).limit(len(queued) + limit)]
+                    new_ids = [row_id for row_id in pending if row_id not in queued][:limit]
+                    if new_ids:
+                        rows = session.query(RenderOutbox).filter(RenderOutbox.id.in_(new_ids)).order_by(RenderOutbox.id).all()
+                now = datetime.now()
+                for row in rows:
+                    self._outbox_queued.add(row.id)
+                    if row.not_before and row.not_before > now:
+                        self.retries.schedule(RenderTask.from_outbox(row), (row.not_before - now).total_seconds())
+                    else:
+                        self.queue.put_nowait(RenderTask.from_outbox(row))
+                if rows:
+                    logger.debug(f"Queued {len(rows)} outbox rows, {len(self._outbox_queued)} in flight")
+                session.commit() # end the read, so the next one sees rows committed since
+                if self.queue.full():
+                    self._outbox_starved = True # wait for the workers to make room, rather than for new rows
+                elif len(rows) == limit:
+                    continue # there may be more waiting, don't sleep yet
+                try:
+                    await asyncio.wait_for(self.outbox_event.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    pass
+                self.outbox_event.clear()
+        logger.info("outbox pump terminated")
 
     # we are going to start subdividing the queue consumer into multiple functions, for clarity
 
-    async def _handle_create_task(self, task: tuple[int, Any], session: Session):
-        session.execute(text("SET SESSION innodb_lock_wait_timeout = 10"))
-        requeued = False
-        if task[1].id is None:
-            logger.error(f"Task has a None id, skipping")
-            return
-        instance  = session.query(task[1].__class__).filter(task[1].__class__.id == task[1].id).first()
-        if isinstance(instance, Player):
-            player = instance
+    async def _pace(self, method: str, channel_id: int | str):
+        """
+        Waits for headroom in the rate limit bucket of a request against a channel, and takes a token from it.
+
+        This is called right before every send, edit and delete, so a task that turns out to have nothing to write,
+        like an unchanged render, doesn't use up tokens.
+        """
+        with registry.timer("pacing"):
+            await self.pacer.acquire(channel_route(method, int(channel_id)))
+
+    def _load_player(self, task: RenderTask, session: Session) -> Player | None:
+        """
+        Loads the fresh state of the player a task renders, None if the task isn't for a player or the player is gone.
+        """
+        if task.player_id is None:
+            logger.error(f"Task {task} is not for a player, skipping")
+            return None
+        player = session.get(Player, task.player_id)
+        if player is None:
+            logger.error(f"Player {task.player_id} not found for {task}, skipping")
+            registry.inc("dropped")
+        return player
+
+    async def _handle_create_task(self, task: RenderTask, session: Session):
+        player = self._load_player(task, session)
+        if player:
             if self.config.get("dossier_channel_id"):
                 medals = session.query(Medals).filter(Medals.player_id == player.id).all()
-                # identify what medals have known emotes
-                known_emotes = set(self.medal_emotes.keys())
-                known_medals = {medal.name for medal in medals if medal.name in known_emotes}
-                unknown_medals = {medal.name for medal in medals if medal.name not in known_emotes}
-                known_medals_list = list(known_medals)
-                # make rows of 5 medals that have known emotes
-                rows = [known_medals_list[i:i+5] for i in range(0, len(known_medals_list), 5)]
-                unknown_medals_list = list(unknown_medals)
-                unknown_text = "\n".join(unknown_medals_list)
-                # convert the rows to a string of emotes, with a space between each emote
-                medal_block = "\n".join([" ".join([self.medal_emotes[medal] for medal in row]) for row in rows]) + "\n" + unknown_text
-                mention = await self.fetch_user(player.discord_id)
-                mention = mention.mention if mention else ""
+                medal_block = self.medal_block(medals)
+                mention = self.mentions.mention(player.discord_id)
                 # check for an existing dossier message, if it exists, skip creation
+                # messages deleted on the Discord side are cleaned up by verify_messages, or by the next edit that hits NotFound
                 create_dossier = True
                 existing_dossier = session.query(Dossier).filter(Dossier.player_id == player.id).first()
                 if existing_dossier:
-                    # check if the message itself actually exists
-                    channel = self.get_channel(self.config["dossier_channel_id"])
-                    if channel:
-                        message = await channel.fetch_message(existing_dossier.message_id)
-                        if message:
-                            logger.debug(f"Dossier message for player {player.id} already exists, skipping creation")
-                            create_dossier = False
+                    logger.debug(f"Dossier message for player {player.id} already exists, skipping creation")
+                    create_dossier = False
                 if not player.id:
                     logger.error(f"missing player id, skipping dossier creation")
                     return
                 if create_dossier:
-                    dossier_message = await self.get_channel(self.config["dossier_channel_id"]).send(templates.Dossier.format(mention=mention, player=player, medals=medal_block))
+                    dossier_content = templates.Dossier.format(mention=mention, player=player, medals=medal_block)
+                    await self._pace("POST", self.config["dossier_channel_id"])
+                    dossier_message = await self.get_channel(self.config["dossier_channel_id"]).send(dossier_content)
                     dossier = Dossier(player_id=player.id, message_id=dossier_message.id)
                     session.add(dossier)
+                    self._remember_render(dossier_message.id, dossier_content, session)
                     logger.debug(f"Created dossier for player {player.id} with message ID {dossier_message.id}")
             if self.config.get("statistics_channel_id"):
-                unit_message = await self.generate_unit_message(player)
-                _player = session.merge(player)
-                discord_id = _player.discord_id
-                mention = await self.fetch_user(discord_id)
-                mention = mention.mention if mention else ""
+                unit_message = await self.generate_unit_message(player, session=session)
+                discord_id = player.discord_id
+                mention = self.mentions.mention(discord_id)
                 # check for an existing statistics message, if it exists, skip creation
-                existing_statistics = session.query(Statistic).filter(Statistic.player_id == _player.id).first()
+                existing_statistics = session.query(Statistic).filter(Statistic.player_id == player.id).first()
                 if existing_statistics:
-                    # check if the message itself actually exists
-                    channel = self.get_channel(self.config["statistics_channel_id"])
-                    if channel:
-                        message = await channel.fetch_message(existing_statistics.message_id)
-                        if message:
-                            logger.debug(f"Statistics message for player {_player.id} already exists, skipping creation")
-                            return
-                if not _player.id:
+                    logger.debug(f"Statistics message for player {player.id} already exists, skipping creation")
+                    return
+                if not player.id:
                     logger.error(f"missing player id, skipping statistics creation")
                     return
-                statistics_message = await self.get_channel(self.config["statistics_channel_id"]).send(templates.Statistics_Player.format(mention=mention, player=_player, units=unit_message))
-                statistics = Statistic(player_id=_player.id, message_id=statistics_message.id)
+                statistics_content = templates.Statistics_Player.format(mention=mention, player=player, units=unit_message)
+                await self._pace("POST", self.config["statistics_channel_id"])
+                statistics_message = await self.get_channel(self.config["statistics_channel_id"]).send(statistics_content)
+                statistics = Statistic(player_id=player.id, message_id=statistics_message.id)
                 session.add(statistics)
-                logger.debug(f"Created statistics for player {_player.id} with message ID {statistics_message.id}")
-        elif isinstance(instance, Unit):
-            player = session.query(Player).filter(Player.id == instance.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to unit {instance.id} Location 1")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to unit {instance.id} Location 1")
-            else:
-                logger.error(f"Player not found for unit {instance.id}")
-        elif isinstance(instance, PlayerUpgrade):
-            unit = session.query(Unit).filter(Unit.id == instance.unit_id).first()
-            player = session.query(Player).filter(Player.id == unit.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to upgrade {instance.id} Location 2")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to upgrade {instance.id} Location 2")
+                self._remember_render(statistics_message.id, statistics_content, session)
+                logger.debug(f"Created statistics for player {player.id} with message ID {statistics_message.id}")
 
-    async def _handle_update_task(self, task: tuple[int, Any], session: Session):
-        session.execute(text("SET SESSION innodb_lock_wait_timeout = 10"))
-        instance = session.query(task[1].__class__).filter(task[1].__class__.id == task[1].id).first()
+    async def _handle_update_task(self, task: RenderTask, session: Session):
+        player = self._load_player(task, session)
         requeued = False
-        if isinstance(instance, Player):
-            logger.debug(f"Updating player: {instance}")
-            player = instance
+        if player:
+            logger.debug(f"Updating player: {player}")
             logger.debug("fetching dossier")
             dossier = session.query(Dossier).filter(Dossier.player_id == player.id).first()
             if dossier:
                 logger.debug("dossier found, fetching channel")
                 channel = self.get_channel(self.config["dossier_channel_id"])
                 if channel:
-                    logger.debug("channel found, fetching message")
-                    message = await channel.fetch_message(dossier.message_id)
-                    logger.debug("message found, fetching user")
-                    mention = await self.fetch_user(player.discord_id)
-                    mention = mention.mention if mention else ""
-                    logger.debug("user found, editing message")
-                    await message.edit(content=templates.Dossier.format(mention=mention, player=player, medals=""))
-                    logger.debug(f"Updated dossier for player {player.id} with message ID {dossier.message_id}")
+                    logger.debug("channel found, rendering message")
+                    mention = self.mentions.mention(player.discord_id)
+                    try:
+                        if await self._edit_rendered(channel, dossier.message_id, templates.Dossier.format(mention=mention, player=player, medals=""), session):
+                            logger.debug(f"Updated dossier for player {player.id} with message ID {dossier.message_id}")
+                    except NotFound:
+                        self._forget_message(Dossier, dossier.message_id, session)
+                        self.offer((CREATE, player), session)
+                        requeued = True
+                        logger.warning(f"Dossier message {dossier.message_id} of player {player.id} is gone, queued a create task to replace it")
             else:
                 logger.debug("no dossier found, pushing create task")
                 if not requeued:
-                    self.queue.put_nowait((0, player))
+                    self.offer((CREATE, player), session)
                     logger.debug(f"Queued create task for player {player.id} due to missing dossier message Location 3")
                     requeued = True
                 else:
@@ -330,97 +554,94 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
             if statistics:
                 channel = self.get_channel(self.config["statistics_channel_id"])
                 if channel:
-                    message = await channel.fetch_message(statistics.message_id)
                     discord_id = player.discord_id
-                    unit_message = await self.generate_unit_message(player)
-                    _player = session.merge(player)
-                    _statistics = session.merge(statistics)
-                    mention = await self.fetch_user(discord_id)
-                    mention = mention.mention if mention else ""
-                    await message.edit(content=templates.Statistics_Player.format(mention=mention, player=_player, units=unit_message))
-                    logger.debug(f"Updated statistics for player {_player.id} with message ID {_statistics.message_id}")
+                    unit_message = self.prerendered.pop(player.id, None)
+                    if unit_message is None:
+                        unit_message = await self.generate_unit_message(player, session=session)
+                    mention = self.mentions.mention(discord_id)
+                    try:
+                        if await self._edit_rendered(channel, statistics.message_id, templates.Statistics_Player.format(mention=mention, player=player, units=unit_message), session):
+                            logger.debug(f"Updated statistics for player {player.id} with message ID {statistics.message_id}")
+                    except NotFound:
+                        self._forget_message(Statistic, statistics.message_id, session)
+                        if not requeued:
+                            self.offer((CREATE, player), session)
+                            requeued = True
+                        logger.warning(f"Statistics message {statistics.message_id} of player {player.id} is gone, queued a create task to replace it")
                 else:
                     # there should be a message, but the discord side was probably deleted by a mod
                     logger.error(f"No channel found for statistics message of player {player.id}, skipping")
             else:
                 # user doesn't have a statistics message, push a create task on the user, to fudge it back
                 if not requeued:
-                    self.queue.put_nowait((0, player))
+                    self.offer((CREATE, player), session)
                     logger.debug(f"Queued create task for player {player.id} due to missing statistics message Location 4")
                     requeued = True
                 else:
                     logger.debug(f"Already queued create task for player {player.id} due to missing statistics message Location 4")
-        elif isinstance(instance, Unit):
-            unit = instance
-            player = session.query(Player).filter(Player.id == unit.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to unit {unit.id} Location 5")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to unit {unit.id} Location 5")
-        elif isinstance(task[1], PlayerUpgrade):
-            upgrade = task[1]
-            unit = session.query(Unit).filter(Unit.id == upgrade.unit_id).first()
-            player = session.query(Player).filter(Player.id == unit.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to upgrade {upgrade.id} Location 6")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to upgrade {upgrade.id} Location 6")
-
-    async def _handle_delete_task(self, task: tuple[int, Any], session: Session):
-        session.execute(text("SET SESSION innodb_lock_wait_timeout = 10"))
-        logger.debug(f"requerying instance for delete task")
-        with session.no_autoflush: # disable flush on delete, to avoid a reinsert
-            instance = session.query(task[1].__class__).filter(task[1].__class__.id == task[1].id).first()
-        logger.debug(f"instance found for delete task: {instance}") # we can't log the task as it's possibly unbound, but we can log the instance
-        requeued = False
-        if isinstance(instance, Dossier):
-            dossier = instance
+
+    def _remember_render(self, message_id: int | str, content: str, session: Session):
+        """
+        Stores the fingerprint of what was just posted as a message, so an identical render can skip the edit.
+        """
+        fingerprint = RenderCache.fingerprint(content)
+        cached = session.get(RenderCache, int(message_id))
+        if cached:
+            cached.content_hash = fingerprint
+        else:
+            session.add(RenderCache(message_id=int(message_id), content_hash=fingerprint))
+
+    async def _edit_rendered(self, channel, message_id: int | str, content: str, session: Session) -> bool:
+        """
+        Edits a rendered message, unless its content is identical to what was last posted.
+
+        The edit goes through a partial message built from the stored id, so it costs a single request.
+
+        Returns:
+            bool: True if the message was edited, False if the edit was skipped.
+
+        Raises:
+            NotFound: If the message was deleted on the Discord side.
+        """
+        cached = session.get(RenderCache, int(message_id))
+        if cached and cached.content_hash == RenderCache.fingerprint(content):
+            self.edits_avoided += 1
+            logger.debug(f"Message {message_id} is unchanged, skipping the edit")
+            return False
+        await self._pace("PATCH", channel.id)
+        await channel.get_partial_message(int(message_id)).edit(content=content)
+        self._remember_render(message_id, content, session)
+        return True
+
+    def _forget_message(self, model: type[Dossier] | type[Statistic], message_id: int | str, session: Session):
+        """
+        Removes the row of a dossier or statistics message that no longer exists on Discord, so it can be created again.
+
+        This is a bulk delete on purpose, the listeners would otherwise queue a delete for a message that is already gone.
+        """
+        session.query(model).filter(model.message_id == str(message_id)).delete(synchronize_session=False)
+        session.query(RenderCache).filter(RenderCache.message_id == int(message_id)).delete(synchronize_session=False)
+
+    async def _handle_delete_task(self, task: RenderTask, session: Session):
+        # Dossier and Statistic rows are already gone, so the task carries the id of the message to delete as its pk
+        if task.model == "Dossier":
             channel = self.get_channel(self.config["dossier_channel_id"])
-            if channel:
-                message = await channel.fetch_message(dossier.message_id)
-                await message.delete()
-                logger.debug(f"Deleted dossier message ID {dossier.message_id} for player {dossier.player_id}")
-        elif isinstance(instance, Statistic):
-            statistic = instance
+        elif task.model == "Statistic":
             channel = self.get_channel(self.config["statistics_channel_id"])
-            if channel:
-                message = await channel.fetch_message(statistic.message_id)
-                await message.delete()
-                logger.debug(f"Deleted statistics message ID {statistic.message_id} for player {statistic.player_id}")
-        elif isinstance(instance, Unit):
-            logger.debug(f"instance is a unit, expunging")
-            session.expunge(instance)
+        else:
+            # Unit and PlayerUpgrade deletions never reach this handler, the RenderQueue turns them into player updates
+            logger.error(f"Unexpected delete task {task}, skipping")
             return
-            unit = instance
-            player = session.query(Player).filter(Player.id == unit.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to unit {unit.id} Location 7")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to unit {unit.id} Location 7")
-        elif isinstance(instance, PlayerUpgrade):
-            upgrade = instance
-            unit = session.query(Unit).filter(Unit.id == upgrade.unit_id).first()
-            player = session.query(Player).filter(Player.id == unit.player_id).first()
-            if player:
-                if not requeued:
-                    self.queue.put_nowait((1, player))
-                    logger.debug(f"Queued update task for player {player.id} due to upgrade {upgrade.id} Location 8")
-                    requeued = True
-                else:
-                    logger.debug(f"Already queued update task for player {player.id} due to upgrade {upgrade.id} Location 8")
-        if instance: # if the instance is not None, we need to expunge it, if the instance is None we can ignore it
-            session.expunge(instance)
-
-    async def _handle_terminate_task(self, task): 
+        if channel:
+            try:
+                await self._pace("DELETE", channel.id)
+                await channel.get_partial_message(task.pk).delete()
+                logger.debug(f"Deleted {task.model.lower()} message ID {task.pk}")
+            except NotFound:
+                logger.debug(f"{task.model} message ID {task.pk} was already deleted")
+        session.query(RenderCache).filter(RenderCache.message_id == task.pk).delete(synchronize_session=False)
+
+    async def _handle_terminate_task(self, task, session: Session = None):
         logger.debug("Queue consumer terminating")
         return True # this is the only function that returns a value, as that's how we'll know to terminate, is if a value or raise is returned
 
@@ -440,6 +661,22 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         "LIGHT_MECH": templates.Armor_Stats
     }
 
+    def medal_block(self, medals: list[Medals]) -> str:
+        """
+        Builds the medal section of a dossier, the medals with a known emote as rows of 5 emotes, the others by name.
+        """
+        # identify what medals have known emotes
+        known_emotes = set(self.medal_emotes.keys())
+        known_medals = {medal.name for medal in medals if medal.name in known_emotes}
+        unknown_medals = {medal.name for medal in medals if medal.name not in known_emotes}
+        known_medals_list = list(known_medals)
+        # make rows of 5 medals that have known emotes
+        rows = [known_medals_list[i:i+5] for i in range(0, len(known_medals_list), 5)]
+        unknown_medals_list = list(unknown_medals)
+        unknown_text = "\n".join(unknown_medals_list)
+        # convert the rows to a string of emotes, with a space between each emote
+        return "\n".join([" ".join([self.medal_emotes[medal] for medal in row]) for row in rows]) + "\n" + unknown_text
+
     async def generate_unit_message(self, player: Player, session: Session):
         """
         Creates a message detailing a player's units, both active and inactive.
@@ -450,23 +687,40 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         Returns:
             str: Formatted unit messages for the player, grouped by status.
         """
-        logger.debug(f"Generating unit message for player: {player.id}")
-        unit_messages = []
+        return self.generate_unit_messages([player.id], session)[player.id]
 
-        # Query inactive units
-        units = session.query(Unit).filter(Unit.player_id == player.id).all()
-        logger.debug(f"Found {len(units)} units for player: {player.id}")
+    def generate_unit_messages(self, player_ids: list[int], session: Session) -> dict[int, str]:
+        """
+        Creates the unit messages for several players at once.
+
+        The units of every player and their upgrades are loaded with a single query, so the cost doesn't grow with
+        the number of units, or the number of players when `RefreshJob` renders a page ahead of the workers. It
+        doesn't await anything, so the job can run it on a session of `async_sessionmaker` through `run_sync`.
+
+        Args:
+            player_ids (list[int]): The ids of the players to generate the messages for.
+
+        Returns:
+            dict[int, str]: The unit message of every player, by player id.
+        """
+        logger.debug(f"Generating unit messages for players: {player_ids}")
+        rosters: dict[int, list[str]] = {player_id: [] for player_id in player_ids}
+
+        # the upgrades are joined in, everything else the mappers would eagerly load isn't rendered, so leave it unloaded
+        units = (session.query(Unit)
+                 .filter(Unit.player_id.in_(player_ids))
+                 .options(joinedload(Unit.upgrades).lazyload("*"), lazyload(Unit.campaign))
+                 .order_by(Unit.id)
+                 .all())
+        logger.debug(f"Found {len(units)} units for players: {player_ids}")
         for unit in units:
-            upgrades = session.query(PlayerUpgrade).filter(PlayerUpgrade.unit_id == unit.id).all()
-            upgrade_list = ", ".join([upgrade.name for upgrade in upgrades])
+            upgrade_list = ", ".join([upgrade.name for upgrade in sorted(unit.upgrades, key=lambda upgrade: upgrade.id)])
             logger.debug(f"Unit {unit.name} of type {unit.unit_type} has status {unit.status.name}")
             logger.debug(f"Unit {unit.id} has upgrades: {upgrade_list}")
-            unit_messages.append(templates.Statistics_Unit.format(unit=unit, upgrades=upgrade_list, callsign=('\"' + unit.callsign + '\"') if unit.callsign else ""))
+            rosters[unit.player_id].append(templates.Statistics_Unit.format(unit=unit, upgrades=upgrade_list, callsign=('\"' + unit.callsign + '\"') if unit.callsign else ""))
 
-        # Combine all unit messages into a single string
-        combined_message = "\n".join(unit_messages)
-        logger.debug(f"Generated unit message for player {player.id}: {combined_message}")
-        return combined_message
+        # Combine all unit messages into a single string per player
+        return {player_id: "\n".join(unit_messages) for player_id, unit_messages in rosters.items()}
 
     async def load_extensions(self, extensions: list[str]):
         """
@@ -499,6 +753,13 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         logger.info(f"Logged in as {self.user}")
         #await self.set_bot_nick("S.A.M.")
         asyncio.create_task(self.queue_consumer())
+        asyncio.create_task(self.outbox_pump())
+        asyncio.create_task(self.retries.run())
+        asyncio.create_task(registry.watch_loop_lag())
+        if not self.verify_messages.is_running():
+            self.verify_messages.start()
+        if not RefreshJob.running(self):
+            RefreshJob.resume(self)
         await self.change_presence(status=Status.online, activity=Activity(name="Meta Campaign", type=ActivityType.playing))
         if (getenv("STARTUP_ANIMATION", "false").lower() == "true"):
             try:
@@ -514,11 +775,52 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         except Exception as e:
             logger.error(f"Error fetching channel: {e}")
             channel = None
-        owner = await self.fetch_user(533009808501112881)
         if channel:
-            await channel.send(f"{owner.mention}\n# S.A.M. was terminated by the system")
+            await channel.send(f"{self.mentions.mention(533009808501112881)}\n# S.A.M. was terminated by the system")
         await self.close()
 
+    @tasks.loop(hours=float(getenv("MESSAGE_VERIFY_HOURS", 6)))
+    async def verify_messages(self):
+        """
+        Checks that every dossier and statistics message we have a row for still exists on Discord.
+
+        Render tasks trust the stored message ids, so this is what notices messages a mod deleted. It reads the
+        channel history in pages of 100 instead of fetching every message, and only back to the oldest message we
+        have a row for, forgets the rows whose message is gone, and queues a bulk create for their player. A channel
+        that can't be read is logged and skipped until the next run. The interval is set with `MESSAGE_VERIFY_HOURS`.
+        """
+        started = discord_utils.utcnow()
+        # only judge messages older than the scan, anything newer can't be in the history we read
+        cutoff = discord_utils.time_snowflake(started)
+        with self.sessionmaker() as session:
+            for model, channel_key in ((Dossier, "dossier_channel_id"), (Statistic, "statistics_channel_id")):
+                channel = self.get_channel(self.config.get(channel_key)) if self.config.get(channel_key) else None
+                if channel is None:
+                    continue
+                try:
+                    tracked = [(player_id, int(message_id)) for player_id, message_id in session.query(model.player_id, model.message_id) if int(message_id) < cutoff]
+                    if not tracked:
+                        continue
+                    oldest = min(message_id for _, message_id in tracked)
+                    posted = {message.id async for message in channel.history(limit=None, after=Object(id=oldest - 1), before=started) if message.author == self.user}
+                    missing = [(player_id, message_id) for player_id, message_id in tracked if message_id not in posted]
+                    for player_id, message_id in missing:
+                        self._forget_message(model, message_id, session)
+                        self.offer(RenderTask.for_player(CREATE, player_id, priority=BULK), session)
+                    session.commit()
+                except Forbidden as e:
+                    logger.error(f"Missing access to the history of the {model.__tablename__} channel {channel.id}, skipping it: {e}")
+                    session.rollback()
+                    continue
+                except HTTPException as e:
+                    logger.error(f"Error reading the history of the {model.__tablename__} channel {channel.id}, skipping it: {e}")
+                    session.rollback()
+                    continue
+                if missing:
+                    logger.warning(f"{len(missing)} messages in {model.__tablename__} were missing from Discord, queued them to be created again")
+                else:
+                    logger.debug(f"All {model.__tablename__} messages are present")
+
     @tasks.loop(count=1)
     async def startup_animation(self):
         try:
@@ -542,8 +844,7 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         channel = await self.fetch_channel(1211454073383952395)
         if not channel:
             return
-        owner = await self.fetch_user(533009808501112881)
-        await channel.send(f"{owner.mention}\n# I have successfully survived 24 Hours!")
+        await channel.send(f"{self.mentions.mention(533009808501112881)}\n# I have successfully survived 24 Hours!")
         logger.debug("24 hour notification loop finished")
         self.notify_on_24_hours.cancel()
     
@@ -554,10 +855,12 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
         Puts a termination signal in the queue, resyncs configuration, commits database changes,
         and closes the session.
         """
-        await self.queue.put((4, None))
-        await self.resync_config(session=session)
+        await self.queue.put((TERMINATE, None))
+        await self.resync_config()
         await self.change_presence(status=Status.offline, activity=None)
         await super().close()
+        if self.db_executor:
+            self.db_executor.shutdown(wait=False)
 
     async def setup_hook(self):
         """
@@ -603,7 +906,6 @@ class CustomClient(Bot): # need to inherit from Bot to use Cogs
 
         # wrap all the consumer methods in uses_db now, since we can access the sessionmaker after init
         decorator = uses_db(sessionmaker=self.sessionmaker)
-        self.queue_consumer = decorator(self.queue_consumer)
         self._handle_create_task = decorator(self._handle_create_task)
         self._handle_update_task = decorator(self._handle_update_task)
         self._handle_delete_task = decorator(self._handle_delete_task)
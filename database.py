@@ -0,0 +1,57 @@
+"""
+Engine setup for the databases the bot runs on: MySQL in production, SQLite for local profiling.
+
+Everything that depends on the database is decided here from the URL's dialect, so the rest of the bot doesn't
+have to: the pool options, and the settings every new connection gets (`on_connect`). A lock wait timeout of
+`DB_LOCK_TIMEOUT` seconds is `innodb_lock_wait_timeout` on MySQL and `busy_timeout` on SQLite. SQLite also gets
+foreign keys switched on, to behave like InnoDB, and WAL, so the render workers can read while a command writes.
+"""
+
+from logging import getLogger
+from os import getenv
+from typing import Any
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+
+logger = getLogger(__name__)
+
+LOCK_TIMEOUT = int(getenv("DB_LOCK_TIMEOUT", 10))
+
+def engine_options(url: str) -> dict[str, Any]:
+    """
+    The `create_engine` options for a URL, the pool of 10 plus 20 overflow for servers, what SQLite can take for files.
+    """
+    url = make_url(url)
+    options: dict[str, Any] = {"pool_pre_ping": True}
+    if url.get_backend_name() == "sqlite":
+        # the offloaded database threads share the pooled connections, and an in memory database has a single one
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            return options
+    options["pool_size"] = int(getenv("DB_POOL_SIZE", 10))
+    options["max_overflow"] = int(getenv("DB_MAX_OVERFLOW", 20))
+    return options
+
+def on_connect(engine: Engine):
+    """
+    Applies the per connection settings of the engine's dialect to every connection it opens.
+    """
+    dialect = engine.dialect.name
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if dialect == "mysql":
+                cursor.execute(f"SET SESSION innodb_lock_wait_timeout = {LOCK_TIMEOUT}")
+            elif dialect == "sqlite":
+                cursor.execute(f"PRAGMA busy_timeout = {LOCK_TIMEOUT * 1000}")
+                cursor.execute("PRAGMA foreign_keys = ON")
+                cursor.execute("PRAGMA journal_mode = WAL")
+        finally:
+            cursor.close()
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    engine = create_engine(url, **{**engine_options(url), **kwargs})
+    on_connect(engine)
+    logger.debug(f"Created a {engine.dialect.name} engine")
+    return engine
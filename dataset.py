@@ -0,0 +1,131 @@
+"""
+Fills a database with a synthetic, realistic looking dataset, as the base for performance work.
+
+    python dataset.py sqlite:///bench.db --players 10000 --units 100000
+
+The shape follows the live data: a few companies own most of the units (a Pareto spread, `--skew`), most players
+have one active unit, upgrades and medals per unit and player are Poisson distributed around `--upgrades` and
+`--medals`, and active units are spread over `--campaigns` campaigns. The same `--seed` always gives the same data.
+
+Rows are inserted through Core in chunks, not through the ORM, so the model listeners don't queue a render task for
+every generated row. The schema is created or migrated first, and ids continue after whatever the database holds.
+"""
+
+import argparse
+import math
+import random
+import time
+from logging import getLogger, basicConfig, INFO
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import sessionmaker
+from database import create_db_engine
+from configstore import ConfigStore
+import migrations
+from models import Player, Unit, UnitStatus, PlayerUpgrade, UpgradeType, ShopUpgrade, ShopUpgradeUnitTypes, Medals, Campaign
+
+logger = getLogger(__name__)
+
+UNIT_TYPES = ["INFANTRY", "ARMOR", "ARTILLERY", "AIR", "RECON", "SUPPORT", "ENGINEER", "NAVAL"]
+AREAS = ["ARMCO", "NORTH", "SOUTH", "EAST", "WEST", "ORBIT"]
+MEDALS = [f"Medal of {word}" for word in ("Valor", "Honor", "Service", "Merit", "Courage", "Sacrifice", "Duty", "Glory", "Resolve", "Vigilance")]
+
+def poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method, the means used here are small
+    if mean <= 0:
+        return 0
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+def insert_chunked(connection: Connection, table, rows: list[dict], chunk: int):
+    for start in range(0, len(rows), chunk):
+        connection.execute(insert(table), rows[start:start + chunk])
+
+def next_id(connection: Connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def generate(connection: Connection, players: int, units: int, upgrades: float, medals: float, campaigns: int,
+             shop_upgrades: int, skew: float, rng: random.Random, chunk: int = 5000) -> dict[str, int]:
+    """
+    Inserts the dataset on `connection` and returns how many rows of each kind it made.
+    """
+    player_start, unit_start = next_id(connection, Player), next_id(connection, Unit)
+    campaign_start, shop_start = next_id(connection, Campaign), next_id(connection, ShopUpgrade)
+    discord_start = 10 ** 17 + player_start # snowflake sized, and clear of real ids
+
+    player_rows = [{"id": player_start + i, "discord_id": str(discord_start + i), "name": f"Company {player_start + i}",
+                    "lore": "", "rec_points": rng.randint(0, 200), "bonus_pay": rng.choice((0, 0, 0, 5, 10))} for i in range(players)]
+    campaign_rows = [{"id": campaign_start + i, "name": f"Campaign {campaign_start + i}", "active": rng.random() < 0.3,
+                      "open": rng.random() < 0.2, "gm": ""} for i in range(campaigns)]
+    shop_rows = [{"id": shop_start + i, "name": f"Upgrade {shop_start + i}", "type": rng.choice(list(UpgradeType)),
+                  "cost": rng.randint(1, 20)} for i in range(shop_upgrades)]
+    # most upgrades fit a couple of unit types, the shop filters on these
+    shop_type_rows = [{"shop_upgrade_id": shop["id"], "unit_type": unit_type} for shop in shop_rows
+                      for unit_type in rng.sample(UNIT_TYPES, rng.randint(1, 3))]
+
+    # a heavy tailed weight per player, so a few companies own most of the units
+    weights = [rng.paretovariate(skew) for _ in range(players)]
+    owners = rng.choices(range(players), weights=weights, k=units) if players else []
+    unit_rows, active = [], set()
+    for i, owner in enumerate(owners):
+        unit_id = unit_start + i
+        is_active = owner not in active and rng.random() < 0.6
+        if is_active:
+            active.add(owner)
+        status = UnitStatus.ACTIVE if is_active else rng.choices(
+            [UnitStatus.INACTIVE, UnitStatus.PROPOSED, UnitStatus.MIA, UnitStatus.KIA, UnitStatus.LEGACY], weights=[60, 15, 5, 15, 5])[0]
+        unit_type = rng.choice(UNIT_TYPES)
+        unit_rows.append({"id": unit_id, "name": f"Unit {unit_id}", "player_id": player_start + owner, "unit_type": unit_type,
+                          "status": status, "legacy": status == UnitStatus.LEGACY, "active": is_active, "callsign": f"C{unit_id}",
+                          "area_operation": rng.choice(AREAS), "original_type": unit_type,
+                          "campaign_id": campaign_start + rng.randrange(campaigns) if is_active and campaigns and rng.random() < 0.5 else None})
+
+    upgrade_rows = []
+    for unit in unit_rows:
+        for _ in range(poisson(rng, upgrades)):
+            shop = rng.choice(shop_rows) if shop_rows else None
+            upgrade_rows.append({"type": shop["type"] if shop else UpgradeType.UPGRADE, "name": shop["name"] if shop else "Upgrade",
+                                 "original_price": shop["cost"] if shop else 0, "unit_id": unit["id"], "shop_upgrade_id": shop["id"] if shop else None})
+    medal_rows = [{"name": name, "player_id": player["id"]} for player in player_rows
+                  for name in rng.sample(MEDALS, min(len(MEDALS), poisson(rng, medals)))]
+
+    for table, rows in ((Player.__table__, player_rows), (Campaign.__table__, campaign_rows), (ShopUpgrade.__table__, shop_rows),
+                        (ShopUpgradeUnitTypes.__table__, shop_type_rows), (Unit.__table__, unit_rows), (PlayerUpgrade.__table__, upgrade_rows), (Medals.__table__, medal_rows)):
+        insert_chunked(connection, table, rows, chunk)
+        logger.info(f"Inserted {len(rows)} {table.name}")
+    return {"players": len(player_rows), "campaigns": len(campaign_rows), "shop_upgrades": len(shop_rows),
+            "shop_unit_types": len(shop_type_rows), "units": len(unit_rows), "upgrades": len(upgrade_rows), "medals": len(medal_rows)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with a synthetic dataset")
+    parser.add_argument("url", help="the database URL, sqlite:///bench.db for a local file")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--units", type=int, default=100000, help="units over all players")
+    parser.add_argument("--upgrades", type=float, default=2.0, help="average upgrades per unit")
+    parser.add_argument("--medals", type=float, default=1.5, help="average medals per player")
+    parser.add_argument("--campaigns", type=int, default=20)
+    parser.add_argument("--shop-upgrades", type=int, default=50)
+    parser.add_argument("--skew", type=float, default=3.0, help="Pareto shape of units per player, lower is more uneven")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    basicConfig(level=INFO)
+
+    engine = create_db_engine(args.url)
+    migrations.upgrade(engine)
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        counts = generate(connection, args.players, args.units, args.upgrades, args.medals, args.campaigns,
+                          args.shop_upgrades, args.skew, random.Random(args.seed))
+    # the unit type pickers read the configured types
+    config = ConfigStore(sessionmaker(bind=engine), "BOT_CONFIG", defaults={"EXTENSIONS": []})
+    with sessionmaker(bind=engine)() as session:
+        config.load(session)
+        config.mutate("unit_types", lambda unit_types: unit_types | set(UNIT_TYPES), set())
+    config.flush()
+    logger.info(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from discord import Interaction, app_commands as ac, Member, TextStyle, Emoji, S
 from discord.ui import Modal, TextInput
 from models import Player, Unit, UnitStatus, PlayerUpgrade, Medals
 from customclient import CustomClient
+from refreshjob import RefreshJob
 import os
 from utils import has_invalid_url, uses_db, string_to_list
 from sqlalchemy.orm import Session
@@ -84,7 +85,7 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         Adjusts a player's requisition points by adding or removing a specified amount.
         """
         # find the player by discord id
-        player = session.query(Player).filter(Player.discord_id == player.id).first()
+        player = Player.by_discord_id(session, player.id)
         if not player:
             await interaction.response.send_message("User doesn't have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
@@ -107,7 +108,7 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         Modify a player's bonus pay by adding or removing a specified amount.
         """
         # find the player by discord id
-        player = session.query(Player).filter(Player.discord_id == player.id).first()
+        player = Player.by_discord_id(session, player.id)
         if not player:
             await interaction.response.send_message("User doesn't have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
@@ -188,7 +189,7 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         Assign a specific medal to a player.
         """
         # find the player by discord id
-        _player: Player = session.query(Player).filter(Player.discord_id == player.id).first()
+        _player: Player = Player.by_discord_id(session, player.id)
         if not _player:
             await interaction.response.send_message("User doesn't have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
@@ -212,11 +213,8 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         if len(name) > 15:
             await interaction.response.send_message("Unit type name is too long, please use a shorter name", ephemeral=self.bot.use_ephemeral)
             return
-        if not self.bot.config.get("unit_types"):
-            self.bot.config["unit_types"] = {name}
-        else:
-            self.bot.config["unit_types"].add(name) # unit_types is a set, so we can just append
-        await self.bot.resync_config(session)
+        self.bot.config.mutate("unit_types", lambda unit_types: unit_types | {name}, set()) # unit_types is a set, so adding an existing name is harmless
+        await self.bot.resync_config()
         await interaction.response.send_message(f"Unit type {name} created", ephemeral=self.bot.use_ephemeral)
 
     @ac.command(name="refresh_stats", description="Refresh the statistics and dossiers for all players")
@@ -225,10 +223,12 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         """
         Refreshes the statistics and dossiers for all players.
         """
-        await interaction.response.send_message("Refreshing statistics and dossiers for all players", ephemeral=self.bot.use_ephemeral)
-        for player in session.query(Player).all():
-            self.bot.queue.put_nowait((1, player)) # make the bot think the player was edited, using nowait to avoid yielding control
-        await interaction.followup.send("Refreshed statistics and dossiers for all players", ephemeral=self.bot.use_ephemeral)
+        if RefreshJob.running(self.bot):
+            await interaction.response.send_message("A refresh is already running, its progress is posted in the channel it was started from", ephemeral=self.bot.use_ephemeral)
+            return
+        # the job streams the players through the render queue a page at a time, and resumes after a restart
+        RefreshJob.start(self.bot, interaction.channel.id, session)
+        await interaction.response.send_message("Refreshing statistics and dossiers for all players, progress will be posted in this channel", ephemeral=self.bot.use_ephemeral)
     
     @ac.command(name="refresh_player", description="Refresh the statistics and dossiers for a player")
     @ac.describe(player="The player to refresh the statistics and dossiers for")
@@ -242,11 +242,11 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         Refreshes the statistics and dossiers for a specific player.
         """
         await interaction.response.send_message(f"Refreshing statistics and dossiers for {player.name}", ephemeral=self.bot.use_ephemeral)
-        _player = session.query(Player).filter(Player.discord_id == player.id).first()
+        _player = Player.by_discord_id(session, player.id)
         if not _player:
             await interaction.response.send_message("Player does not have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
-        self.bot.queue.put_nowait((1, _player))
+        self.bot.offer((1, _player), session)
 
     @ac.command(name="specialupgrade", description="Give a player a one-off or relic item")
     @ac.describe(player="The player to give the item to")
@@ -256,7 +256,7 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         """
         Give a unique or relic item to a player’s active unit.
         """
-        _player = session.query(Player).filter(Player.discord_id == player.id).first()
+        _player = Player.by_discord_id(session, player.id)
         if not _player:
             await interaction.response.send_message("Player does not have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
@@ -305,14 +305,14 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
                 if not unit:
                     await interaction.response.send_message("Unit not found", ephemeral=self.bot.use_ephemeral)
                     return
-                self.bot.queue.put_nowait((2, unit))
+                self.bot.offer((2, unit), session)
                 session.delete(unit)
                 logger.debug(f"Unit with the id {unit_id} was deleted from player {player.name}")
                 await interaction.response.send_message(f"Unit {unit.name} has been removed", ephemeral=self.bot.use_ephemeral)
                 
 
         # Checks if the Player has a Meta Company and If that company has a name
-        company: Player = session.query(Player).filter(Player.discord_id == player.id).first()
+        company: Player = Player.by_discord_id(session, player.id)
         if not company:
             await interaction.response.send_message(f"{player.name} doesn't have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
@@ -330,9 +330,9 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
         """
         Delete a unit type and mark all related inactive units as legacy.
         """
-        if name in self.bot.config.get("unit_types"):
-            self.bot.config["unit_types"].remove(name)
-            await self.bot.resync_config(session)
+        if name in self.bot.config.get("unit_types", set()):
+            self.bot.config.mutate("unit_types", lambda unit_types: unit_types - {name}, set())
+            await self.bot.resync_config()
         units = session.query(Unit).filter(Unit.unit_type == name).filter(Unit.active == False).all()
         for unit in units:
             unit.legacy = True
@@ -465,7 +465,7 @@ class Admin(GroupCog, group_name="admin", name="Admin"):
                 self.player.lore = self.children[1].value
                 await interaction.response.send_message("Company updated", ephemeral=self.bot.use_ephemeral)
 
-        player = session.query(Player).filter(Player.discord_id == player.id).first()
+        player = Player.by_discord_id(session, player.id)
         if not player:
             logger.debug(f"User {player.display_name} does not have a Meta Campaign company and an admin is trying to edit it")
             await interaction.response.send_message("The player doesn't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
@@ -10,6 +10,7 @@ import os
 from customclient import CustomClient
 from utils import uses_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 logger = getLogger(__name__)
 
 class Backup(GroupCog):
@@ -28,8 +29,8 @@ class Backup(GroupCog):
         return valid
 
     @ac.command(name="create-xls", description="Create an Excel file with the current state of the database")
-    @uses_db(CustomClient().sessionmaker)
-    async def create_xls(self, interaction: Interaction, session: Session):
+    @uses_db(CustomClient().async_sessionmaker)
+    async def create_xls(self, interaction: Interaction, session: AsyncSession):
         await interaction.response.defer(ephemeral=self.use_ephemeral)
         
         # Roll the file and prepare for writing
@@ -37,6 +38,14 @@ class Backup(GroupCog):
         handle_path = self.xls_roller.current_handle.name
         self.xls_roller.close()  # Close the handle, as pandas will be using it
 
+        # reading every table and writing the workbook is the slowest thing the bot does, so it runs as one piece of
+        # synchronous work, which is offloaded to the database threads when DB_OFFLOAD is on
+        await session.run_sync(self._write_xls, handle_path)
+
+        await interaction.followup.send(f"Excel file created: {handle_path}", ephemeral=self.use_ephemeral)
+
+    @staticmethod
+    def _write_xls(session: Session, handle_path: str):
         # Get table names
         table_names = [table.name for table in Base.metadata.tables.values()]
 
@@ -53,11 +62,17 @@ class Backup(GroupCog):
                 logger.debug(f"Writing table {table_name} with {len(df)} rows")
                 df.to_excel(writer, sheet_name=table_name, index=True)
 
-        await interaction.followup.send(f"Excel file created: {handle_path}", ephemeral=self.use_ephemeral)
-
     @ac.command(name="create-sql", description="Create a mysqldump file with the current state of the database")
     async def create_sql(self, interaction: Interaction):
         await interaction.response.defer(ephemeral=self.use_ephemeral)
+        engine = CustomClient().sessionmaker.kw["bind"]
+        if engine.dialect.name == "sqlite":
+            # there is no server to run mysqldump against, SQLite can dump itself
+            self.sql_roller.roll()
+            await asyncio.to_thread(self._dump_sqlite, engine, self.sql_roller.current_handle)
+            await interaction.followup.send(f"SQL dump created: {self.sql_roller.current_handle.name}", ephemeral=self.use_ephemeral)
+            self.sql_roller.close()
+            return
         # we need to use subprocess to call mysqldump
         # for all other parameters, we assume localhost and armco as the user and schema
         
@@ -75,6 +90,15 @@ class Backup(GroupCog):
             await interaction.followup.send(f"SQL dump created: {self.sql_roller.current_handle.name}", ephemeral=self.use_ephemeral)
         self.sql_roller.close()
 
+    @staticmethod
+    def _dump_sqlite(engine, handle):
+        connection = engine.raw_connection()
+        try:
+            for line in connection.driver_connection.iterdump():
+                handle.write(f"{line}\n".encode()) # the roller opens its files in binary
+        finally:
+            connection.close()
+
 bot: Bot = None
 async def setup(_bot: Bot):
     global bot
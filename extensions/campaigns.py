@@ -5,6 +5,7 @@ from models import Campaign, UnitStatus, CampaignInvite, Player
 from utils import uses_db
 from sqlalchemy.orm import Session
 from customclient import CustomClient
+from renderqueue import BULK
 logger = getLogger(__name__)
 class Campaigns(GroupCog):
     def __init__(self, bot: Bot):
@@ -157,7 +158,8 @@ class Campaigns(GroupCog):
             logger.error(f"{interaction.user.name} does not have permission to payout campaign {campaign}")
             await interaction.response.send_message("You don't have permission to payout this campaign", ephemeral=True)
             return
-        # payout all players in the campaign
+        # payout all players in the campaign, the rerenders this causes go in the bulk lane
+        session.info["render_priority"] = BULK
         for unit in _campaign.units:
             unit.player.rec_points += base
             if unit.status == UnitStatus.ACTIVE:
@@ -179,7 +181,7 @@ class Campaigns(GroupCog):
             logger.error(f"{interaction.user.name} does not have permission to invite to campaign {campaign}")
             await interaction.response.send_message("You don't have permission to invite to this campaign", ephemeral=True)
             return
-        _player = session.query(Player).filter(Player.discord_id == player.id).first()
+        _player = Player.by_discord_id(session, player.id)
         if not _player:
             logger.error(f"Player {player.name} doesn't have a Meta Campaign company")
             await interaction.response.send_message("Player doesn't have a Meta Campaign company", ephemeral=True)
@@ -203,7 +205,7 @@ class Campaigns(GroupCog):
             logger.error(f"{interaction.user.name} does not have permission to deactivate player from campaign {campaign}")
             await interaction.response.send_message("You don't have permission to deactivate this player", ephemeral=True)
             return
-        _player = session.query(Player).filter(Player.discord_id == player.id).first()
+        _player = Player.by_discord_id(session, player.id)
         if not _player:
             logger.error(f"Player {player.name} doesn't have a Meta Campaign company")
             await interaction.response.send_message("Player doesn't have a Meta Campaign company", ephemeral=True)
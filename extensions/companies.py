@@ -3,6 +3,7 @@ from discord.ext.commands import GroupCog, Bot
 from discord import Interaction, app_commands as ac, ui, TextStyle, Member
 from models import Player, Unit, UnitStatus
 from customclient import CustomClient
+from renderqueue import DEFERRED
 import templates
 import os
 from utils import has_invalid_url, uses_db
@@ -18,7 +19,7 @@ class Company(GroupCog):
     @uses_db(CustomClient().sessionmaker)
     async def create(self, interaction: Interaction, session: Session):
         # check if the user already has a company
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.snapshot(session, interaction.user.id)
         if player:
             logger.debug(f"User {interaction.user.display_name} already has a Meta Campaign company")
             await interaction.response.send_message("You already have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
@@ -60,14 +61,13 @@ class Company(GroupCog):
                 if has_invalid_url(self.children[1].value):
                     await interaction.response.send_message("Lore cannot contain invalid URLs", ephemeral=CustomClient().use_ephemeral)
                     return
+                # set on the instance, not with a bulk update, so the change listeners queue the render and update the caches
                 _player = session.merge(self.player)
-                session.query(Player).filter(Player.id == _player.id).update({
-                    Player.name: self.children[0].value,
-                    Player.lore: self.children[1].value
-                })
+                _player.name = self.children[0].value
+                _player.lore = self.children[1].value
                 await interaction.response.send_message("Company updated", ephemeral=CustomClient().use_ephemeral)
 
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             logger.debug(f"User {interaction.user.display_name} does not have a Meta Campaign company and is trying to edit it")
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
@@ -80,7 +80,7 @@ class Company(GroupCog):
     @ac.describe(member="The players Meta Campaign company to show")
     @uses_db(CustomClient().sessionmaker)
     async def show(self, interaction: Interaction, session: Session, member: Member):
-        player = session.query(Player).filter(Player.discord_id == member.id).first()
+        player = Player.by_discord_id(session, member.id)
         if not player:
             await interaction.response.send_message(f"{member.display_name} doesn't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -95,11 +95,13 @@ class Company(GroupCog):
     @ac.command(name="refresh", description="Refresh your Meta Campaign company")
     @uses_db(CustomClient().sessionmaker)
     async def refresh(self, interaction: Interaction, session: Session):
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
-        self.bot.queue.put_nowait((1, player))
+        if self.bot.offer((1, player), session) == DEFERRED:
+            await interaction.response.send_message("The bot is busy, your Meta Campaign company will be refreshed as soon as it catches up", ephemeral=CustomClient().use_ephemeral)
+            return
         await interaction.response.send_message("Your Meta Campaign company has been refreshed", ephemeral=CustomClient().use_ephemeral)
 
 bot: Bot = None
@@ -1,8 +1,9 @@
 from logging import getLogger
 from discord.ext.commands import GroupCog, Bot
 from discord import Interaction, app_commands as ac, ChannelType
-from models import Config as Config_model, Dossier, Player, Statistic
+from models import Dossier, Player, Statistic
 from customclient import CustomClient
+from renderqueue import RenderTask, CREATE, BULK
 from utils import uses_db
 from sqlalchemy.orm import Session
 logger = getLogger(__name__)
@@ -50,12 +51,13 @@ class Config(GroupCog):
         self.bot.config["dossier_channel_id"] = interaction.channel.id
         await self.bot.resync_config()
         logger.info(f"Dossier channel set to {interaction.channel.name}")
+        session.info["render_priority"] = BULK # every message is rerendered, keep it out of the way of players using the bot
         old_dossiers = session.query(Dossier).all()
         for dossier in old_dossiers:
             session.delete(dossier)
         session.commit()
         for player in session.query(Player).all():
-            self.bot.queue.put_nowait((0, player))
+            self.bot.offer(RenderTask.for_instance(CREATE, player, priority=BULK), session)
         await interaction.response.send_message(f"Dossier channel set to {interaction.channel.mention}", ephemeral=self.bot.use_ephemeral)
 
     @ac.command(name="setstatistics", description="Set the statistics channel to the current channel")
@@ -67,19 +69,19 @@ class Config(GroupCog):
         self.bot.config["statistics_channel_id"] = interaction.channel.id
         await self.bot.resync_config()
         logger.info(f"Statistics channel set to {interaction.channel.name}")
+        session.info["render_priority"] = BULK # every message is rerendered, keep it out of the way of players using the bot
         old_statistics = session.query(Statistic).all()
         for statistic in old_statistics:
             session.delete(statistic)
         session.commit()
         for player in session.query(Player).all():
-            self.bot.queue.put_nowait((0, player))
+            self.bot.offer(RenderTask.for_instance(CREATE, player, priority=BULK), session)
         await interaction.response.send_message(f"Statistics channel set to {interaction.channel.mention}", ephemeral=self.bot.use_ephemeral)
 
     @ac.command(name="list_configs", description="List all configurations")
-    @uses_db(CustomClient().sessionmaker)
-    async def list_configs(self, interaction: Interaction, session: Session):
-        configs = session.query(Config_model).all()
-        config_list = [f"{config.key}: {config.value}" for config in configs]
+    async def list_configs(self, interaction: Interaction):
+        # served from the config stores' memory, they hold what is about to be written as well as what already is
+        config_list = [f"{store.namespace}.{key}: {value}" for store in (self.bot.config, self.bot.medal_emotes) for key, value in store.items()]
         config_str = "\n".join(config_list)
         await interaction.response.send_message(f"Configurations:\n{config_str}", ephemeral=self.bot.use_ephemeral)
 
@@ -2,16 +2,21 @@ from logging import getLogger
 from pathlib import Path
 from discord.ext.commands import GroupCog, Bot
 from discord import Interaction, app_commands as ac, ui, TextStyle, ButtonStyle, Embed, SelectOption, Forbidden, HTTPException, Message
-from sqlalchemy import text, func
+from sqlalchemy import text, func, select
 import os
-from models import Player
+from models import Player, DeadLetter
 from asyncio import QueueEmpty
 import random
 from customclient import CustomClient
 from utils import uses_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from coloredformatter import stats
-from templates import stats_template
+from templates import stats_template, shard_stats_template, lane_stats_template, metric_stats_template, metric_count_template, metric_timing_template, query_stats_template, query_command_template, query_shape_template, dead_letters_template, dead_letter_template
+from metrics import registry
+from playercache import players
+from searchindex import index as search_index
+from renderqueue import LANE_NAMES, KIND_NAMES
 from datetime import datetime, timedelta
 from psutil import Process
 from MessageManager import MessageManager
@@ -89,9 +94,7 @@ class Debug(GroupCog):
         logger.info(f"Load command invoked for {extension}")
         await interaction.response.send_message(f"Loading {extension} ")
         await self.bot.load_extension(extension)
-        if not self.bot.config.get("EXTENSIONS"):
-            self.bot.config["EXTENSIONS"] = []
-        self.bot.config["EXTENSIONS"].append(extension)
+        self.bot.config.mutate("EXTENSIONS", lambda extensions: extensions + [extension], [])
         await self.bot.tree.sync()
     # unload cannot have "debug" as it's argument, as that would cause a deadlock
     @ac.command(name="unload", description="Unload an extension")
@@ -105,17 +108,17 @@ class Debug(GroupCog):
         logger.info(f"Unload command invoked for {extension}")
         await interaction.response.send_message(f"Unloading {extension}")
         await self.bot.unload_extension(extension)
-        self.bot.config["EXTENSIONS"].remove(extension)
+        self.bot.config.mutate("EXTENSIONS", lambda extensions: [loaded for loaded in extensions if loaded != extension], [])
         await self.bot.tree.sync()
 
     @ac.command(name="query", description="Run a SQL query")
     @ac.describe(query="SQL query to run")
-    @uses_db(CustomClient().sessionmaker)
-    async def query(self, interaction: Interaction, query: str, session: Session):
+    @uses_db(CustomClient().async_sessionmaker)
+    async def query(self, interaction: Interaction, query: str, session: AsyncSession):
         try:
             logger.info(f"Running query: {query}")
-            result = session.execute(text(query))
-            session.commit()
+            result = await session.execute(text(query))
+            await session.commit()
             try:
                 rows = result.fetchall()
             except Exception:
@@ -125,15 +128,15 @@ class Debug(GroupCog):
             logger.error(f"Error running query: {e}")
             await interaction.response.send_message(f"Error: {e}", ephemeral=self.bot.use_ephemeral)
 
-    @uses_db(CustomClient().sessionmaker)
-    async def botcompany(self, interaction: Interaction, _: MessageManager, session: Session):
-        existing = session.query(Player).filter(Player.discord_id == self.bot.user.id).first()
+    @uses_db(CustomClient().async_sessionmaker)
+    async def botcompany(self, interaction: Interaction, _: MessageManager, session: AsyncSession):
+        existing = await session.scalar(select(Player).where(Player.discord_id == self.bot.user.id))
         if existing:
             await interaction.response.send_message("Bot company already exists", ephemeral=self.bot.use_ephemeral)
             return
         player = Player(discord_id=self.bot.user.id, name="Supply Allocation and Management", rec_points=0)
         session.add(player)
-        session.commit()
+        await session.commit()
         await interaction.response.send_message("Bot company created", ephemeral=self.bot.use_ephemeral)
 
     async def rp(self, interaction: Interaction, _: MessageManager):
@@ -193,7 +196,72 @@ class Debug(GroupCog):
         resident = self.process.memory_info().rss / 1024 ** 2 # resident memory in MB
         cpu_time = self.process.cpu_times().user + self.process.cpu_times().system # total CPU time in seconds
         average_cpu = cpu_time / uptime.total_seconds() if uptime.total_seconds() > 0 else 0 # average CPU usage
-        await interaction.response.send_message(stats_template.format(**stats, **locals()), ephemeral=self.bot.use_ephemeral)
+        queued = self.bot.queue.qsize()
+        coalesced = self.bot.queue.coalesced
+        capacity = self.bot.queue.maxsize or "unbounded"
+        deferred = self.bot.queue.deferred
+        retrying = len(self.bot.retries)
+        workers = len(self.bot.queue)
+        edits_avoided = self.bot.edits_avoided
+        cached = len(self.bot.mentions)
+        player_hits, player_misses, player_invalidations = players.stats["hits"], players.stats["misses"], players.stats["invalidations"]
+        players_cached = len(players)
+        searches_indexed, searches_database, search_reloaded, search_players = search_index.stats["index"], search_index.stats["database"], search_index.stats["reloaded"], len(search_index)
+        shards = "\n".join(shard_stats_template.format(shard=shard, depth=self.bot.queue.shards[shard].qsize(),
+                                                        state=f"working on {worker['current']}" if worker["current"] else "idle", **worker)
+                           for shard, worker in enumerate(self.bot.worker_stats))
+        lanes = "\n".join(lane_stats_template.format(lane=LANE_NAMES[lane].capitalize(), **metrics)
+                           for lane, metrics in self.bot.queue.lane_metrics().items())
+        await interaction.response.send_message(stats_template.format(**stats, **self.bot.mentions.stats, **locals()), ephemeral=self.bot.use_ephemeral)
+        # the metrics go in a second message, together they would not fit in one
+        labels = registry.labels()
+        counts = "\n".join(metric_count_template.format(label=label, **{name: registry.counter(name, label) for name in ("processed", "failed", "retried", "dead_lettered", "dropped", "rate_limited")})
+                           for label in labels)
+        timings = "\n".join(metric_timing_template.format(label=label, name=name, count=histogram.count, average=histogram.average, p95=histogram.percentile(0.95), max=histogram.max)
+                            for (name, label), histogram in sorted(registry.histograms.items(), key=lambda item: (item[0][1], item[0][0])))
+        await interaction.followup.send(metric_stats_template.format(counts=counts or "none yet", timings=timings or "none yet"), ephemeral=self.bot.use_ephemeral)
+
+    @uses_db(CustomClient().sessionmaker)
+    async def dead_letters(self, interaction: Interaction, _: MessageManager, session: Session):
+        total = session.query(DeadLetter).count()
+        letters = session.query(DeadLetter).order_by(DeadLetter.id.desc()).limit(10).all()
+        letters = "\n".join(dead_letter_template.format(id=letter.id, kind=KIND_NAMES.get(letter.kind, letter.kind), model=letter.model, pk=letter.pk, attempts=letter.attempts,
+                                                         failed_at=int(letter.failed_at.timestamp()), error=letter.error) for letter in letters)
+        if not total:
+            await interaction.response.send_message("No dead letters", ephemeral=self.bot.use_ephemeral)
+            return
+        view = ui.View()
+        replay = ui.Button(label="Replay all", style=ButtonStyle.primary)
+        purge = ui.Button(label="Purge all", style=ButtonStyle.danger)
+
+        @uses_db(CustomClient().sessionmaker)
+        async def on_replay(_interaction: Interaction, session: Session):
+            replayed = self.bot.replay_dead_letters(session)
+            session.commit()
+            logger.info(f"{_interaction.user.global_name} replayed {replayed} dead letters")
+            await _interaction.response.send_message(f"Replayed {replayed} dead letters", ephemeral=self.bot.use_ephemeral)
+
+        @uses_db(CustomClient().sessionmaker)
+        async def on_purge(_interaction: Interaction, session: Session):
+            purged = self.bot.purge_dead_letters(session)
+            session.commit()
+            logger.info(f"{_interaction.user.global_name} purged {purged} dead letters")
+            await _interaction.response.send_message(f"Purged {purged} dead letters", ephemeral=self.bot.use_ephemeral)
+
+        replay.callback = on_replay
+        purge.callback = on_purge
+        view.add_item(replay)
+        view.add_item(purge)
+        await interaction.response.send_message(dead_letters_template.format(total=total, letters=letters), view=view, ephemeral=self.bot.use_ephemeral)
+
+    async def queries(self, interaction: Interaction, _: MessageManager):
+        # the commands running the most statements first, flagged ones also show the shape that repeated
+        lines = []
+        for name, command in sorted(registry.commands.items(), key=lambda item: item[1].statements, reverse=True)[:15]:
+            lines.append(query_command_template.format(name=name, calls=command.calls, average=command.average, most=command.most, seconds=command.seconds, flagged=command.flagged))
+            if command.shape:
+                lines.append(query_shape_template.format(shape=" ".join(command.shape.split())[:150]))
+        await interaction.response.send_message(query_stats_template.format(commands="\n".join(lines) or "none yet")[:2000], ephemeral=self.bot.use_ephemeral)
 
     @ac.command(name="menu", description="Show the menu")
     async def menu(self, interaction: Interaction):
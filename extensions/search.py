@@ -4,10 +4,52 @@ from discord import Interaction, app_commands as ac, ui, ButtonStyle, SelectOpti
 from sqlalchemy.orm import Session
 from models import Player, Unit
 from customclient import CustomClient
+from searchindex import index, SearchPage
 from utils import uses_db
 
 logger = getLogger(__name__)
 
+def results_message(page: SearchPage, ao: str, unit_type: str) -> str:
+    if not page.total:
+        return f"No players in the AO '{ao}' have a unit of type '{unit_type}'"
+    names = "\n".join(name for _, name in page.players)
+    return f"The names of the players in the AO '{ao}' with a unit of type '{unit_type}', page {page.page + 1}/{page.pages} of {page.total} players\n{names}"
+
+class ResultsView(ui.View):
+    """
+    Pages through the players a search found, every page is looked up again so it reflects changes since the search.
+
+    Attributes:
+        unit_type (str): The unit type that was searched for.
+        ao (str): The area of operation that was searched in.
+        page (int): The page that is shown, counting from 0.
+    """
+    def __init__(self, unit_type: str, ao: str, page: SearchPage):
+        super().__init__()
+        self.unit_type = unit_type
+        self.ao = ao
+        self.show(page)
+
+    def show(self, page: SearchPage):
+        self.page = page.page
+        self.previous_button.disabled = page.page == 0
+        self.next_button.disabled = page.page >= page.pages - 1
+
+    async def turn(self, interaction: Interaction, session: Session, page_number: int):
+        page = index.search(session, self.ao, self.unit_type, page=page_number)
+        self.show(page)
+        await interaction.response.edit_message(content=results_message(page, self.ao, self.unit_type), view=self)
+
+    @ui.button(label="Previous", style=ButtonStyle.secondary)
+    @uses_db(sessionmaker=CustomClient().sessionmaker)
+    async def previous_button(self, interaction: Interaction, button: ui.Button, session: Session):
+        await self.turn(interaction, session, self.page - 1)
+
+    @ui.button(label="Next", style=ButtonStyle.secondary)
+    @uses_db(sessionmaker=CustomClient().sessionmaker)
+    async def next_button(self, interaction: Interaction, button: ui.Button, session: Session):
+        await self.turn(interaction, session, self.page + 1)
+
 class Search(GroupCog):
     """
     A cog for searching players by unit type and area of operation in the Meta Campaign.
@@ -29,8 +71,9 @@ class Search(GroupCog):
         """
                Handles the '/search' command for finding players based on unit type and area of operation.
 
-               This command presents the user with a UI to select a unit type and AO. Once selected, it queries
-               the database for players who match the selected criteria and sends back a list of their names.
+               This command presents the user with a UI to select a unit type and AO. Once selected, it looks up
+               the players with a unit of that type in that AO in the search index, and sends back their names a
+               page at a time.
 
                Args:
                    interaction (Interaction): The interaction that triggered this command.
@@ -40,12 +83,12 @@ class Search(GroupCog):
                    AOSelect (ui.Select): UI component for selecting an area of operation.
                    SearchView (ui.View): View to display TypeSelect and AOSelect options, along with a search button.
                """
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             await interaction.response.send_message("You don't have a Meta Campaign company so you can't search", ephemeral=CustomClient().use_ephemeral)
             return
         unit = session.query(Unit).filter(Unit.player_id == player.id, Unit.active == True).first()
-        aos = session.query(Unit.area_operation).distinct().all()
+        aos = index.areas(session)
 
         class TypeSelect(ui.Select):
             """
@@ -57,7 +100,7 @@ class Search(GroupCog):
             def __init__(self):
                 options = []
                 for unit_type in bot.config["unit_types"]:
-                    if unit and unit_type == unit.type:
+                    if unit and unit_type == unit.unit_type:
                         options.append(SelectOption(label=unit_type, value=unit_type, default=True))
                     else:
                         options.append(SelectOption(label=unit_type, value=unit_type))
@@ -94,36 +137,32 @@ class Search(GroupCog):
 
             def __init__(self):
                 super().__init__()
-                self.add_item(TypeSelect())
-                self.add_item(AOSelect())
+                self.type_select = TypeSelect()
+                self.ao_select = AOSelect()
+                self.add_item(self.type_select)
+                self.add_item(self.ao_select)
 
             @ui.button(label="Search", style=ButtonStyle.primary)
             @uses_db(sessionmaker=CustomClient().sessionmaker)
             async def search_callback(self, interaction: Interaction, button: ui.Button, session: Session):
                 """
-                Executes a search in the database for players matching the selected unit type and AO.
+                Looks up the players matching the selected unit type and AO, and sends the first page of them.
 
                 Args:
                     interaction (Interaction): The interaction that triggered this button click.
                     button (ui.Button): The button component itself.
                 """
-                # create the unit in the database
-                unit_type = self.children[1].values[0]
-                ao = self.children[2].values[0]
+                if not self.type_select.values or not self.ao_select.values:
+                    await interaction.response.send_message("Please select both a unit type and an AO", ephemeral=CustomClient().use_ephemeral)
+                    return
+                unit_type = self.type_select.values[0]
+                ao = self.ao_select.values[0]
                 logger.debug(f"Unit type selected: {unit_type}")
                 logger.debug(f"AO selected: {ao}")
 
-                target_units_in_ao = session.query(Unit.player_id).filter(Unit.area_operation == ao).all()
-                target_units_same_type = session.query(Unit.player_id).filter(Unit.unit_type == unit_type).all()
-                targets = list(set(target_units_in_ao).intersection(target_units_same_type))
-                message = ""
-                for target in targets:
-                    player_name = session.query(Player.name).filter(Player.discord_id == target).first()
-                    message += f"{player_name}\n"
-
-                logger.debug(f"Unit {unit.name} created for player {player.name}")
-                button.disabled = True
-                await interaction.response.send_message(f"The names of the players in the AO '{ao}' with a unit of type '{unit_type}\n{message}",
+                page = index.search(session, ao, unit_type)
+                logger.debug(f"Search for {unit_type} in {ao} found {page.total} players in the {page.source}")
+                await interaction.response.send_message(results_message(page, ao, unit_type), view=ResultsView(unit_type, ao, page),
                                                         ephemeral=CustomClient().use_ephemeral)
 
         view = SearchView()
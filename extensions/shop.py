@@ -17,6 +17,18 @@ async def is_mod(interaction: Interaction):
         logger.warning(f"{interaction.user.name} tried to use shop admin commands")
     return valid
 
+def compatible(upgrades: list[ShopUpgrade], unit_type: str) -> list[ShopUpgrade]:
+    """
+    Filters the upgrades down to the ones that can be bought for a unit of `unit_type`.
+    """
+    # we need to filter the upgrades based on the unit types, but we cannot do it directly in the query
+    compatible_upgrades = []
+    for upgrade in upgrades:
+        for upgrade_type in upgrade.unit_types:
+            if upgrade_type.unit_type in unit_type:
+                compatible_upgrades.append(upgrade)
+    return compatible_upgrades
+
 class Shop(GroupCog):
     def __init__(self, bot: Bot):
         self.bot = bot
@@ -24,7 +36,7 @@ class Shop(GroupCog):
     @ac.command(name="open", description="View the shop")
     @uses_db(CustomClient().sessionmaker)
     async def shop(self, interaction: Interaction, session: Session):
-        _player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        _player = Player.snapshot(session, interaction.user.id)
         if not _player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -164,12 +176,7 @@ class Shop(GroupCog):
         _player = session.query(Player).filter(Player.id == player_id).first()
         _unit = session.query(Unit).filter(Unit.id == unit_id).first()
 
-        # we need to filter the upgrades based on the unit types, but we cannot do it directly in the query
-        compatible_upgrades = []
-        for upgrade in upgrades:
-            for unit_type in upgrade.unit_types:
-                if unit_type.unit_type in _unit.unit_type:
-                    compatible_upgrades.append(upgrade)
+        compatible_upgrades = compatible(upgrades, _unit.unit_type)
         if not compatible_upgrades:
             embed.description = "No upgrades are available for this unit"
             embed.color = 0xff0000
@@ -257,7 +264,7 @@ class Shop(GroupCog):
     @ac.command(name="replace_stockpile", description="Create a new stockpile unit if you don't have one")
     @uses_db(CustomClient().sessionmaker)
     async def replace_stockpile(self, interaction: Interaction, session: Session):
-        _player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        _player = Player.by_discord_id(session, interaction.user.id)
         if not _player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=self.bot.use_ephemeral)
             return
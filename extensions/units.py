@@ -33,7 +33,7 @@ class Unit(GroupCog):
             @ui.button(label="Create Unit", style=ButtonStyle.primary)
             @uses_db(sessionmaker=CustomClient().sessionmaker)
             async def create_unit_callback(self, interaction: Interaction, button: ui.Button, session: Session):
-                player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+                player = Player.by_discord_id(session, interaction.user.id)
                 if not player:
                     await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
                     return
@@ -63,7 +63,7 @@ class Unit(GroupCog):
                 unit = Unit_model(player_id=player.id, name=unit_name, unit_type=unit_type, active=False)
                 session.add(unit)
                 session.commit()
-                CustomClient().queue.put_nowait((1, unit))
+                CustomClient().offer((1, unit), session)
                 logger.debug(f"Unit {unit.name} created for player {player.name}")
                 button.disabled = True
                 await interaction.response.send_message(f"Unit {unit.name} created", ephemeral=CustomClient().use_ephemeral)
@@ -87,7 +87,7 @@ class Unit(GroupCog):
             return
         
         logger.debug(f"Activating unit for {interaction.user.id}")
-        player: Player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player: Player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -161,7 +161,7 @@ class Unit(GroupCog):
     @ac.command(name="remove_unit", description="Remove a proposed unit from your company")
     @uses_db(sessionmaker=CustomClient().sessionmaker)
     async def remove_unit(self, interaction: Interaction, session: Session):
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -188,7 +188,7 @@ class Unit(GroupCog):
                 logger.debug(f"Removing unit {unit.name}")
                 session.delete(unit)
                 session.commit()
-                CustomClient().queue.put_nowait((1, player))
+                CustomClient().offer((1, player), session)
                 await interaction.response.send_message(f"Unit {unit.name} removed", ephemeral=CustomClient().use_ephemeral)
 
         view = View()
@@ -204,7 +204,7 @@ class Unit(GroupCog):
     @uses_db(sessionmaker=CustomClient().sessionmaker)
     async def deactivateunit(self, interaction: Interaction, session: Session):
         logger.debug(f"Deactivating unit for {interaction.user.id}")
-        player: Player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player: Player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -224,7 +224,7 @@ class Unit(GroupCog):
     @ac.describe(player="The player to deliver results for")
     @uses_db(sessionmaker=CustomClient().sessionmaker)
     async def units(self, interaction: Interaction, player: Member, session: Session):
-        player = session.query(Player).filter(Player.discord_id == player.id).first()
+        player = Player.by_discord_id(session, player.id)
         if not player:
             await interaction.response.send_message("User doesn't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
             return
@@ -247,7 +247,7 @@ class Unit(GroupCog):
     @uses_db(sessionmaker=CustomClient().sessionmaker)
     async def rename(self, interaction: Interaction, session: Session):
         logger.info("rename command invoked")
-        player = session.query(Player).filter(Player.discord_id == interaction.user.id).first()
+        player = Player.by_discord_id(session, interaction.user.id)
         if not player:
             logger.error("Player not found for rename command")
             await interaction.response.send_message("You don't have a Meta Campaign company", ephemeral=CustomClient().use_ephemeral)
@@ -300,7 +300,7 @@ class Unit(GroupCog):
                         return
                     _unit.name = new_name
                     session.commit()
-                    CustomClient().queue.put_nowait((1, unit))
+                    CustomClient().offer((1, unit), session)
 
                     logger.info(f"Unit renamed to {new_name}")
                     await interaction.response.send_message(f"Unit renamed to {new_name}", ephemeral=CustomClient().use_ephemeral)
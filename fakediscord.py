@@ -0,0 +1,291 @@
+"""
+An in-process stand-in for the parts of Discord the render pipeline talks to, for measuring it without Discord.
+
+`FakeDiscord` holds channels, messages and users in memory and answers channel sends, message fetches, edits and
+deletes, channel history and `fetch_user` like the HTTP API would, after a configurable latency. Every request goes
+through a token bucket per route, using the same routes as `ratelimit.route_key`, and answers with the same
+`X-RateLimit-*` headers Discord sends. Those are fed to the client's `RatePacer`, and an empty bucket answers 429,
+which is waited out and retried the way discord.py does. Failures can be scripted with `fail`, or injected at
+random with `failure_rate`.
+
+Random latency and failures are drawn from a generator seeded with the seed, the operation, what it targets and
+how many times that target was hit before. So a run sees the same failures however the render workers happen to
+interleave, and the retry behaviour of `queue_consumer` can be compared between runs.
+
+    fake = FakeDiscord(latency=0.005, failure_rate=0.05)
+    fake.add_channel(dossier_channel_id)
+    fake.install(client)
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from logging import getLogger
+from typing import AsyncIterator, Callable, Hashable
+from discord import HTTPException, NotFound, utils as discord_utils
+from discord.abc import Snowflake
+from ratelimit import TokenBucket, route_key
+
+logger = getLogger(__name__)
+
+API = "https://discord.com/api/v10"
+
+# how often discord.py retries a request that was rate limited before giving up on it
+MAX_RATE_LIMIT_RETRIES = 5
+
+class FakeResponse:
+    """
+    The part of an aiohttp response discord.py's exceptions read.
+    """
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+class FakeUser:
+    """
+    A user, `send` is a DM.
+    """
+    def __init__(self, fake: "FakeDiscord", user_id: int, name: str):
+        self._fake = fake
+        self.id = user_id
+        self.name = name
+        self.global_name = name
+        self.mention = f"<@{user_id}>"
+
+    async def send(self, content: str):
+        await self._fake.request("dm", "POST", f"/users/{self.id}/messages", content)
+        self._fake.dms.append((self.id, content))
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeMessage:
+    """
+    A message as it is stored on the fake, or a partial one that only knows its id until it hits the fake.
+    """
+    def __init__(self, channel: "FakeChannel", message_id: int, content: str | None = None, author: FakeUser | None = None):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.author = author
+
+    @property
+    def created_at(self) -> datetime:
+        return discord_utils.snowflake_time(self.id)
+
+    async def edit(self, content: str):
+        await self.channel._fake.edit_message(self.channel.id, self.id, content)
+        self.content = content
+        return self
+
+    async def delete(self):
+        await self.channel._fake.delete_message(self.channel.id, self.id)
+
+    async def fetch(self) -> "FakeMessage":
+        return await self.channel.fetch_message(self.id)
+
+class FakeChannel:
+    """
+    A text channel holding the messages sent to it, by id.
+    """
+    def __init__(self, fake: "FakeDiscord", channel_id: int):
+        self._fake = fake
+        self.id = channel_id
+        self.messages: dict[int, FakeMessage] = {}
+
+    async def send(self, content: str) -> FakeMessage:
+        return await self._fake.send_message(self.id, content)
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self, int(message_id))
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        return await self._fake.fetch_message(self.id, int(message_id))
+
+    async def history(self, limit: int | None = 100, before: datetime | None = None, after: Snowflake | None = None) -> AsyncIterator[FakeMessage]:
+        # in pages of 100 like the real history, newest first, or oldest first when it starts after a message
+        cutoff = discord_utils.time_snowflake(before) if before else None
+        floor = after.id if after else None
+        ids = sorted((message_id for message_id in self.messages if (cutoff is None or message_id < cutoff) and (floor is None or message_id > floor)), reverse=after is None)
+        if limit is not None:
+            ids = ids[:limit]
+        for start in range(0, len(ids), 100):
+            await self._fake.request("history", "GET", f"/channels/{self.id}/messages", start)
+            for message_id in ids[start:start + 100]:
+                if message_id in self.messages:
+                    yield self.messages[message_id]
+
+class FakeDiscord:
+    """
+    Channels, messages and users in memory, behind a simulated HTTP API.
+
+    Attributes:
+        latency (float): The average seconds every request takes.
+        jitter (float): How far the latency of a single request may be off the average, as a fraction of it.
+        failure_rate (float): The chance that a request fails with a 500.
+        seed (int): Seeds the latency and the failures.
+        limit (int): How many requests every route allows per `period`.
+        period (float): How many seconds a rate limit window lasts.
+        channels (dict[int, FakeChannel]): The channels by id.
+        users (dict[int, FakeUser]): The users `fetch_user` knows, by id.
+        requests (Counter[str]): How many requests were made of every operation, retries after a 429 included.
+        failures (Counter[str]): How many requests of every operation failed, scripted or injected.
+        throttled (int): How many requests were answered with a 429.
+        written (dict[int, float]): The `time.monotonic` of the last send or edit of every message, by message id.
+        dms (list[tuple[int, str]]): The user id and content of every DM.
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.5, failure_rate: float = 0.0, seed: int = 0, limit: int = 50, period: float = 1.0):
+        if not 0 <= failure_rate < 1:
+            raise ValueError("Failure rate must be at least 0 and below 1.")
+        if limit <= 0:
+            raise ValueError("Limit must be greater than 0.")
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.limit = limit
+        self.period = period
+        self.channels: dict[int, FakeChannel] = {}
+        self.users: dict[int, FakeUser] = {}
+        self.bot_user = FakeUser(self, 10 ** 17, "S.A.M.")
+        self.requests: Counter[str] = Counter()
+        self.failures: Counter[str] = Counter()
+        self.throttled = 0
+        self.written: dict[int, float] = {}
+        self.dms: list[tuple[int, str]] = []
+        self.observers: list[Callable[[str, str, int, dict[str, str]], None]] = []
+        self._buckets: dict[Hashable, TokenBucket] = {}
+        self._scripted: dict[str, list[int]] = {}
+        self._seen: Counter[tuple] = Counter()
+        self._last_id = 0
+
+    def add_channel(self, channel_id: int) -> FakeChannel:
+        return self.channels.setdefault(int(channel_id), FakeChannel(self, int(channel_id)))
+
+    def add_user(self, user_id: int, name: str = "") -> FakeUser:
+        return self.users.setdefault(int(user_id), FakeUser(self, int(user_id), name or f"user{user_id}"))
+
+    def get_channel(self, channel_id: int | None) -> FakeChannel | None:
+        return self.channels.get(int(channel_id)) if channel_id else None
+
+    def fail(self, operation: str, times: int = 1, status: int = 500):
+        """
+        Makes the next `times` requests of an operation fail with `status`, whatever the failure rate.
+
+        The operations are send, fetch, edit, delete, history, fetch_user and dm.
+        """
+        self._scripted.setdefault(operation, []).extend([status] * times)
+
+    def remove(self, channel_id: int, message_id: int):
+        """
+        Deletes a message without a request, the way a mod deleting it in the client would.
+        """
+        self.channels[int(channel_id)].messages.pop(int(message_id), None)
+
+    def install(self, client):
+        """
+        Points a client at the fake, and its rate limit headers at the client's pacer.
+        """
+        client.get_channel = self.get_channel
+        client.get_user = lambda user_id: None # nothing is in the gateway cache, so users are fetched
+        client.fetch_user = self.fetch_user
+        client._connection.user = self.bot_user
+        self.observers.append(lambda method, url, status, headers: client.pacer.observe(method, url, status, headers))
+
+    def _draw(self, *key) -> random.Random:
+        # a str seed is hashed the same way on every run, unlike hash() of a tuple
+        return random.Random(f"{self.seed}:{':'.join(map(str, key))}")
+
+    def _observe(self, method: str, url: str, status: int, headers: dict[str, str]):
+        for observer in self.observers:
+            observer(method, url, status, headers)
+
+    async def request(self, operation: str, method: str, path: str, target: Hashable):
+        """
+        Simulates one HTTP request, waiting out the latency and any rate limit, and raising if it fails.
+
+        Args:
+            operation (str): What the request does, for the counters and `fail`.
+            method (str): The HTTP method, which with `path` picks the rate limit bucket.
+            path (str): The path of the request under the API.
+            target (Hashable): What the request is about, so the same request draws the same latency and failure.
+        """
+        url = f"{API}{path}"
+        key = route_key(method, url)
+        attempt = self._seen[(operation, target)]
+        self._seen[(operation, target)] += 1
+        draw = self._draw(operation, target, attempt)
+        for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+            self.requests[operation] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency * draw.uniform(1 - self.jitter, 1 + self.jitter))
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(key, TokenBucket(self.limit, self.period))
+            retry_after = bucket.delay(now)
+            if retry_after <= 0:
+                break
+            self.throttled += 1
+            self._observe(method, url, 429, {"Retry-After": f"{retry_after:.3f}", "X-RateLimit-Scope": "user"})
+            logger.debug(f"{operation} on {key} rate limited, retrying in {retry_after:.3f}s")
+            await asyncio.sleep(retry_after)
+        else:
+            raise HTTPException(FakeResponse(429, "Too Many Requests"), f"{operation} on {key} is still rate limited")
+        bucket.tokens -= 1
+        headers = {"X-RateLimit-Limit": str(bucket.limit), "X-RateLimit-Remaining": str(bucket.tokens),
+                   "X-RateLimit-Reset-After": f"{max(0.0, bucket.reset_at - now):.3f}"}
+        status = self._scripted[operation].pop(0) if self._scripted.get(operation) else None
+        if status is None and self.failure_rate and draw.random() < self.failure_rate:
+            status = 500
+        self._observe(method, url, status or 200, headers)
+        if status is not None:
+            self.failures[operation] += 1
+            raise HTTPException(FakeResponse(status, "Injected failure"), f"{operation} failed with {status}")
+
+    def _message(self, channel_id: int, message_id: int, operation: str) -> FakeMessage:
+        message = self.channels[channel_id].messages.get(message_id)
+        if message is None:
+            self.failures[operation] += 1
+            raise NotFound(FakeResponse(404, "Not Found"), "Unknown Message")
+        return message
+
+    def _next_id(self) -> int:
+        # real snowflakes, so the message times and the history cutoff of verify_messages work on them
+        self._last_id = max(self._last_id + 1, discord_utils.time_snowflake(discord_utils.utcnow()))
+        return self._last_id
+
+    async def send_message(self, channel_id: int, content: str) -> FakeMessage:
+        await self.request("send", "POST", f"/channels/{channel_id}/messages", (channel_id, content))
+        channel = self.channels[channel_id]
+        message = FakeMessage(channel, self._next_id(), content, self.bot_user)
+        channel.messages[message.id] = message
+        self.written[message.id] = time.monotonic()
+        return message
+
+    async def fetch_message(self, channel_id: int, message_id: int) -> FakeMessage:
+        await self.request("fetch", "GET", f"/channels/{channel_id}/messages/{message_id}", (channel_id, message_id))
+        return self._message(channel_id, message_id, "fetch")
+
+    async def edit_message(self, channel_id: int, message_id: int, content: str):
+        await self.request("edit", "PATCH", f"/channels/{channel_id}/messages/{message_id}", (channel_id, content))
+        self._message(channel_id, message_id, "edit").content = content
+        self.written[message_id] = time.monotonic()
+
+    async def delete_message(self, channel_id: int, message_id: int):
+        await self.request("delete", "DELETE", f"/channels/{channel_id}/messages/{message_id}", (channel_id, message_id))
+        self._message(channel_id, message_id, "delete")
+        del self.channels[channel_id].messages[message_id]
+
+    async def fetch_user(self, user_id: int) -> FakeUser:
+        await self.request("fetch_user", "GET", f"/users/{user_id}", user_id)
+        if int(user_id) not in self.users:
+            self.failures["fetch_user"] += 1
+            raise NotFound(FakeResponse(404, "Not Found"), "Unknown User")
+        return self.users[int(user_id)]
+
+    def stats(self) -> dict[str, object]:
+        return {"requests": dict(self.requests), "failures": dict(self.failures), "throttled": self.throttled}
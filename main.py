@@ -2,7 +2,6 @@ import logging
 from dotenv import load_dotenv
 import sys
 import os
-from utils import uses_db
 from coloredformatter import ColoredFormatter
 if not os.path.exists("global.env"):
     raise FileNotFoundError("global.env not found")
@@ -34,9 +33,10 @@ logging.basicConfig(level=logging.DEBUG,
                     ],
                     force=True) # needed to delete the default stderr handler
 # rest of the imports   
-from sqlalchemy import create_engine, text
+from database import create_db_engine, engine_options, on_connect
+from utils import async_database_url # utils imports metrics, which reads its settings from the env files loaded above
 from sqlalchemy.orm import sessionmaker
-from models import Base
+import migrations
 from customclient import CustomClient
 import asyncio
 
@@ -45,32 +45,44 @@ logger = logging.getLogger(__name__)
 
 
 # create a DB engine
-engine = create_engine(
-    url = os.getenv("DATABASE_URL"),
-    pool_pre_ping= True,
-    pool_size=10,
-    max_overflow=20)
+engine = create_db_engine(os.getenv("DATABASE_URL")) # the pool and per connection settings depend on the dialect, see database.py
 
 logger.debug("Database engine created with URL: %s", os.getenv("DATABASE_URL"))
 
-# create the tables
-Base.metadata.create_all(bind=engine)
-logger.info("Database tables created successfully.")
+# create the async engine, for the code that has moved to it, only when it is switched on
+async_engine = None
+AsyncSession = None
+if os.getenv("DB_ASYNC", "false").lower() == "true":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_url = os.getenv("ASYNC_DATABASE_URL") or async_database_url(os.getenv("DATABASE_URL"))
+    async_engine = create_async_engine(async_url, **engine_options(async_url))
+    on_connect(async_engine.sync_engine)
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+    logger.debug("Async database engine created")
+
+# create the tables and indexes, or bring them up to date, this does nothing when the schema is already current
+migrations.upgrade(engine)
+logger.info("Database schema ready.")
 
 # create a session
 Session = sessionmaker(bind=engine)
 session = Session()
-session.execute(text("SET SESSION innodb_lock_wait_timeout = 10")) # set the lock timeout to 10 seconds only for the global session
 
 logger.debug("Session created successfully.")
 
 # create the bot
-bot = CustomClient(session, sessionmaker=Session)
+bot = CustomClient(session, sessionmaker=Session, async_sessionmaker=AsyncSession)
 logger.info("Bot created successfully.")
 
 # start the bot
 logger.info("starting bot")
-asyncio.run(bot.start())
+async def run():
+    try:
+        await bot.start()
+    finally:
+        if async_engine:
+            await async_engine.dispose() # the async pool has to be closed from inside the loop
+asyncio.run(run())
 logger.info("Bot terminated")
 
 # close the session
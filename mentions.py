@@ -0,0 +1,80 @@
+"""
+Mention and user resolution for the render queue.
+
+A mention is nothing more than `<@id>`, so rendered messages build it straight from the discord id we already store
+on the Player, without asking Discord for the user. When a real `User` is needed (to DM someone), `MentionResolver`
+looks in the gateway's user cache first, then in its own bounded TTL/LRU cache, and only calls `fetch_user` when
+both miss.
+"""
+
+import time
+from collections import OrderedDict
+from logging import getLogger
+from discord import Client, User, NotFound
+
+logger = getLogger(__name__)
+
+class MentionResolver:
+    """
+    Resolves mentions and users for discord ids, with as few HTTP requests as possible.
+
+    Users that don't exist are cached too, so a stale id doesn't cost a request every time it is looked up.
+
+    Attributes:
+        maxsize (int): How many users the cache holds before the least recently used one is evicted.
+        ttl (float): How many seconds a fetched user stays valid.
+        stats (dict[str, int]): Mentions built directly from an id, and gateway, cache hit and cache miss counts for `resolve`.
+    """
+    def __init__(self, client: Client, maxsize: int = 1024, ttl: float = 3600.0):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0.")
+        self.client = client
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache: OrderedDict[int, tuple[float, User | None]] = OrderedDict()
+        self.stats = {"direct": 0, "gateway": 0, "hits": 0, "misses": 0}
+
+    def mention(self, discord_id: int | str | None) -> str:
+        """
+        Builds the mention for a discord id, or an empty string if the id isn't a valid snowflake.
+        """
+        try:
+            user_id = int(discord_id)
+        except (TypeError, ValueError):
+            logger.warning(f"Can't mention invalid discord id {discord_id!r}")
+            return ""
+        self.stats["direct"] += 1
+        return f"<@{user_id}>"
+
+    async def resolve(self, discord_id: int | str) -> User | None:
+        """
+        Finds the user for a discord id, returning None if Discord doesn't know it.
+        """
+        user_id = int(discord_id)
+        user = self.client.get_user(user_id)
+        if user is not None:
+            self.stats["gateway"] += 1
+            return user
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[0] > now:
+            self._cache.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return cached[1]
+        self.stats["misses"] += 1
+        try:
+            user = await self.client.fetch_user(user_id)
+        except NotFound:
+            logger.warning(f"User {user_id} not found")
+            user = None
+        self._cache[user_id] = (now + self.ttl, user)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return user
+
+    def invalidate(self, discord_id: int | str):
+        self._cache.pop(int(discord_id), None)
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,244 @@
+"""
+A small in-process metrics registry for the render pipeline.
+
+Counters and histograms are keyed by a name and a label, the label being the kind of render task that was running
+when the value was recorded. The render workers set `task_label` for the duration of a task, and because it is a
+ContextVar, every database query and Discord request made while handling that task is attributed to it, without
+passing anything down to the code that makes them.
+
+Every call of a `uses_db` function is also accounted on its own: the statements it ran, the time they took, and
+how often each statement shape repeated. A shape that repeats `N_PLUS_ONE_THRESHOLD` times in one call is almost
+always a query per row that should have been a join or an IN, so the call is flagged as N+1 and logged.
+
+`registry` is the process wide instance, like the log `stats` in coloredformatter.
+"""
+
+import asyncio
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from os import getenv
+from types import SimpleNamespace
+import aiohttp
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = getLogger(__name__)
+
+task_label: ContextVar[str] = ContextVar("task_label", default="other")
+
+# how many times one statement shape may run in a single call before the call is flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+# bucket upper bounds in seconds, anything slower lands in the last, open ended bucket
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """
+    A fixed bucket histogram of durations in seconds.
+
+    Attributes:
+        counts (list[int]): How many values fell in each bucket of `BUCKETS`, plus one for everything above the last.
+        count (int): How many values were recorded.
+        total (float): The sum of all recorded values.
+        max (float): The largest recorded value.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimates a percentile as the upper bound of the bucket it falls in, capped at the largest value seen.
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def __repr__(self):
+        return f"Histogram(count={self.count}, average={self.average:.4f}, max={self.max:.4f})"
+
+class QueryLog:
+    """
+    The statements run during one call of a `uses_db` function.
+
+    The shape of a statement is its SQL with the parameters left out, so the same query for different rows has the
+    same shape.
+
+    Attributes:
+        name (str): The qualified name of the function.
+        count (int): How many statements were run.
+        seconds (float): How long they took together.
+        shapes (Counter[str]): How many times each shape was run.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement] += 1
+
+    def merge(self, other: "QueryLog"):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.shapes.update(other.shapes)
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        return [(shape, times) for shape, times in self.shapes.most_common() if times >= threshold]
+
+query_log: ContextVar[QueryLog | None] = ContextVar("query_log", default=None)
+
+class CommandStats:
+    """
+    The query accounting of every call of one `uses_db` function, added up.
+
+    Attributes:
+        calls (int): How many times the function was called.
+        statements (int): How many statements all of its calls ran.
+        seconds (float): How long those statements took.
+        most (int): The most statements a single call ran.
+        flagged (int): How many calls were flagged as N+1.
+        shape (str | None): The most repeated shape of the last flagged call.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.statements = 0
+        self.seconds = 0.0
+        self.most = 0
+        self.flagged = 0
+        self.shape: str | None = None
+
+    @property
+    def average(self) -> float:
+        return self.statements / self.calls if self.calls else 0.0
+
+class MetricsRegistry:
+    """
+    Holds every counter and histogram of the process, keyed by `(name, label)`.
+    """
+    def __init__(self):
+        self.counters: dict[tuple[str, str], int] = {}
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.commands: dict[str, CommandStats] = {}
+
+    def inc(self, name: str, label: str | None = None, amount: int = 1):
+        key = (name, label or task_label.get())
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, label: str | None = None):
+        key = (name, label or task_label.get())
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, label: str | None = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, label)
+
+    def labels(self) -> list[str]:
+        return sorted({label for _, label in self.counters} | {label for _, label in self.histograms})
+
+    def counter(self, name: str, label: str) -> int:
+        return self.counters.get((name, label), 0)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.commands.clear()
+
+    @contextmanager
+    def account(self, name: str):
+        """
+        Accounts the statements run inside the block to `name`. A nested block is also added to the one around it.
+        """
+        log = QueryLog(name)
+        token = query_log.set(log)
+        try:
+            yield log
+        finally:
+            query_log.reset(token)
+            if (parent := query_log.get()) is not None:
+                parent.merge(log)
+            self.settle(log)
+
+    def settle(self, log: QueryLog):
+        stats = self.commands.setdefault(log.name, CommandStats())
+        stats.calls += 1
+        stats.statements += log.count
+        stats.seconds += log.seconds
+        stats.most = max(stats.most, log.count)
+        if repeated := log.repeated():
+            stats.flagged += 1
+            stats.shape, times = repeated[0]
+            logger.warning(f"Possible N+1 in {log.name}: {log.count} statements, one shape ran {times} times: {' '.join(stats.shape.split())[:200]}")
+
+    async def watch_loop_lag(self, interval: float = 0.5):
+        """
+        Records how late the event loop wakes from a sleep of `interval` as the `loop_lag` histogram, anything that
+        blocks the loop (a slow query run on it, for one) shows up here.
+        """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("loop_lag", max(0.0, time.perf_counter() - start - interval), label="loop")
+
+    def instrument_engine(self, engine=Engine):
+        """
+        Times every query run through `engine`, or through every engine if none is given, as the `db` histogram.
+        """
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            self.observe("db", elapsed)
+            if (log := query_log.get()) is not None:
+                log.record(statement, elapsed)
+
+    def instrument_trace(self, trace: aiohttp.TraceConfig) -> aiohttp.TraceConfig:
+        """
+        Adds timing of every HTTP request to a TraceConfig, as the `http` histogram.
+        """
+        async def on_request_start(session, context: SimpleNamespace, params):
+            context.metrics_start = time.perf_counter()
+
+        async def on_request_end(session, context: SimpleNamespace, params):
+            self.observe("http", time.perf_counter() - context.metrics_start)
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_end)
+        return trace
+
+registry = MetricsRegistry()
@@ -0,0 +1,81 @@
+"""
+A small versioned migration runner, replacing the `create_all` main.py used to run on every start.
+
+`create_all` only creates missing tables, it can't add an index or a column to a table that already exists. Every
+change to the schema is now also a migration: a function registered with `@migration(version, description)`,
+applied once, in version order, each in a transaction of its own, and recorded in the SchemaVersion table. On start
+`upgrade` compares the recorded version with the latest one and does nothing at all when they match.
+
+A new model needs a migration that creates its table (`Base.metadata.create_all` with the table is fine), a new
+index or column one that adds it to existing databases, so fresh and existing databases end up the same.
+"""
+
+from datetime import datetime
+from logging import getLogger
+from typing import Callable
+from sqlalchemy import func, select, insert
+from sqlalchemy.engine import Connection, Engine
+from models import Base, SchemaVersion, Unit, Medals, PlayerUpgrade, ShopUpgradeUnitTypes
+
+logger = getLogger(__name__)
+
+MIGRATIONS: dict[int, tuple[str, Callable[[Connection], None]]] = {}
+
+def migration(version: int, description: str):
+    def decorator(fn: Callable[[Connection], None]):
+        if version in MIGRATIONS:
+            raise ValueError(f"Migration {version} is defined twice")
+        MIGRATIONS[version] = (description, fn)
+        return fn
+    return decorator
+
+@migration(1, "Baseline, create every table that doesn't exist yet")
+def baseline(connection: Connection):
+    # this is what create_all did on every start, the databases that exist already were all made by it
+    Base.metadata.create_all(bind=connection)
+
+@migration(2, "Composite indexes for the hottest unit and medal filters")
+def composite_indexes(connection: Connection):
+    for table in (Unit.__table__, Medals.__table__):
+        for index in table.indexes:
+            if len(index.columns) > 1:
+                index.create(bind=connection, checkfirst=True)
+
+@migration(3, "Indexes on the foreign keys the roster, shop and payout queries join on")
+def foreign_key_indexes(connection: Connection):
+    # InnoDB indexes every foreign key on its own, SQLite doesn't, so without these the benchmarks scan where MySQL seeks
+    # (on MySQL the new index takes over from the one InnoDB made for the constraint)
+    for column in (PlayerUpgrade.__table__.c.unit_id, Unit.__table__.c.campaign_id, ShopUpgradeUnitTypes.__table__.c.shop_upgrade_id):
+        for index in column.table.indexes:
+            if list(index.columns) == [column]:
+                index.create(bind=connection, checkfirst=True)
+
+def latest_version() -> int:
+    return max(MIGRATIONS, default=0)
+
+def current_version(connection: Connection) -> int:
+    return connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+
+def upgrade(engine: Engine) -> int:
+    """
+    Applies every migration newer than the recorded schema version, and returns the version the schema is at.
+    """
+    with engine.begin() as connection:
+        SchemaVersion.__table__.create(bind=connection, checkfirst=True)
+        version = current_version(connection)
+    latest = latest_version()
+    if version == latest:
+        logger.info(f"Database schema is up to date at version {version}")
+        return version
+    if version > latest:
+        logger.warning(f"Database schema is at version {version}, newer than this code knows ({latest})")
+        return version
+    for target in sorted(v for v in MIGRATIONS if v > version):
+        description, fn = MIGRATIONS[target]
+        logger.info(f"Migrating database schema to version {target}: {description}")
+        with engine.begin() as connection:
+            fn(connection)
+            connection.execute(insert(SchemaVersion).values(version=target, description=description, applied_at=datetime.now()))
+        version = target
+    logger.info(f"Database schema migrated to version {version}")
+    return version
@@ -1,6 +1,11 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey, PickleType, Boolean, BigInteger, event
-from sqlalchemy.orm import relationship, backref, declarative_base
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, PickleType, Boolean, BigInteger, DateTime, Text, UniqueConstraint, Index, event, select, insert
+from sqlalchemy.orm import relationship, backref, declarative_base, object_session, Session
+from datetime import datetime
+from hashlib import sha256
 from enum import Enum as PyEnum
+from typing import Callable
+from renderqueue import owner_of, CREATE, UPDATE, DELETE, TERMINATE, INTERACTIVE
+from playercache import players, PlayerSnapshot
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,23 +30,121 @@ class UnitStatus(PyEnum):
 
 # Listeners
 
+def _owner_id(connection, target) -> int | None:
+    # upgrades only know their unit, so look the owning player up on the flushing connection
+    if isinstance(target, PlayerUpgrade) and target.unit_id is not None:
+        return connection.execute(select(Unit.player_id).where(Unit.id == target.unit_id)).scalar()
+    return owner_of(target)
+
+def _record_change(connection, kind: int, target):
+    """
+    Notes the render task a changed row calls for in its session. Nothing is written per row, the changes of a flush
+    are deduplicated and written to the RenderOutbox together once it is done, see `write_changes`.
+    """
+    session = object_session(target)
+    if session is None:
+        logger.debug(f"{target} changed outside of a session, it has no render task to record")
+        return
+    changes: dict[tuple[str, int], int] = session.info.setdefault("render_changes", {})
+    if isinstance(target, PlayerUpgrade) and target.unit_id is not None and kind != DELETE:
+        # owners of upgrades are looked up together, one query for the whole flush
+        session.info.setdefault("render_units", set()).add(target.unit_id)
+        return
+    owner = _owner_id(connection, target) # a deleted upgrade's unit may be gone by the end of the flush, look it up now
+    if owner is not None:
+        # anything a player owns is rendered as an update of that player
+        key, kind = ("Player", owner), kind if isinstance(target, Player) else UPDATE
+    elif isinstance(target, (Dossier, Statistic)) and target.message_id:
+        # the row is gone by the time the task runs, so keep the id of the Discord message that has to go with it
+        key = (target.__class__.__name__, int(target.message_id))
+    else:
+        logger.debug(f"{target} has no render task to record")
+        return
+    changes[key] = min(kind, changes.get(key, kind)) # a create covers any update of the same player
+
+def write_changes(session: Session, flush_context):
+    """
+    `after_flush_postexec` hook, writes the deduplicated render tasks of a flush to the RenderOutbox, in the flush's
+    transaction so they commit or roll back with it. A task already written earlier in the transaction isn't written again.
+    """
+    changes: dict[tuple[str, int], int] = session.info.pop("render_changes", {})
+    units = session.info.pop("render_units", None)
+    if not changes and not units:
+        return
+    connection = session.connection()
+    if units:
+        for player_id, in connection.execute(select(Unit.player_id).where(Unit.id.in_(units)).distinct()):
+            changes[("Player", player_id)] = min(UPDATE, changes.get(("Player", player_id), UPDATE))
+    written: dict[tuple[str, int], int] = session.info.setdefault("render_written", {})
+    # bulk producers mark their session, so the work they cause waits in the bulk lane
+    priority = session.info.get("render_priority", INTERACTIVE)
+    rows = [{"kind": kind, "model": model, "pk": pk, "priority": priority}
+            for (model, pk), kind in changes.items() if written.get((model, pk), TERMINATE) > kind]
+    if rows:
+        connection.execute(insert(RenderOutbox), rows)
+        written.update({(row["model"], row["pk"]): row["kind"] for row in rows})
+        session.info["outbox_written"] = True # lets the after_commit hook know there is something to drain
+
+_change_subscribers: list[Callable[[frozenset[int]], None]] = []
+
+def subscribe_changes(callback: Callable[[frozenset[int]], None]):
+    """
+    Calls `callback` after every commit that changed players, once, with the set of their ids.
+    """
+    _change_subscribers.append(callback)
+
+def publish_changes(session: Session):
+    written = session.info.pop("render_written", None)
+    if not written:
+        return
+    players_changed = frozenset(pk for model, pk in written if model == "Player")
+    for callback in _change_subscribers:
+        try:
+            callback(players_changed)
+        except Exception as e:
+            logger.error(f"Error publishing changed players to {callback}: {e}")
+
+def discard_changes(session: Session, *args):
+    # nothing of a rolled back transaction is published
+    for key in ("render_changes", "render_units", "render_written"):
+        session.info.pop(key, None)
+
+def _invalidate_player(target):
+    players.invalidate(target.discord_id, target.id)
+    session = object_session(target)
+    if session is not None:
+        # invalidated again once the transaction ends, see invalidate_changed_players
+        session.info.setdefault("players_changed", set()).add((target.discord_id, target.id))
+
+def invalidate_changed_players(session, *args):
+    # a lookup made by another session between the flush and the commit still read the old row, drop what it cached
+    for discord_id, player_id in session.info.pop("players_changed", ()):
+        players.invalidate(discord_id, player_id)
+
+def reset_render_priority(session, *args):
+    # sessions are reused by the scoped sessions in uses_db, so a bulk hint must not outlive its transaction
+    session.info.pop("render_priority", None)
+
 def after_insert(mapper, connection, target):
     logger.debug(f"{target} was inserted into the database")
-    from customclient import CustomClient
-    queue = CustomClient().queue
-    queue.put_nowait((0, target))
+    if isinstance(target, Player):
+        _invalidate_player(target)
+    _record_change(connection, CREATE, target)
 
 def after_update(mapper, connection, target):
     logger.debug(f"{target} was updated in the database")
-    from customclient import CustomClient
-    queue = CustomClient().queue
-    queue.put_nowait((1, target))
+    if isinstance(target, Player):
+        _invalidate_player(target)
+    _record_change(connection, UPDATE, target)
 
 def after_delete(mapper, connection, target):
     logger.debug(f"{target} was deleted from the database")
-    from customclient import CustomClient
-    queue = CustomClient().queue
-    queue.put_nowait((2, target))
+    _record_change(connection, DELETE, target)
+
+def after_player_delete(mapper, connection, target):
+    # a deleted company has nothing left to render, it only has to leave the player cache
+    logger.debug(f"{target} was deleted from the database")
+    _invalidate_player(target)
 
 
 class BaseModel(Base):
@@ -70,6 +173,12 @@ class BaseModel(Base):
 
 class Unit(BaseModel):
     __tablename__ = "units"
+    # composite indexes for the hottest filters, existing databases get them from migrations.py
+    __table_args__ = (
+        Index("ix_units_player_id_active", "player_id", "active"),
+        Index("ix_units_player_id_status", "player_id", "status"),
+        Index("ix_units_area_operation_unit_type", "area_operation", "unit_type"),
+    )
     # columns
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(30), index=True)
@@ -78,7 +187,7 @@ class Unit(BaseModel):
     status = Column(Enum(UnitStatus), default=UnitStatus.PROPOSED) # status is still an enum, but type is a string now
     legacy = Column(Boolean, default=False)
     active = Column(Boolean, default=False)
-    campaign_id = Column(Integer, ForeignKey("campaigns.id"), nullable=True)
+    campaign_id = Column(Integer, ForeignKey("campaigns.id"), index=True, nullable=True)
     callsign = Column(String(15), index=True, unique=True)
     area_operation = Column(String(30), default="ARMCO")
     original_type = Column(String(15), nullable=True)
@@ -126,6 +235,27 @@ class Player(BaseModel):
     medals = relationship("Medals", back_populates="player", cascade="none")
     campaign_invites = relationship("CampaignInvite", back_populates="player", cascade="none")
 
+    @classmethod
+    def snapshot(cls, session: Session, discord_id: int | str) -> PlayerSnapshot | None:
+        """
+        The cached snapshot of the company of a discord user, read from the database only on a cache miss.
+        """
+        return players.get(discord_id, lambda: session.execute(
+            select(cls.id, cls.discord_id, cls.name, cls.rec_points, cls.bonus_pay).where(cls.discord_id == str(discord_id))).first())
+
+    @classmethod
+    def by_discord_id(cls, session: Session, discord_id: int | str) -> "Player | None":
+        """
+        The company of a discord user, found through the player cache and loaded by primary key.
+        """
+        snapshot = cls.snapshot(session, discord_id)
+        if snapshot is None:
+            return None
+        player = session.get(cls, snapshot.id)
+        if player is None:
+            players.invalidate(discord_id, snapshot.id) # deleted behind the listeners' back, by a raw query
+        return player
+
 class PlayerUpgrade(BaseModel):
     __tablename__ = "player_upgrades"
     # columns
@@ -133,7 +263,7 @@ class PlayerUpgrade(BaseModel):
     type = Column(Enum(UpgradeType))
     name = Column(String(30), index=True)
     original_price = Column(Integer, default=0)
-    unit_id = Column(Integer, ForeignKey("units.id"))
+    unit_id = Column(Integer, ForeignKey("units.id"), index=True)
     shop_upgrade_id = Column(Integer, ForeignKey("shop_upgrades.id"))
     # relationships
     unit = relationship("Unit", back_populates="upgrades", lazy="joined")
@@ -162,8 +292,26 @@ class Config(BaseModel):
     key = Column(String(255), index=True, unique=True)
     value = Column(PickleType)
 
+class SchemaVersion(BaseModel):
+    __tablename__ = "schema_versions"
+    # one row per migration applied by migrations.py, the highest version is the version of the schema
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), default="")
+    applied_at = Column(DateTime, default=datetime.now)
+
+class ConfigEntry(BaseModel):
+    __tablename__ = "config_entries"
+    # one row per key of a ConfigStore, JSON encoded, so a key can be read or written without touching the others
+    __table_args__ = (UniqueConstraint("namespace", "key"),)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    namespace = Column(String(64), index=True, nullable=False)
+    key = Column(String(255), nullable=False)
+    value = Column(Text, nullable=False)
+    version = Column(Integer, default=0)
+
 class Medals(BaseModel):
     __tablename__ = "medals"
+    __table_args__ = (Index("ix_medals_player_id_name", "player_id", "name"),)
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(30), index=True)
     player_id = Column(Integer, ForeignKey("players.id"), index=True)
@@ -188,10 +336,45 @@ class ShopUpgrade(BaseModel):
     unit_types = relationship("ShopUpgradeUnitTypes", back_populates="shop_upgrade", cascade="all, delete-orphan", lazy="subquery")
     required_upgrade = relationship("ShopUpgrade", remote_side=[id], lazy="joined")
 
+class RenderOutbox(BaseModel):
+    __tablename__ = "render_outbox"
+    # pending render tasks, written by the listeners in the same transaction as the change that caused them
+    # the outbox pump keeps the ids of the rows it queued in CustomClient._outbox_queued until a worker deletes them,
+    # and every pass queues the pending rows that aren't among them, whatever order their ids committed in
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    kind = Column(Integer, nullable=False)
+    model = Column(String(30), nullable=False)
+    pk = Column(BigInteger, nullable=False) # the Discord message id for Dossier and Statistic deletions, as their row is gone
+    attempts = Column(Integer, default=0)
+    priority = Column(Integer, default=INTERACTIVE) # the render queue lane, see renderqueue.INTERACTIVE and renderqueue.BULK
+    not_before = Column(DateTime, default=datetime.now, index=True)
+
+class DeadLetter(BaseModel):
+    __tablename__ = "dead_letters"
+    # render tasks that ran out of retries, kept for inspection, replay or purging from the debug menu
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    kind = Column(Integer, nullable=False)
+    model = Column(String(30), nullable=False)
+    pk = Column(BigInteger, nullable=False)
+    attempts = Column(Integer, default=0)
+    priority = Column(Integer, default=INTERACTIVE)
+    error = Column(String(255), default="")
+    failed_at = Column(DateTime, default=datetime.now)
+
+class RenderCache(BaseModel):
+    __tablename__ = "render_cache"
+    # a fingerprint of the content last posted in every dossier and statistics message, to skip edits that change nothing
+    message_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    content_hash = Column(String(64), nullable=False)
+
+    @staticmethod
+    def fingerprint(content: str) -> str:
+        return sha256(content.encode()).hexdigest()
+
 class ShopUpgradeUnitTypes(BaseModel):
     __tablename__ = "shop_upgrade_unit_types"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    shop_upgrade_id = Column(Integer, ForeignKey("shop_upgrades.id"))
+    shop_upgrade_id = Column(Integer, ForeignKey("shop_upgrades.id"), index=True)
     unit_type = Column(String(15))
     shop_upgrade = relationship("ShopUpgrade", back_populates="unit_types", lazy="joined")
 
@@ -201,5 +384,13 @@ class ShopUpgradeUnitTypes(BaseModel):
 [event.listen(model, "after_insert", after_insert) for model in [Player, Unit, PlayerUpgrade]]
 [event.listen(model, "after_update", after_update) for model in [Player, Unit, PlayerUpgrade]]
 [event.listen(model, "after_delete", after_delete) for model in [PlayerUpgrade, Dossier, Statistic]]
+event.listen(Player, "after_delete", after_player_delete)
+event.listen(Session, "after_commit", reset_render_priority)
+event.listen(Session, "after_rollback", reset_render_priority)
+event.listen(Session, "after_commit", invalidate_changed_players)
+event.listen(Session, "after_rollback", invalidate_changed_players)
+event.listen(Session, "after_flush_postexec", write_changes)
+event.listen(Session, "after_commit", publish_changes)
+event.listen(Session, "after_rollback", discard_changes)
 
 create_all = Base.metadata.create_all
@@ -0,0 +1,89 @@
+"""
+PlayerCache maps discord ids to a snapshot of the player's company, for the lookup nearly every command starts with.
+
+The snapshot holds the columns commands read to identify a player, and it is keyed by the discord id the
+interaction already carries, so a repeated lookup is a memory hit. Users without a company are cached too, so the
+check in `/company create` doesn't cost a query either. The Player listeners in models.py invalidate an entry when
+its row is inserted, updated or deleted, once at flush and once more at commit, so a read made by another session
+between the two can't leave a stale snapshot behind.
+
+`players` is the process wide instance, like `registry` in metrics.
+"""
+
+import threading
+from collections import OrderedDict
+from logging import getLogger
+from os import getenv
+from typing import Any, Callable, NamedTuple
+
+logger = getLogger(__name__)
+
+class PlayerSnapshot(NamedTuple):
+    id: int
+    discord_id: str
+    name: str
+    rec_points: int
+    bonus_pay: int
+
+class PlayerCache:
+    """
+    A bounded LRU cache of PlayerSnapshots, keyed by discord id.
+
+    Attributes:
+        maxsize (int): How many discord ids the cache holds before the least recently used one is evicted.
+        stats (dict[str, int]): Hit, miss and invalidation counts.
+    """
+    def __init__(self, maxsize: int = 2048):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be greater than 0.")
+        self.maxsize = maxsize
+        self._cache: OrderedDict[str, PlayerSnapshot | None] = OrderedDict()
+        self._discord_ids: dict[int, str] = {} # player id to discord id, so an entry can be found from the row
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._lock = threading.Lock() # the listeners run on whichever thread flushed or committed, the offloaded ones too
+
+    def get(self, discord_id: int | str, load: Callable[[], Any]) -> PlayerSnapshot | None:
+        """
+        Returns the snapshot for a discord id, calling `load` for the row on a miss. None means there is no company.
+        """
+        key = str(discord_id)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._cache[key]
+            self.stats["misses"] += 1
+        row = load() # not under the lock, the query shouldn't hold up the listeners
+        snapshot = PlayerSnapshot(*row) if row is not None else None
+        with self._lock:
+            self._cache[key] = snapshot
+            if snapshot is not None:
+                self._discord_ids[snapshot.id] = key
+            while len(self._cache) > self.maxsize:
+                _, evicted = self._cache.popitem(last=False)
+                if evicted is not None:
+                    self._discord_ids.pop(evicted.id, None)
+        return snapshot
+
+    def invalidate(self, discord_id: int | str | None = None, player_id: int | None = None):
+        """
+        Drops the entry of a discord id, and the entry of a player id, which matters when the discord id itself changed.
+        """
+        keys = {str(discord_id)} if discord_id is not None else set()
+        with self._lock:
+            if player_id is not None and player_id in self._discord_ids:
+                keys.add(self._discord_ids.pop(player_id))
+            for key in keys:
+                if (snapshot := self._cache.pop(key, None)) is not None:
+                    self._discord_ids.pop(snapshot.id, None)
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._discord_ids.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+players = PlayerCache(int(getenv("PLAYER_CACHE_SIZE", 2048)))
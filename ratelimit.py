@@ -0,0 +1,157 @@
+"""
+Rate limit aware pacing for the render queue.
+
+Discord reports what is left of every rate limit bucket in the `X-RateLimit-*` headers of each response. The
+`RatePacer` listens to those headers through an `aiohttp.TraceConfig` handed to discord.py as `http_trace`, and keeps
+a token bucket per route, so the queue consumer can burst while a bucket has headroom and wait exactly as long as
+Discord asks once it runs dry, instead of sleeping a fixed amount between every task.
+
+The pacer never talks to Discord itself, anything that can call `RatePacer.observe` with a method, url, status and
+headers (like a fake HTTP layer) can drive it.
+"""
+
+import asyncio
+import re
+import time
+from logging import getLogger
+from typing import Hashable, Mapping
+import aiohttp
+from metrics import registry
+
+logger = getLogger(__name__)
+
+# the major parameters Discord buckets its rate limits on
+MAJOR_PARAMETER = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+
+def route_key(method: str, url: str) -> Hashable:
+    """
+    Maps a request onto the key of the bucket that paces it, which is the method and the major parameter of the url.
+    """
+    match = MAJOR_PARAMETER.search(str(url))
+    major = f"{match.group(1)}:{match.group(2)}" if match else str(url)
+    return (method.upper(), major)
+
+def channel_route(method: str, channel_id: int) -> Hashable:
+    """
+    The bucket key for a request against a channel, the same key `route_key` gives its url.
+    """
+    return (method.upper(), f"channels:{channel_id}")
+
+class TokenBucket:
+    """
+    A token bucket mirroring one Discord rate limit bucket.
+
+    Attributes:
+        limit (int): How many requests the bucket allows per window.
+        tokens (int): How many requests are left in the current window.
+        reset_at (float): The `time.monotonic` value at which the window resets and the bucket is full again.
+    """
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.tokens = limit
+        self.reset_at = 0.0
+
+    def refill(self, now: float):
+        if now >= self.reset_at:
+            self.tokens = self.limit
+            self.reset_at = now + self.period
+
+    def delay(self, now: float) -> float:
+        """
+        How long a caller has to wait before a token is available, 0 if one is available right now.
+        """
+        self.refill(now)
+        if self.tokens > 0:
+            return 0.0
+        return self.reset_at - now
+
+    def update(self, limit: int, remaining: int, reset_after: float, now: float):
+        self.limit = limit
+        self.tokens = min(self.tokens, remaining) if now < self.reset_at else remaining
+        self.period = max(self.period, reset_after)
+        self.reset_at = now + reset_after
+
+    def __repr__(self):
+        return f"TokenBucket(limit={self.limit}, tokens={self.tokens}, period={self.period})"
+
+class RatePacer:
+    """
+    Paces requests per route with token buckets that are corrected from Discord's rate limit headers.
+
+    Buckets start at `default_limit` requests per `default_period` seconds until Discord tells us otherwise. A 429
+    empties the offending bucket for the requested retry time, or pauses every bucket if the limit was global.
+
+    Attributes:
+        buckets (dict): The token bucket for every route seen so far.
+        waited (float): Total seconds spent waiting for tokens.
+        throttled (int): How many 429 responses have been observed.
+    """
+    def __init__(self, default_limit: int = 5, default_period: float = 5.0):
+        self.default_limit = default_limit
+        self.default_period = default_period
+        self.buckets: dict[Hashable, TokenBucket] = {}
+        self.global_reset_at = 0.0
+        self.waited = 0.0
+        self.throttled = 0
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.default_limit, self.default_period)
+        return self.buckets[key]
+
+    async def acquire(self, *keys: Hashable):
+        """
+        Waits until every given bucket has a token, then takes one from each.
+        """
+        while True:
+            now = time.monotonic()
+            delay = max([self.global_reset_at - now] + [self.bucket(key).delay(now) for key in keys])
+            if delay <= 0:
+                break
+            logger.debug(f"Pacing {keys} for {delay:.2f}s")
+            self.waited += delay
+            await asyncio.sleep(delay)
+        for key in keys:
+            self.buckets[key].tokens -= 1
+
+    def observe(self, method: str, url: str, status: int, headers: Mapping[str, str]):
+        """
+        Corrects the bucket for a request from the headers of its response.
+        """
+        now = time.monotonic()
+        key = route_key(method, url)
+        if status == 429:
+            self.throttled += 1
+            registry.inc("rate_limited")
+            retry_after = float(headers.get("Retry-After") or headers.get("X-RateLimit-Reset-After") or self.default_period)
+            if headers.get("X-RateLimit-Global") or headers.get("X-RateLimit-Scope") == "global":
+                logger.warning(f"Global rate limit hit, pausing all routes for {retry_after}s")
+                self.global_reset_at = now + retry_after
+                return
+            logger.warning(f"Rate limit hit on {key}, backing off for {retry_after}s")
+            bucket = self.bucket(key)
+            bucket.tokens = 0
+            bucket.reset_at = now + retry_after
+            return
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        try:
+            limit = int(headers.get("X-RateLimit-Limit", self.default_limit))
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_after = float(headers.get("X-RateLimit-Reset-After", self.default_period))
+        except ValueError:
+            logger.error(f"Malformed rate limit headers for {key}: {dict(headers)}")
+            return
+        self.bucket(key).update(limit, remaining, reset_after, now)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Builds a TraceConfig that feeds every finished request into `observe`, for the `http_trace` option of discord.py.
+        """
+        async def on_request_end(session, context, params: aiohttp.TraceRequestEndParams):
+            self.observe(params.method, str(params.url), params.response.status, params.response.headers)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_end.append(on_request_end)
+        return trace
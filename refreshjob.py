@@ -0,0 +1,177 @@
+"""
+RefreshJob rerenders the dossier and statistics messages of every player, for `/admin refresh_stats`.
+
+Instead of loading the whole players table and queueing every player at once, the job walks the player ids in keyset
+pages, queues one page in the bulk lane, and waits for that page to be rendered before it moves on, so the render
+queue never holds more than a page of refresh work, and a page is only done once none of its players are waiting
+anywhere: in the queue, on a worker, on the retry heap or in the RenderOutbox. The unit messages of a page are rendered up front with a single
+query (`CustomClient.generate_unit_messages`), so the workers don't run one each. The state of the job, up to the id of the last finished
+page, is kept under `refresh` in the `JOBS` ConfigStore (`CustomClient.jobs`), and `RefreshJob.resume` picks an
+interrupted job back up from there after a restart.
+"""
+
+import asyncio
+import time
+from os import getenv
+from logging import getLogger
+from typing import Any
+from sqlalchemy.orm import Session
+from models import Player, RenderOutbox
+from renderqueue import RenderTask, UPDATE, BULK
+
+logger = getLogger(__name__)
+
+CONFIG_KEY = "refresh" # the key of the job in CustomClient.jobs
+PAGE_SIZE = int(getenv("REFRESH_PAGE_SIZE", 50))
+RATE = float(getenv("REFRESH_RATE", 5))
+
+class RefreshJob:
+    """
+    A bulk refresh of every player, fed to the render queue a page at a time.
+
+    Attributes:
+        channel_id (int): The channel the progress message is posted in.
+        page_size (int): How many players are queued at once.
+        rate (float): The most players per second the job queues, 0 for no limit.
+        last_id (int): The id of the last player of the last finished page.
+        done (int): How many players have been refreshed so far.
+        total (int): How many players there were to refresh when the job started.
+        message_id (int | None): The id of the progress message, once it is posted.
+    """
+    def __init__(self, client, channel_id: int, page_size: int = PAGE_SIZE, rate: float = RATE, last_id: int = 0, done: int = 0, total: int = 0, message_id: int | None = None):
+        if page_size <= 0:
+            raise ValueError("Page size must be greater than 0.")
+        self.client = client
+        self.channel_id = channel_id
+        self.page_size = page_size
+        self.rate = rate
+        self.last_id = last_id
+        self.done = done
+        self.total = total
+        self.message_id = message_id
+
+    @classmethod
+    def start(cls, client, channel_id: int, session: Session, **kwargs) -> "RefreshJob":
+        """
+        Starts a new refresh job, reporting in the given channel.
+        """
+        job = cls(client, channel_id, total=session.query(Player).count(), **kwargs)
+        job.save()
+        client.refresh_job = asyncio.create_task(job.run())
+        return job
+
+    @classmethod
+    def resume(cls, client, **kwargs) -> "RefreshJob | None":
+        """
+        Resumes the refresh job that was running when the bot stopped, if there was one.
+        """
+        state = client.jobs.get(CONFIG_KEY)
+        if not state:
+            return None
+        job = cls(client, **state, **kwargs)
+        logger.info(f"Resuming refresh job after player {job.last_id}, {job.done}/{job.total} done")
+        client.refresh_job = asyncio.create_task(job.run())
+        return job
+
+    @staticmethod
+    def running(client) -> bool:
+        task = getattr(client, "refresh_job", None)
+        return task is not None and not task.done()
+
+    def state(self) -> dict[str, Any]:
+        return {"channel_id": self.channel_id, "last_id": self.last_id, "done": self.done, "total": self.total, "message_id": self.message_id}
+
+    def save(self):
+        self.client.jobs[CONFIG_KEY] = self.state()
+
+    def next_page(self, session: Session) -> list[int]:
+        return [player_id for player_id, in session.query(Player.id).filter(Player.id > self.last_id).order_by(Player.id).limit(self.page_size)]
+
+    async def run(self):
+        logger.info(f"Refresh job started after player {self.last_id}")
+        # the job reads through the awaitable session, so its queries are offloaded to the database threads when DB_OFFLOAD is on
+        async with self.client.async_sessionmaker() as session:
+            try:
+                while page := await session.run_sync(self.next_page):
+                    started = time.monotonic()
+                    await session.commit() # don't hold the read open while the page renders
+                    while self.client.queue.room() < len(page):
+                        await asyncio.sleep(1) # leave the room in the queue to interactive work while it is busy
+                    await self.prerender(session, page)
+                    for player_id in page:
+                        self.client.offer(RenderTask.for_player(UPDATE, player_id, priority=BULK))
+                    await self.wait_for(session, page)
+                    for player_id in page:
+                        self.client.prerendered.pop(player_id, None) # players without a statistics message never used theirs
+                    self.last_id = page[-1]
+                    self.done += len(page)
+                    await self.report(f"Refreshing statistics and dossiers: {self.done}/{self.total} players")
+                    self.save()
+                    await self.client.jobs.flush_async() # a restart resumes after this page, not before it
+                    if self.rate > 0:
+                        await asyncio.sleep(max(0.0, len(page) / self.rate - (time.monotonic() - started)))
+                del self.client.jobs[CONFIG_KEY]
+                await self.client.jobs.flush_async()
+                await self.report(f"Refreshed statistics and dossiers for all {self.done} players")
+                logger.info(f"Refresh job finished, {self.done} players refreshed")
+            except asyncio.CancelledError:
+                logger.info(f"Refresh job stopped after player {self.last_id}, it will resume on the next start")
+                raise
+
+    async def prerender(self, session, page: list[int]):
+        """
+        Renders the unit messages of a whole page with one query, for the render workers to use instead of a query each.
+
+        The page is claimed in `prerendered` before the units are read, so a commit that changes one of its players
+        while they are read drops the claim, and that player's worker renders them fresh.
+        """
+        for player_id in page:
+            self.client.prerendered[player_id] = None
+        try:
+            messages = await session.run_sync(lambda sync_session: self.client.generate_unit_messages(page, sync_session))
+            await session.commit()
+        except Exception as e:
+            # the workers render the page on their own, a query per player
+            logger.error(f"Error prerendering the unit messages of the page after player {self.last_id}: {e}")
+            await session.rollback()
+            messages = {}
+        for player_id in page:
+            if player_id in self.client.prerendered and player_id in messages:
+                self.client.prerendered[player_id] = messages[player_id]
+            else:
+                self.client.prerendered.pop(player_id, None)
+
+    @staticmethod
+    def outboxed(session: Session, page: list[int]) -> bool:
+        """
+        Whether any player of the page has a row in the RenderOutbox, deferred or queued and not yet rendered.
+        """
+        return session.query(RenderOutbox.id).filter(RenderOutbox.model == "Player", RenderOutbox.pk.in_(page)).first() is not None
+
+    async def wait_for(self, session, page: list[int]):
+        """
+        Waits until every player of a page is rendered, or given up on.
+        """
+        while True:
+            # memory first, a task only moves from the outbox into memory, and its row stays until it is rendered
+            if not any(self.client.rendering(("Player", player_id)) for player_id in page):
+                outboxed = await session.run_sync(self.outboxed, page)
+                await session.commit()
+                if not outboxed:
+                    return
+            await asyncio.sleep(1)
+
+    async def report(self, text: str):
+        """
+        Posts or edits the progress message. Failing to report never stops the job.
+        """
+        channel = self.client.get_channel(self.channel_id)
+        if channel is None:
+            return
+        try:
+            if self.message_id is None:
+                self.message_id = (await channel.send(text)).id
+            else:
+                await channel.get_partial_message(self.message_id).edit(content=text)
+        except Exception as e:
+            logger.error(f"Error reporting refresh job progress: {e}")
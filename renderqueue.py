@@ -0,0 +1,392 @@
+"""
+RenderQueue is a coalescing `asyncio.Queue` used to feed the dossier and statistics renderer in `CustomClient`.
+
+Every change to a Player, or to something a Player owns (Unit, PlayerUpgrade), collapses onto a single pending
+task for that player, so a burst of listener events only ever produces one Discord edit. Tasks that are not owned
+by a player (Dossier and Statistic deletions, the terminate signal) are queued under their own key.
+
+Pending tasks wait in one of two lanes. Interactive work (a player changing their own company) is served first, bulk
+work (refreshing every player from an admin command) fills in behind it, but every few interactive tasks one bulk
+task is let through, so a steady stream of interactive work can never starve the bulk lane.
+
+Tasks raised by the model listeners arrive through the RenderOutbox table, so they survive a restart, see
+`CustomClient.outbox_pump`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# task kinds, these match the keys of the handler table in CustomClient.queue_consumer
+CREATE = 0
+UPDATE = 1
+DELETE = 2
+TERMINATE = 4
+KIND_NAMES = {CREATE: "create", UPDATE: "update", DELETE: "delete", TERMINATE: "terminate"}
+
+# priority lanes, lower is served first
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# results of ShardedRenderQueue.offer
+ACCEPTED = 0
+DEFERRED = 1
+
+class RenderTask:
+    """
+    A single pending unit of render work.
+
+    Tasks only carry the name and primary key of the row they are for, never a model instance, so nothing captured
+    in a listener's flush is kept alive while the task waits, and handlers always load fresh state by primary key.
+
+    Attributes:
+        kind (int): One of CREATE, UPDATE, DELETE or TERMINATE.
+        model (str | None): The name of the model the task is for, "Player" for everything rendered as a player.
+        pk (int | None): The primary key of the row the task is for, or the Discord message id for Dossier and Statistic deletions.
+        attempts (int): How many times the task has failed so far.
+        enqueued_at (float): The `time.monotonic` value at which the task was created, used for the wait metrics.
+        priority (int): The lane the task waits in, INTERACTIVE or BULK.
+        outbox_ids (set[int]): The ids of the RenderOutbox rows this task settles once it is done.
+    """
+    __slots__ = ("kind", "model", "pk", "attempts", "enqueued_at", "priority", "outbox_ids")
+
+    def __init__(self, kind: int, model: str | None = None, pk: int | None = None, attempts: int = 0, priority: int = INTERACTIVE):
+        self.kind = kind
+        self.model = model
+        self.pk = pk
+        self.attempts = attempts
+        self.enqueued_at = time.monotonic()
+        self.priority = priority
+        self.outbox_ids: set[int] = set()
+
+    @classmethod
+    def for_player(cls, kind: int, player_id: int, attempts: int = 0, priority: int = INTERACTIVE) -> "RenderTask":
+        return cls(kind, "Player", player_id, attempts, priority)
+
+    @classmethod
+    def for_instance(cls, kind: int, instance: Any, attempts: int = 0, priority: int = INTERACTIVE) -> "RenderTask":
+        """
+        Builds a task for a model instance, resolving the owning player from its loaded state.
+
+        Any change to something a player owns is a plain update of that player's messages, so those tasks are
+        normalized to UPDATE here, which keeps the merge rules simple. Only the ids are kept, not the instance.
+        """
+        player_id = owner_of(instance)
+        if player_id is not None:
+            if instance.__class__.__name__ != "Player" and kind != TERMINATE:
+                kind = UPDATE
+            return cls.for_player(kind, player_id, attempts, priority)
+        return cls(kind, instance.__class__.__name__, instance.id, attempts, priority)
+
+    @classmethod
+    def from_tuple(cls, task: tuple) -> "RenderTask":
+        """
+        Builds a RenderTask from the legacy `(kind, instance[, fail_count])` tuple form still used by the extensions.
+        """
+        kind = task[0]
+        instance = task[1] if len(task) > 1 else None
+        attempts = task[2] if len(task) > 2 else 0
+        if instance is None:
+            return cls(kind, attempts=attempts)
+        return cls.for_instance(kind, instance, attempts=attempts)
+
+    @classmethod
+    def from_outbox(cls, row) -> "RenderTask":
+        """
+        Builds a RenderTask from a RenderOutbox row, the listeners already resolved player owned rows to their player.
+        """
+        task = cls(row.kind, row.model, row.pk, row.attempts, row.priority)
+        task.outbox_ids.add(row.id)
+        return task
+
+    @property
+    def player_id(self) -> int | None:
+        """
+        The id of the player whose messages need to be rendered, None for tasks that are not owned by a player.
+        """
+        return self.pk if self.model == "Player" else None
+
+    @property
+    def key(self) -> Hashable:
+        if self.kind == TERMINATE:
+            return ("TERMINATE", id(self)) # never merge the terminate signal
+        return (self.model, self.pk)
+
+    def merge(self, newer: "RenderTask"):
+        """
+        Folds a newer task for the same key into this one.
+
+        A pending create is kept (the create handler renders the latest state anyway), and the attempt count is reset
+        to the lowest of the two so fresh work is never dropped for an old failure. Interactive work promotes a
+        pending bulk task, the task keeps its original enqueue time.
+        """
+        if self.player_id is not None:
+            self.kind = min(self.kind, newer.kind)
+        else:
+            self.kind = newer.kind
+        self.attempts = min(self.attempts, newer.attempts)
+        self.outbox_ids |= newer.outbox_ids
+        self.priority = min(self.priority, newer.priority)
+
+    def __repr__(self):
+        return f"RenderTask(kind={self.kind}, model={self.model}, pk={self.pk}, attempts={self.attempts}, priority={self.priority})"
+
+def owner_of(instance: Any) -> int | None:
+    """
+    Finds the id of the player that owns an instance, without emitting any SQL.
+
+    Returns None when the instance isn't player owned, or when the owner can't be found from loaded state.
+    """
+    # imported here to avoid a circular import, models imports this module for its listeners
+    from models import Player, Unit, PlayerUpgrade
+    if isinstance(instance, Player):
+        return instance.id
+    if isinstance(instance, Unit):
+        return instance.player_id
+    if isinstance(instance, PlayerUpgrade):
+        unit = instance.__dict__.get("unit") # only use the relationship if it is already loaded
+        return unit.player_id if unit is not None else None
+    return None
+
+class RenderQueue(asyncio.Queue):
+    """
+    An `asyncio.Queue` that holds at most one pending task per key, in an interactive and a bulk lane.
+
+    Putting a task whose key is already pending merges it into the pending task in place, so it keeps its position
+    in the queue rather than moving to the back, unless the merge promotes a bulk task to the interactive lane.
+    Plain tuples are accepted and converted with `RenderTask.from_tuple`.
+
+    `get` serves the interactive lane first, but after `bulk_every` interactive tasks in a row while bulk work is
+    waiting, the oldest bulk task is served instead.
+
+    Attributes:
+        coalesced (int): How many puts have been merged into an already pending task.
+        lanes (dict[int, OrderedDict]): The keys of the pending tasks in each lane, in the order they are served.
+        lane_stats (dict[int, dict]): How many tasks each lane has served, and their total and longest wait in seconds.
+    """
+    def __init__(self, maxsize: int = 0, bulk_every: int = 4):
+        if bulk_every <= 0:
+            raise ValueError("bulk_every must be greater than 0.")
+        self.bulk_every = bulk_every
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        # the base class sizes the queue with len(self._queue), so the pending map takes its place
+        self._queue: OrderedDict[Hashable, RenderTask] = OrderedDict()
+        self.lanes: dict[int, OrderedDict[Hashable, None]] = {lane: OrderedDict() for lane in LANE_NAMES}
+        self.lane_stats = {lane: {"served": 0, "wait_total": 0.0, "wait_max": 0.0} for lane in LANE_NAMES}
+        self.coalesced = 0
+        self._interactive_streak = 0
+
+    def _next_lane(self) -> int:
+        if not self.lanes[BULK]:
+            return INTERACTIVE
+        if not self.lanes[INTERACTIVE] or self._interactive_streak >= self.bulk_every:
+            return BULK
+        return INTERACTIVE
+
+    def _get(self) -> RenderTask:
+        lane = self._next_lane()
+        self._interactive_streak = self._interactive_streak + 1 if lane == INTERACTIVE else 0
+        key, _ = self.lanes[lane].popitem(last=False)
+        task = self._queue.pop(key)
+        wait = time.monotonic() - task.enqueued_at
+        stats = self.lane_stats[lane]
+        stats["served"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        return task
+
+    def _put(self, task: RenderTask | tuple):
+        if isinstance(task, tuple):
+            task = RenderTask.from_tuple(task)
+        key = task.key
+        pending = self._queue.get(key)
+        if pending is None:
+            self._queue[key] = task
+            self.lanes[task.priority][key] = None
+            return
+        lane = pending.priority
+        pending.merge(task)
+        if pending.priority != lane:
+            del self.lanes[lane][key]
+            self.lanes[pending.priority][key] = None
+        self.coalesced += 1
+        # the base class counts every put as unfinished work, but a merged put will never be handed out by get
+        self._unfinished_tasks -= 1
+        logger.debug(f"Coalesced {task} into pending task for {key}")
+
+    def depth(self, lane: int) -> int:
+        return len(self.lanes[lane])
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._queue
+
+class ShardedRenderQueue:
+    """
+    Splits render work over several RenderQueues, one per worker, by player id.
+
+    All of a player's tasks land on the same shard, so they are handled in order by a single worker while other
+    players are rendered in parallel. Producers use it like a single queue, the terminate signal is sent to every shard.
+
+    The queue holds at most `maxsize` pending tasks over all shards. `offer` is how producers respect that, it refuses
+    new work once the queue is full and leaves it to the caller to store the task somewhere durable, while `put_nowait`
+    always queues, for work that has to stay in memory like a retried task or the terminate signal.
+
+    Attributes:
+        shards (list[RenderQueue]): One queue per worker.
+        maxsize (int): How many tasks may be pending before `offer` defers, 0 for no limit.
+        low_water (int): The depth the queue has to drain to before deferred work is taken back in.
+        deferred (int): How many offers have been deferred.
+    """
+    def __init__(self, shard_count: int, bulk_every: int = 4, maxsize: int = 0):
+        if shard_count <= 0:
+            raise ValueError("Shard count must be greater than 0.")
+        self.shards = [RenderQueue(bulk_every=bulk_every) for _ in range(shard_count)]
+        self.maxsize = maxsize
+        self.low_water = maxsize // 2
+        self.deferred = 0
+
+    def shard_for(self, task: RenderTask) -> int:
+        if task.player_id is not None:
+            return task.player_id % len(self.shards)
+        return hash(task.key) % len(self.shards)
+
+    def put_nowait(self, task: RenderTask | tuple):
+        if isinstance(task, tuple):
+            task = RenderTask.from_tuple(task)
+        if task.kind == TERMINATE:
+            for shard in self.shards:
+                shard.put_nowait(RenderTask(TERMINATE))
+            return
+        self.shards[self.shard_for(task)].put_nowait(task)
+
+    async def put(self, task: RenderTask | tuple):
+        self.put_nowait(task) # the shards are unbounded, so this never has to wait
+
+    def offer(self, task: RenderTask | tuple) -> int:
+        """
+        Queues a task if there is room for it, without ever blocking.
+
+        A task that merges into one that is already pending always fits, as it doesn't make the queue any longer.
+
+        Returns:
+            int: ACCEPTED if the task was queued, DEFERRED if the queue is full and the caller has to keep the task.
+        """
+        if isinstance(task, tuple):
+            task = RenderTask.from_tuple(task)
+        if task.kind != TERMINATE and task.key not in self and self.room() <= 0:
+            self.deferred += 1
+            return DEFERRED
+        self.put_nowait(task)
+        return ACCEPTED
+
+    def room(self) -> int:
+        """
+        How many more tasks fit in the queue, never less than 0.
+        """
+        if self.maxsize <= 0:
+            return sys.maxsize
+        return max(0, self.maxsize - self.qsize())
+
+    def full(self) -> bool:
+        return self.room() <= 0
+
+    def get_nowait(self) -> RenderTask:
+        for shard in self.shards:
+            if not shard.empty():
+                return shard.get_nowait()
+        raise asyncio.QueueEmpty
+
+    def qsize(self) -> int:
+        return sum(shard.qsize() for shard in self.shards)
+
+    def empty(self) -> bool:
+        return all(shard.empty() for shard in self.shards)
+
+    @property
+    def coalesced(self) -> int:
+        return sum(shard.coalesced for shard in self.shards)
+
+    def lane_metrics(self) -> dict[int, dict]:
+        """
+        Sums the depth and wait times of every lane over all shards.
+
+        Returns:
+            dict[int, dict]: Per lane, the `depth`, the number of tasks `served`, and the `avg_wait` and `max_wait` in seconds.
+        """
+        metrics = {}
+        for lane in LANE_NAMES:
+            served = sum(shard.lane_stats[lane]["served"] for shard in self.shards)
+            wait_total = sum(shard.lane_stats[lane]["wait_total"] for shard in self.shards)
+            metrics[lane] = {
+                "depth": sum(shard.depth(lane) for shard in self.shards),
+                "served": served,
+                "avg_wait": wait_total / served if served else 0.0,
+                "max_wait": max(shard.lane_stats[lane]["wait_max"] for shard in self.shards),
+            }
+        return metrics
+
+    def __contains__(self, key: Hashable) -> bool:
+        return any(key in shard for shard in self.shards)
+
+    def __len__(self):
+        return len(self.shards)
+
+class RetryScheduler:
+    """
+    Holds failed tasks back until their backoff has passed, then puts them back on the queue.
+
+    Every waiting task sits on a single timer heap served by one coroutine, `run`, so a burst of failures costs one
+    sleep rather than one per task. The backoff doubles with every attempt up to `cap`, and half of it is random
+    jitter, so tasks that failed together (a Discord outage) don't all come back at the same moment.
+
+    Attributes:
+        queue (ShardedRenderQueue): Where tasks go once their delay is over.
+        base (float): The delay in seconds before the first retry, before jitter.
+        cap (float): The longest delay in seconds, before jitter.
+    """
+    def __init__(self, queue: ShardedRenderQueue, base: float = 2.0, cap: float = 300.0):
+        self.queue = queue
+        self.base = base
+        self.cap = cap
+        self._heap: list[tuple[float, int, RenderTask]] = []
+        self._order = itertools.count() # breaks ties between tasks due at the same moment, tasks can't be compared
+        self._wakeup = asyncio.Event()
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.cap, self.base * 2 ** max(0, attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(self, task: RenderTask, delay: float):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._order), task))
+        self._wakeup.set() # the new task may be due before the one run is sleeping on
+        logger.debug(f"Retrying {task} in {delay:.2f}s")
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, task = heapq.heappop(self._heap)
+                task.enqueued_at = now # the wait of the retry starts now
+                self.queue.put_nowait(task)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._heap[0][0] - now if self._heap else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def __contains__(self, key: Hashable) -> bool:
+        return any(task.key == key for _, _, task in self._heap)
+
+    def __len__(self):
+        return len(self._heap)
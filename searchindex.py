@@ -0,0 +1,260 @@
+"""
+SearchIndex answers `/search` from memory: which players have a unit in an area of operation, of a unit type, with a
+status, in a campaign.
+
+Every distinct `(area_operation, unit_type, status, campaign_id)` of the units table is a key, and the index holds the
+set of players with a unit under each key. The players matching a search are kept sorted by name for the
+`SEARCH_CACHE_SIZE` most recent searches, and changed players are moved in and out of those lists one at a time, so
+a repeated search or a page turn costs a slice, however large the roster is.
+
+The index is loaded with one query the first time it is searched. After that it is kept up to date from the change
+events models.py publishes after every commit (`subscribe_changes`), plus the player and unit deletes, which don't
+publish anything because they have nothing to render. A change only marks its players dirty, their rows are loaded
+again together, with one query, by the next search. With `SEARCH_INDEX` set to false, or if loading the index
+fails, every search is a single query against the database instead.
+
+`index` is the process wide instance, like `players` in playercache.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from logging import getLogger
+from os import getenv
+from typing import Any, Iterable, NamedTuple
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.orm import Session, object_session
+from models import Player, Unit, UnitStatus, subscribe_changes
+
+logger = getLogger(__name__)
+
+PAGE_SIZE = int(getenv("SEARCH_PAGE_SIZE", 20))
+CACHE_SIZE = int(getenv("SEARCH_CACHE_SIZE", 64))
+
+Key = tuple[str, str, UnitStatus, int | None]
+Filters = tuple[str | None, str | None, UnitStatus | None, int | None]
+
+def matches(filters: Filters, key: Key) -> bool:
+    return all(value is None or value == part for value, part in zip(filters, key))
+
+class SearchPage(NamedTuple):
+    players: list[tuple[int, str]] # player id and name, ordered by name
+    page: int
+    pages: int
+    total: int
+    source: str # "index" or "database"
+
+def paginate(matches: list[tuple[int, str]], page: int, page_size: int, source: str) -> SearchPage:
+    pages = max(1, -(-len(matches) // page_size))
+    page = min(max(page, 0), pages - 1)
+    return SearchPage(matches[page * page_size:(page + 1) * page_size], page, pages, len(matches), source)
+
+def query(area_operation: str | None = None, unit_type: str | None = None, status: UnitStatus | None = None, campaign_id: int | None = None):
+    """
+    The database fallback, every player with a unit matching the filters that aren't None, ordered by name.
+    """
+    statement = select(Player.id, Player.name).join(Unit, Unit.player_id == Player.id).distinct().order_by(Player.name, Player.id)
+    for column, value in ((Unit.area_operation, area_operation), (Unit.unit_type, unit_type), (Unit.status, status), (Unit.campaign_id, campaign_id)):
+        if value is not None:
+            statement = statement.where(column == value)
+    return statement
+
+# built once, building and caching the statement again on every search cost more than running it
+ROWS = select(Player.id, Player.name, Unit.area_operation, Unit.unit_type, Unit.status, Unit.campaign_id).join(Unit, Unit.player_id == Player.id)
+CHANGED_ROWS = ROWS.where(Player.id.in_(bindparam("player_ids", expanding=True)))
+
+class SearchIndex:
+    """
+    An inverted index from unit keys to the players owning a unit under them.
+
+    Attributes:
+        enabled (bool): Whether searches use the index, or always go to the database.
+        ready (bool): Whether the index has been loaded.
+        stats (dict[str, int]): Searches answered from the index and from the database, and players reloaded.
+    """
+    def __init__(self, enabled: bool = True, cache_size: int = CACHE_SIZE):
+        if cache_size <= 0:
+            raise ValueError("cache_size must be greater than 0.")
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self.ready = False
+        self._postings: dict[Key, set[int]] = {}
+        self._keys: dict[int, set[Key]] = {} # player id to the keys of their units, to take a player out again
+        self._names: dict[int, str] = {}
+        self._parts: list[dict[Any, set[Key]]] = [{} for _ in range(4)] # every value of each part of a key, to the keys holding it
+        self._dirty: set[int] = set()
+        self._results: OrderedDict[Filters, list[tuple[str, int]]] = OrderedDict() # the matches of recent searches, by name and id
+        self._lock = threading.Lock() # changes are published by whichever thread committed them
+        self.stats = {"index": 0, "database": 0, "reloaded": 0}
+
+    def invalidate(self, player_ids: Iterable[int | None]):
+        with self._lock:
+            self._dirty.update(player_id for player_id in player_ids if player_id is not None)
+
+    def _take_dirty(self) -> set[int]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _post(self, key: Key, player_id: int):
+        if key not in self._postings:
+            self._postings[key] = set()
+            for part, value in zip(self._parts, key):
+                part.setdefault(value, set()).add(key)
+        self._postings[key].add(player_id)
+
+    def _unpost(self, key: Key, player_id: int):
+        postings = self._postings[key]
+        postings.discard(player_id)
+        if not postings:
+            del self._postings[key]
+            for part, value in zip(self._parts, key):
+                part[value].discard(key)
+                if not part[value]:
+                    del part[value]
+
+    def _add(self, rows: Iterable[tuple[Any, ...]]):
+        for player_id, name, area_operation, unit_type, status, campaign_id in rows:
+            key = (area_operation, unit_type, status, campaign_id)
+            self._post(key, player_id)
+            self._keys.setdefault(player_id, set()).add(key)
+            self._names[player_id] = name
+
+    def load(self, session: Session):
+        """
+        Loads the whole index, whatever it held before.
+        """
+        # the dirty set is taken before reading, so a change committed while the rows are read is reloaded by the next search
+        self._take_dirty()
+        rows = session.connection().execute(ROWS).all()
+        self._postings.clear()
+        for part in self._parts:
+            part.clear()
+        self._keys.clear()
+        self._names.clear()
+        self._results.clear()
+        self._add(rows)
+        self.ready = True
+        logger.info(f"Search index loaded, {len(self._names)} players under {len(self._postings)} keys")
+
+    def refresh(self, session: Session):
+        """
+        Reloads the players that changed since the last search, all of them with one query on the caller's session,
+        which like every `uses_db` session starts its transaction after the changes it is searching for committed.
+
+        Only the postings of the keys a player gained or lost are touched, and a cached search only changes if the
+        player started or stopped matching it, or was renamed.
+        """
+        if not self.ready:
+            self.load(session)
+            return
+        if not (dirty := self._take_dirty()):
+            return
+        names: dict[int, str | None] = dict.fromkeys(dirty)
+        current: dict[int, set[Key]] = {player_id: set() for player_id in dirty}
+        for player_id, name, *key in session.connection().execute(CHANGED_ROWS, {"player_ids": list(dirty)}).all():
+            names[player_id] = name
+            current[player_id].add(tuple(key))
+        for player_id, keys in current.items():
+            name = names[player_id]
+            old_keys, old_name = self._keys.get(player_id, set()), self._names.get(player_id)
+            if keys == old_keys and name == old_name:
+                continue
+            for key in old_keys - keys:
+                self._unpost(key, player_id)
+            for key in keys - old_keys:
+                self._post(key, player_id)
+            if keys:
+                self._keys[player_id], self._names[player_id] = keys, name
+            else:
+                self._keys.pop(player_id, None)
+                self._names.pop(player_id, None)
+            renamed = name != old_name
+            for filters, results in self._results.items():
+                matched = any(matches(filters, key) for key in old_keys)
+                matching = any(matches(filters, key) for key in keys)
+                if matched and (renamed or not matching):
+                    entry = (old_name or "", player_id)
+                    position = bisect_left(results, entry)
+                    if position < len(results) and results[position] == entry:
+                        del results[position]
+                if matching and (renamed or not matched):
+                    insort(results, (name or "", player_id))
+        self.stats["reloaded"] += len(dirty)
+        logger.debug(f"Reloaded {len(dirty)} players into the search index")
+
+    def _refreshed(self, session: Session) -> bool:
+        """
+        Brings the index up to date, returns False if it is disabled or couldn't be, and the database has to answer.
+        """
+        if not self.enabled:
+            return False
+        try:
+            self.refresh(session)
+        except Exception as e:
+            logger.error(f"Error refreshing the search index, searching the database instead: {e}")
+            self.ready = False # loaded again from scratch next time
+            return False
+        return True
+
+    def match(self, filters: Filters) -> list[tuple[str, int]]:
+        """
+        The name and id of every player matching the filters, ordered by name.
+        """
+        if filters in self._results:
+            self._results.move_to_end(filters)
+            return self._results[filters]
+        # only the keys holding every value searched for, starting from the rarest of those values
+        candidates = sorted((self._parts[index].get(value, set()) for index, value in enumerate(filters) if value is not None), key=len)
+        keys = candidates[0].intersection(*candidates[1:]) if candidates else self._postings.keys()
+        player_ids: set[int] = set()
+        for key in keys:
+            player_ids |= self._postings[key]
+        self._results[filters] = results = sorted((self._names[player_id] or "", player_id) for player_id in player_ids)
+        while len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return results
+
+    def search(self, session: Session, area_operation: str | None = None, unit_type: str | None = None, status: UnitStatus | None = None,
+               campaign_id: int | None = None, page: int = 0, page_size: int = PAGE_SIZE) -> SearchPage:
+        """
+        Finds the players with a unit matching every filter that isn't None, and returns one page of them.
+        """
+        if self._refreshed(session):
+            self.stats["index"] += 1
+            found = paginate(self.match((area_operation, unit_type, status, campaign_id)), page, page_size, "index")
+            return found._replace(players=[(player_id, name) for name, player_id in found.players])
+        self.stats["database"] += 1
+        matches = [tuple(row) for row in session.execute(query(area_operation, unit_type, status, campaign_id))]
+        return paginate(matches, page, page_size, "database")
+
+    def areas(self, session: Session) -> list[str]:
+        """
+        The areas of operation any unit is in, for the search menu.
+        """
+        if self._refreshed(session):
+            return sorted({key[0] for key in self._postings if key[0]})
+        return [area for area, in session.execute(select(Unit.area_operation).where(Unit.area_operation.is_not(None)).distinct().order_by(Unit.area_operation))]
+
+    def __len__(self):
+        return len(self._names)
+
+index = SearchIndex(enabled=getenv("SEARCH_INDEX", "true").lower() == "true")
+
+def _removed(mapper, connection, target):
+    # deletes have no render task, so they aren't published, note them in the session until it commits
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("search_removed", set()).add(target.id if isinstance(target, Player) else target.player_id)
+
+def _commit_removed(session: Session):
+    index.invalidate(session.info.pop("search_removed", ()))
+
+def _discard_removed(session: Session, *args):
+    session.info.pop("search_removed", None)
+
+subscribe_changes(index.invalidate)
+event.listen(Player, "after_delete", _removed)
+event.listen(Unit, "after_delete", _removed)
+event.listen(Session, "after_commit", _commit_removed)
+event.listen(Session, "after_rollback", _discard_removed)
@@ -41,4 +41,35 @@ Info logs: today: {today_INFO} total: {total_INFO}
 Warning logs: today: {today_WARNING} total: {total_WARNING}
 Error logs: today: {today_ERROR} total: {total_ERROR}
 Critical logs: today: {today_CRITICAL} total: {total_CRITICAL}
-Total logs: today: {today_total} total: {total_total}"""
\ No newline at end of file
+Total logs: today: {today_total} total: {total_total}
+Render queue: {queued}/{capacity} queued, {coalesced} coalesced, {deferred} deferred to the outbox, {retrying} waiting to retry, {workers} workers, {edits_avoided} unchanged edits skipped
+{lanes}
+{shards}
+Mentions: {direct} built from ids, users: {gateway} from the gateway, {hits} cache hits, {misses} cache misses, {cached} cached
+Player cache: {player_hits} hits, {player_misses} misses, {player_invalidations} invalidations, {players_cached} cached
+Search index: {searches_indexed} searches from the index, {searches_database} from the database, {search_reloaded} players reloaded, {search_players} indexed"""
+
+shard_stats_template = "Shard {shard}: {depth} queued, {processed} processed, {failed} failed, {restarts} restarts, {state}"
+
+lane_stats_template = "{lane} lane: {depth} queued, {served} served, {avg_wait:0.2f}s average wait, {max_wait:0.2f}s longest wait"
+
+metric_stats_template = """Render tasks:
+{counts}
+Timings (count, average, p95, max):
+{timings}"""
+
+metric_count_template = "{label}: {processed} processed, {failed} failed, {retried} retried, {dead_lettered} dead lettered, {dropped} dropped, {rate_limited} rate limited"
+
+metric_timing_template = "{label} {name}: {count}, {average:0.3f}s, {p95:0.3f}s, {max:0.3f}s"
+
+query_stats_template = """Queries per command (calls, average and most statements per call, time in the database, calls flagged as N+1):
+{commands}"""
+
+query_command_template = "{name}: {calls}, {average:0.1f}, {most}, {seconds:0.3f}s, {flagged}"
+
+query_shape_template = "  repeated: {shape}"
+
+dead_letters_template = """Dead letters: {total}
+{letters}"""
+
+dead_letter_template = "{id}: {kind} {model} {pk}, {attempts} attempts, failed <t:{failed_at}:R>: {error}"
\ No newline at end of file
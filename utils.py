@@ -2,10 +2,16 @@ import re
 import os
 from functools import lru_cache, wraps
 from inspect import Signature
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import scoped_session, Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from logging import getLogger
 import asyncio
 from collections import deque
+from concurrent.futures import Executor
+from contextvars import copy_context
+from functools import partial
+from metrics import registry
 from typing import Coroutine
 logger = getLogger(__name__)
 
@@ -50,7 +56,106 @@ def has_invalid_url(text: str) -> bool:
 class RollbackException(Exception):
     pass
 
+# the async driver to use for each database, when the URL doesn't name one
+ASYNC_DRIVERS = {"mysql": "aiomysql", "mariadb": "aiomysql", "sqlite": "aiosqlite"}
+
+def async_database_url(url: str) -> str:
+    """
+    Swaps the driver of a database URL for its asyncio counterpart, so the async engine can share `DATABASE_URL`.
+    """
+    url = make_url(url)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}").render_as_string(hide_password=False)
+
+class AwaitableSession:
+    """
+    Gives a synchronous Session the awaitable interface of an AsyncSession.
+
+    This is what lets cogs move to the async engine one at a time: a cog written against AsyncSession (`await
+    session.execute(select(...))`, `await session.commit()`) runs unchanged on the synchronous engine while
+    `DB_ASYNC` is off. Anything without an awaitable counterpart (`add`, `info`, ...) is passed straight through.
+
+    With an executor (`DB_OFFLOAD`), every awaitable call runs on one of its threads instead of the event loop, so a
+    slow query only holds up the coroutine waiting for it. The calls of one session are awaited one after the other,
+    so the session is never used by two threads at once.
+
+    Attributes:
+        sync_session (Session): The session doing the work.
+        executor (Executor | None): The thread pool the work is offloaded to, None to run it on the event loop.
+    """
+    def __init__(self, session: Session, executor: Executor | None = None):
+        self.sync_session = session
+        self.executor = executor
+
+    def __getattr__(self, name):
+        return getattr(self.sync_session, name)
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.executor is None:
+            return fn(*args, **kwargs)
+        context = copy_context() # keep the task label, so the queries are still attributed to the task running them
+        with registry.timer("offload"):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, fn, *args, **kwargs))
+
+    async def execute(self, *args, **kwargs):
+        return await self._call(self.sync_session.execute, *args, **kwargs)
+
+    async def scalar(self, *args, **kwargs):
+        return await self._call(self.sync_session.scalar, *args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return await self._call(self.sync_session.scalars, *args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._call(self.sync_session.get, *args, **kwargs)
+
+    async def delete(self, instance):
+        await self._call(self.sync_session.delete, instance)
+
+    async def merge(self, *args, **kwargs):
+        return await self._call(self.sync_session.merge, *args, **kwargs)
+
+    async def refresh(self, *args, **kwargs):
+        await self._call(self.sync_session.refresh, *args, **kwargs)
+
+    async def flush(self, *args, **kwargs):
+        await self._call(self.sync_session.flush, *args, **kwargs)
+
+    async def commit(self):
+        await self._call(self.sync_session.commit)
+
+    async def rollback(self):
+        await self._call(self.sync_session.rollback)
+
+    async def close(self):
+        await self._call(self.sync_session.close)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await self._call(fn, self.sync_session, *args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+class AwaitableSessionmaker:
+    """
+    Makes AwaitableSessions from a synchronous sessionmaker, the stand-in for an `async_sessionmaker` while `DB_ASYNC` is off.
+    """
+    def __init__(self, sessionmaker, executor: Executor | None = None):
+        self.sessionmaker = sessionmaker
+        self.executor = executor
+
+    def __call__(self) -> AwaitableSession:
+        return AwaitableSession(self.sessionmaker(), self.executor)
+
 def uses_db(sessionmaker):
+    """
+    Gives the decorated coroutine a session, committing it when the coroutine returns and rolling it back when it
+    raises. Every call is accounted in `metrics.registry.commands`, see `MetricsRegistry.account`.
+    """
+    if isinstance(sessionmaker, (async_sessionmaker, AwaitableSessionmaker)):
+        return _uses_async_db(sessionmaker)
     session_scope = scoped_session(sessionmaker)
     def decorator(func):
         logger.debug(f"decorating {func.__name__}")
@@ -58,13 +163,18 @@ def uses_db(sessionmaker):
         new_params = [param for name, param in original_signature.parameters.items() if name != "session"]
         new_signature = original_signature.replace(parameters=new_params)
         @wraps(func)
-        async def wrapper(*args, **kwargs): 
+        async def wrapper(*args, **kwargs):
+            if kwargs.get("session") is not None:
+                # the caller already owns a session and its transaction, so just join it
+                with registry.account(func.__qualname__):
+                    return await func(*args, **kwargs)
             with session_scope() as session: # we are not currently using async with, because the sessionmaker is not async yet
                 try:
                     logger.debug(f"calling {func.__name__}")
-                    result = await func(*args, session=session, **kwargs)
-                    logger.debug(f"commiting session for {func.__name__}")
-                    session.commit()
+                    with registry.account(func.__qualname__): # the commit flushes the changes, so it is accounted too
+                        result = await func(*args, session=session, **kwargs)
+                        logger.debug(f"commiting session for {func.__name__}")
+                        session.commit()
                     logger.debug(f"committed session for {func.__name__}")
                     return result
                 except RollbackException:
@@ -81,6 +191,39 @@ def uses_db(sessionmaker):
         return wrapper
     return decorator
 
+def _uses_async_db(sessionmaker):
+    """
+    The `uses_db` decorator for an async sessionmaker, every call gets a session of its own rather than a scoped one,
+    because an AsyncSession must not be shared between tasks.
+    """
+    def decorator(func):
+        logger.debug(f"decorating {func.__name__} for the async engine")
+        original_signature = Signature.from_callable(func)
+        new_params = [param for name, param in original_signature.parameters.items() if name != "session"]
+        new_signature = original_signature.replace(parameters=new_params)
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if kwargs.get("session") is not None:
+                with registry.account(func.__qualname__):
+                    return await func(*args, **kwargs)
+            async with sessionmaker() as session:
+                try:
+                    with registry.account(func.__qualname__):
+                        result = await func(*args, session=session, **kwargs)
+                        await session.commit()
+                    return result
+                except RollbackException:
+                    logger.debug(f"rolling back session for {func.__name__}")
+                    await session.rollback()
+                    return None
+                except Exception as e:
+                    logger.debug(f"rolling back session for {func.__name__} due to unhandled exception")
+                    await session.rollback()
+                    raise e
+        wrapper.__signature__ = new_signature
+        return wrapper
+    return decorator
+
 
 def string_to_list(string: str) -> list[str]:
     if "\n" in string[:40]: